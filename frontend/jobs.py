@@ -0,0 +1,336 @@
+import os
+import re
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import traceback
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from ms_package.startup import DATA_DIR
+from ms_package.result_store import ResultStore, STORE_DIR, file_digest, file_signature
+from tables import page_table, row_order
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+JOBS_DIR = os.path.join(DATA_DIR, 'jobs')
+JOB_DB = os.path.join(JOBS_DIR, 'jobs.sqlite')
+OBJECT_NAME = re.compile(r'^([0-9a-f]{64})\.[A-Za-z]+$')  # content addressed upload, see UploadStore.object_path
+RESULT_TABLES = ('values', 'hits', 'proteins')
+STAGES = ('spectrum values', 'peptide search', 'protein mapping')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    ms_file TEXT NOT NULL,
+    fasta_file TEXT NOT NULL,
+    owner TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key);
+"""
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """Opens a connection to the job table, which is shared by the web workers and the job processes."""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def process_id() -> str:
+    """Identifies the process queueing or running a job by host name and pid."""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def process_alive(owner: Optional[str]) -> bool:
+    """Checks if the process of a job is still running. Processes on other hosts are assumed to be running, jobs
+    without an owner were left by a previous version of the web app."""
+    if owner is None:
+        return False
+    host, pid = owner.rsplit(':', 1)
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def fail_dead_jobs(conn: sqlite3.Connection):
+    """Marks queued and running jobs whose process died as failed, inside the open transaction."""
+    rows = conn.execute("SELECT id, owner FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+    dead = [(time.time(), row['id']) for row in rows if not process_alive(row['owner'])]
+    conn.executemany("UPDATE jobs SET status = 'failed', error = 'interrupted', updated = ? WHERE id = ?", dead)
+    if dead:
+        logger.warning(f'Marked {len(dead)} interrupted jobs as failed')
+
+
+def update_job(db_path: str, job_id: str, **fields):
+    """Updates the given columns of a job."""
+    fields['updated'] = time.time()
+    columns = ', '.join(f'{column} = ?' for column in fields)
+    conn = connect(db_path)
+    try:
+        conn.execute(f'UPDATE jobs SET {columns} WHERE id = ?', (*fields.values(), job_id))
+    finally:
+        conn.close()
+
+
+def object_digest(path: str) -> Optional[str]:
+    """Content hash of an uploaded file taken from the name of its content addressed object, without reading the
+    file, None for files outside the upload store."""
+    match = OBJECT_NAME.match(os.path.basename(path))
+    if match is not None and os.path.basename(os.path.dirname(path)) == match.group(1)[:2]:
+        return match.group(1)
+    return None
+
+
+def content_digest(path: str) -> str:
+    """Content hash of a file, hashed only if it is not a content addressed upload."""
+    return object_digest(path) or file_digest(path)
+
+
+def upload_key(ms_file: str, fasta_file: str) -> str:
+    """Identifies an upload by the content hashes of its files, so the same files uploaded by several users map to
+    the same key. Submitting does not read the files: other files than uploads are identified by path, size and
+    modification time, their content is hashed by the job process, see run_analysis."""
+    return '|'.join(object_digest(path) or ':'.join(map(str, file_signature(path))) for path in (ms_file, fasta_file))
+
+
+def save_spectra(reader, values: pd.DataFrame, result_dir: str):
+    """Saves the total ion current chromatogram and the decoded spectra of an analysed file as numpy arrays, which
+    the plot endpoints memory map."""
+    spectra_dir = os.path.join(result_dir, 'spectra')
+    os.makedirs(spectra_dir, exist_ok=True)
+    rt = np.array([reader.scan_times.get(key) for key in values.index], dtype=np.float64)
+    tic = values['total_ion_current'].to_numpy(dtype=np.float64)
+    order = np.argsort(rt, kind='stable')
+    valid = ~np.isnan(rt[order]) & ~np.isnan(tic[order])
+    np.save(os.path.join(spectra_dir, 'tic_rt.npy'), rt[order][valid])
+    np.save(os.path.join(spectra_dir, 'tic.npy'), tic[order][valid])
+    if reader.spectrum_data is not None:
+        for name, array in zip(('keys', 'mz', 'intensity', 'offsets'), reader.get_spectrum_arrays()):
+            np.save(os.path.join(spectra_dir, f'{name}.npy'), array)
+
+
+def link_result(stored_dir: str, job_dir: str, name: str):
+    """Links a file or directory of a stored result into the result directory of a job."""
+    link = os.path.join(job_dir, name)
+    if not os.path.lexists(link):
+        os.symlink(os.path.abspath(os.path.join(stored_dir, name)), link)
+
+
+def run_analysis(db_path: str, result_dir: str, job_id: str, ms_file: str, fasta_file: str,
+                 store_dir: str = STORE_DIR):
+    """Runs the spectrum analysis, peptide search and protein mapping of a job in a worker process.
+
+    The result of every stage is kept in the shared result store, keyed by the content hashes of the files it
+    depends on, and linked into the job's result directory. A stage that another job (of any user or web worker)
+    already computed is reused, one that is being computed is waited for.
+    """
+    from ms_package.reader import Reader
+    from ms_package.peptide_prediction import PeptideSearch
+    from ms_package.protein_prediction import ProteinSearch
+
+    def analyse_spectra(path: str):
+        reader = Reader(ms_file)
+        values = reader.analyse_spectrum()
+        values.to_pickle(os.path.join(path, 'values.pkl'))
+        save_spectra(reader, values, path)
+
+    def search_peptides(path: str):
+        PeptideSearch(fasta_file, ms_file).peptide_wrapper()[0].to_pickle(os.path.join(path, 'hits.pkl'))
+
+    def map_proteins(path: str):
+        hits = pd.read_pickle(os.path.join(hits_dir, 'hits.pkl'))
+        pro_search = ProteinSearch(list(hits['Peptide hit sequence']))
+        pro_search.get_proteins()
+        pro_search.ans_df.to_pickle(os.path.join(path, 'proteins.pkl'))
+
+    job_dir = os.path.join(result_dir, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    try:
+        store = ResultStore(store_dir)
+        ms_digest, fasta_digest = content_digest(ms_file), content_digest(fasta_file)
+
+        update_job(db_path, job_id, status='running', stage=STAGES[0], progress=0.0, owner=process_id())
+        values_dir = store.compute(store.key(STAGES[0], ms_digest), analyse_spectra)
+        link_result(values_dir, job_dir, 'values.pkl')
+        link_result(values_dir, job_dir, 'spectra')
+
+        update_job(db_path, job_id, stage=STAGES[1], progress=1 / 3)
+        hits_dir = store.compute(store.key(STAGES[1], ms_digest, fasta_digest), search_peptides)
+        link_result(hits_dir, job_dir, 'hits.pkl')
+
+        update_job(db_path, job_id, stage=STAGES[2], progress=2 / 3)
+        proteins_dir = store.compute(store.key(STAGES[2], ms_digest, fasta_digest), map_proteins)
+        link_result(proteins_dir, job_dir, 'proteins.pkl')
+
+        update_job(db_path, job_id, status='finished', stage=None, progress=1.0)
+    except Exception as e:
+        logger.error(f'Job {job_id} failed: {traceback.format_exc()}')
+        update_job(db_path, job_id, status='failed', error=str(e))
+
+
+@lru_cache(maxsize=32)
+def load_result(result_dir: str, job_id: str, table: str) -> pd.DataFrame:
+    """Loads a result table once per web worker, the tables of a finished job do not change."""
+    return pd.read_pickle(os.path.join(result_dir, job_id, f'{table}.pkl'))
+
+
+@lru_cache(maxsize=64)
+def load_row_order(result_dir: str, job_id: str, table: str, sort: Optional[str], order: str, query: str,
+                   hidden: Tuple[str, ...]) -> np.ndarray:
+    """Filters and sorts a result table once per web worker and view, the pages of the view only slice the
+    returned row positions, see tables.row_order."""
+    return row_order(load_result(result_dir, job_id, table), sort, order, query, hidden)
+
+
+@lru_cache(maxsize=32)
+def load_spectra(result_dir: str, job_id: str) -> Dict[str, np.ndarray]:
+    """Memory maps the saved chromatogram and spectrum arrays of a finished job."""
+    spectra_dir = os.path.join(result_dir, job_id, 'spectra')
+    arrays = dict()
+    for name in ('tic_rt', 'tic', 'keys', 'mz', 'intensity', 'offsets'):
+        path = os.path.join(spectra_dir, f'{name}.npy')
+        if os.path.exists(path):
+            arrays[name] = np.load(path, mmap_mode='r')
+    return arrays
+
+
+class JobQueue:
+    """Runs analyses in a local pool of worker processes. Jobs are kept in a persistent SQLite table, so every web
+    worker can report their progress, and the result tables are cached per upload content in a result store shared
+    by all web workers."""
+
+    def __init__(self, db_path: str = JOB_DB, result_dir: str = JOBS_DIR, max_workers: int = 2,
+                 store_dir: str = STORE_DIR):
+        """
+        parameters:
+            db_path = file path of the job table
+            result_dir = directory in which the result tables of each job are linked
+            max_workers = number of analyses running at the same time
+            store_dir = directory of the result store shared by all jobs
+        """
+        self.db_path = db_path
+        self.result_dir = result_dir
+        self.store_dir = str(store_dir)
+        self.max_workers = max_workers
+        self._executor = None
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        os.makedirs(result_dir, exist_ok=True)
+        conn = connect(db_path)
+        try:
+            conn.executescript(SCHEMA)
+            if 'owner' not in {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}:
+                conn.execute('ALTER TABLE jobs ADD COLUMN owner TEXT')
+        finally:
+            conn.close()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """Worker pool, created on first use so importing the web app does not start processes."""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def submit(self, ms_file: str, fasta_file: str) -> str:
+        """Queues the analysis of an upload and returns right away. An upload with the same content that was
+        already analysed, or is still being analysed, by any user is not run again.
+
+        Parameters
+        ----------
+        ms_file: str
+            file path of the mzML/mzXML file
+        fasta_file: str
+            file path of the FASTA file
+
+        Returns
+        -------
+        job_id: str
+            id to poll the progress and fetch the results of the job
+        """
+        key = upload_key(ms_file, fasta_file)
+        conn = connect(self.db_path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            fail_dead_jobs(conn)  # a job of a crashed worker is submitted again instead of reused
+            row = conn.execute("SELECT id FROM jobs WHERE key = ? AND status != 'failed' ORDER BY created DESC",
+                               (key,)).fetchone()
+            if row is not None:
+                conn.execute('COMMIT')
+                logger.info(f'Reusing job {row["id"]} for {ms_file}')
+                return row['id']
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            conn.execute('INSERT INTO jobs (id, key, status, ms_file, fasta_file, owner, created, updated) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (job_id, key, 'queued', ms_file, fasta_file, process_id(), now, now))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+        self.executor.submit(run_analysis, self.db_path, self.result_dir, job_id, ms_file, fasta_file,
+                             self.store_dir)
+        logger.info(f'Submitted job {job_id} for {ms_file}')
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Returns the status, stage and progress of a job, or None if the job does not exist."""
+        conn = connect(self.db_path)
+        try:
+            row = conn.execute('SELECT id, status, stage, progress, error, created, updated FROM jobs WHERE id = ?',
+                               (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row is not None else None
+
+    def result(self, job_id: str, table: str) -> pd.DataFrame:
+        """Loads a result table ('values', 'hits' or 'proteins') of a finished job."""
+        if table not in RESULT_TABLES:
+            raise KeyError(f'Unknown result table: {table}')
+        return load_result(self.result_dir, job_id, table)
+
+    def page(self, job_id: str, table: str, page: int = 1, size: int = 50, sort: Optional[str] = None,
+             order: str = 'asc', query: str = '', hidden: Tuple[str, ...] = ()) -> Dict:
+        """Returns one page of a result table of a finished job, see tables.page_table. The filtered and sorted
+        row order of a view is cached, so only the first page of a view depends on the size of the table."""
+        df = self.result(job_id, table)
+        positions = load_row_order(self.result_dir, job_id, table, sort, order, query, tuple(hidden))
+        return page_table(df, page, size, sort, order, query, hidden, positions)
+
+    def spectra(self, job_id: str) -> Dict[str, np.ndarray]:
+        """Returns the saved chromatogram ('tic_rt', 'tic') and spectrum arrays ('keys', 'mz', 'intensity',
+        'offsets') of a finished job."""
+        return load_spectra(self.result_dir, job_id)
+
+    def recover(self):
+        """Marks jobs that were interrupted by a crashed web worker or a restart of the web app as failed, so they
+        can be submitted again. Jobs queued by a web worker are owned by it until a job process runs them, jobs of
+        processes that are still running are left alone, so every web worker can call this at startup."""
+        conn = connect(self.db_path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            fail_dead_jobs(conn)
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
@@ -1,42 +1,129 @@
 import os
+import uuid
 from typing import Tuple
 
-from werkzeug.utils import secure_filename
-from flask import Flask, flash, request, redirect, url_for, render_template, session
+import numpy as np
 
-from ms_package.startup import DATA_DIR
-from ms_package.reader import Reader
-from ms_package.peptide_prediction import PeptideSearch
-from ms_package.protein_prediction import ProteinSearch
+from werkzeug.utils import secure_filename
+from flask import Flask, flash, request, redirect, url_for, render_template, session, jsonify, abort
 
+from ms_package import startup
+from jobs import JobQueue
+from uploads import UploadStore, UPLOAD_FOLDER, file_kind
+from ms_package.downsample import minmax_downsample
 
-UPLOAD_FOLDER = os.path.join(DATA_DIR, 'uploads')
-ALLOWED_EXTENSIONS = {"mzml", "mzxml", "fasta"}
+startup.init()
 
 app = Flask(__name__)
 app.secret_key = "someSecretKey"
 
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_PATH'] = 16 * 1024 * 1024
 
+jobs = JobQueue(max_workers=int(os.environ.get('JOB_WORKERS', 2)))
+jobs.recover()  # in every WSGI worker, only jobs of dead processes are reset
+uploads = UploadStore(UPLOAD_FOLDER)
+
+
+def session_id() -> str:
+    if 'uid' not in session:
+        session['uid'] = uuid.uuid4().hex
+    return session['uid']
+
 
 @app.route("/", methods=['GET', 'POST'])
 def home():
     if request.method == 'POST':  # User choosing file type
         file_type = request.form['file_type']
         import_message, import_check = toggle_file_type(file_type)
-        if import_check:  # Both File(s) imported
-            rel_vals = get_values(session['ms_files'])
-            hits, peptide_hits = get_peptide_hits(session['fasta_file'], session['ms_files'])
-            prtns = get_proteins(hits)
-            return render_template('template.html', values=rel_vals, hits=peptide_hits, protein=prtns, import_msg=import_message)
+        if import_check:  # Both File(s) imported, the analysis runs in the background
+            job_id = jobs.submit(session['ms_files'], session['fasta_file'])
+            session['job_id'] = job_id
+            return render_template('template.html', job_id=job_id, import_msg=import_message)
         else:
             return render_template('template.html', import_msg=import_message)
 
     return render_template('template.html')
 
 
+@app.route("/jobs", methods=['POST'])
+def submit_job():
+    if 'ms_files' not in session or 'fasta_file' not in session:
+        return jsonify(error="No files imported."), 400
+    job_id = jobs.submit(session['ms_files'], session['fasta_file'])
+    session['job_id'] = job_id
+    return jsonify(job_id=job_id, status_url=url_for('job_status', job_id=job_id)), 202
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job)
+
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    if job['status'] != 'finished':
+        return render_template('template.html', job_id=job_id)
+    return render_template('template.html', result_id=job_id)
+
+
+@app.route("/jobs/<job_id>/tables/<table>")
+def job_table(job_id, table):
+    job = jobs.get(job_id)
+    if job is None or job['status'] != 'finished':
+        abort(404)
+    try:
+        page = jobs.page(job_id, table,
+                         page=request.args.get('page', 1, type=int),
+                         size=request.args.get('size', 50, type=int),
+                         sort=request.args.get('sort'),
+                         order=request.args.get('order', 'asc'),
+                         query=request.args.get('q', ''),
+                         hidden=('Sequence',) if table == 'proteins' else ())
+    except KeyError:
+        abort(404)
+    return jsonify(page)
+
+
+def finished_spectra(job_id):
+    job = jobs.get(job_id)
+    if job is None or job['status'] != 'finished':
+        abort(404)
+    return jobs.spectra(job_id)
+
+
+def plot_trace(x, y):
+    width = max(1, min(request.args.get('width', 800, type=int), 10000))
+    x, y = minmax_downsample(x, y, width, request.args.get('min', type=float), request.args.get('max', type=float))
+    return jsonify(x=x.tolist(), y=y.tolist())
+
+
+@app.route("/jobs/<job_id>/plots/tic")
+def plot_tic(job_id):
+    arrays = finished_spectra(job_id)
+    if 'tic' not in arrays:
+        abort(404)
+    return plot_trace(arrays['tic_rt'], arrays['tic'])
+
+
+@app.route("/jobs/<job_id>/plots/spectrum/<int:spectrum_id>")
+def plot_spectrum(job_id, spectrum_id):
+    arrays = finished_spectra(job_id)
+    if 'keys' not in arrays:
+        abort(404)
+    i = int(np.searchsorted(arrays['keys'], spectrum_id))
+    if i == len(arrays['keys']) or arrays['keys'][i] != spectrum_id:
+        abort(404)
+    start, end = arrays['offsets'][i], arrays['offsets'][i + 1]
+    return plot_trace(arrays['mz'][start:end], arrays['intensity'][start:end])
+
+
 @app.route("/upload")
 def upload():
     return render_template('upload.html')
@@ -48,8 +135,7 @@ def homepage():
 
 
 def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return file_kind(filename) is not None
 
 
 @app.route('/uploader', methods=['GET', 'POST'])
@@ -69,75 +155,73 @@ def upload_file():
                     return redirect(request.url)
                 if file and allowed_file(file.filename):
                     filename = secure_filename(file.filename)
-                    file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+                    path = uploads.save_stream(file.stream, filename)
+                    uploads.add_to_session(session_id(), filename, path)
             if check_uploads():
                 return render_template('template.html', success_msg="File(s) uploaded successfully!")
             else:
                 return render_template('upload.html', success_msg="Please upload the other file!")
             return redirect(url_for('home'))
         elif request.form['button'] == "Clear Contents":
-            files = os.listdir(UPLOAD_FOLDER)
-            for file in files:
-                os.remove(os.path.join(UPLOAD_FOLDER, file))
+            uploads.clear_session(session_id())
             return render_template('upload.html', success_msg="Uploaded files successfully removed!")
         return redirect(url_for('home'))
 
 
-def toggle_file_type(file_type: str) -> Tuple[str, bool]:
-    ext = ".mzML" if file_type == "mzml" else ".mzxml"
-    ms_files = [
-        os.path.join(app.config['UPLOAD_FOLDER'], f)
-        for f in os.listdir(app.config['UPLOAD_FOLDER'])
-        if f.endswith(ext)
-    ]
-    fasta_file = [
-        os.path.join(app.config['UPLOAD_FOLDER'], f)
-        for f in os.listdir(app.config['UPLOAD_FOLDER'])
-        if f.endswith(".fasta")
-    ]
-    if len(ms_files) == 0 and len(fasta_file) == 0:
-        return "No files uploaded. Please upload files.", False
+@app.route('/uploads', methods=['POST'])
+def start_chunked_upload():
+    filename = secure_filename((request.get_json(silent=True) or {}).get('filename', ''))
+    if not allowed_file(filename):
+        return jsonify(error="Only mzML, mzXML and FASTA files can be uploaded."), 400
+    upload_id = uploads.start(filename)
+    return jsonify(upload_id=upload_id, offset=0), 201
 
-    elif file_type == "mzml" and len(ms_files) != 1:
-        return "Error importing mzml file. Please clear uploaded contents and upload a single mzml file.", False
 
-    elif file_type == "mzxml" and len(ms_files) != 1:
-        return "Error importing mzxml file. Please clear uploaded contents and upload a single mzxml file.", False
+@app.route('/uploads/<upload_id>', methods=['GET', 'PUT'])
+def chunked_upload(upload_id):
+    try:
+        if request.method == 'PUT':
+            offset = uploads.append(upload_id, int(request.args.get('offset', 0)), request.stream)
+        else:
+            offset = uploads.offset(upload_id)
+    except KeyError:
+        abort(404)
+    return jsonify(upload_id=upload_id, offset=offset)
 
-    else:
-        session['file_type'] = file_type
-        session['ms_files'] = ms_files[0]
-        session['fasta_file'] = fasta_file[0]
-        return "File(s) imported successfully!", True
 
+@app.route('/uploads/<upload_id>/finish', methods=['POST'])
+def finish_chunked_upload(upload_id):
+    try:
+        upload = uploads.finish(upload_id)
+    except (KeyError, FileNotFoundError):
+        abort(404)
+    uploads.add_to_session(session_id(), upload['name'], upload['path'])
+    return jsonify(name=upload['name'], complete=check_uploads())
 
-def check_uploads():
-    n_files = len(os.listdir(app.config['UPLOAD_FOLDER']))
-    return True if n_files == 2 else False
 
+def toggle_file_type(file_type: str) -> Tuple[str, bool]:
+    files = uploads.session_files(session_id())
+    ms_file = files.get('ms')
+    fasta_file = files.get('fasta')
+    if ms_file is None and fasta_file is None:
+        return "No files uploaded. Please upload files.", False
 
-def get_values(file):
-    relevant_values = Reader(file)
-    values = relevant_values.analyse_spectrum()
-    rel_vals = values.to_html(header="true", table_id="table", index=False, justify="justify-all")
-    return rel_vals
+    elif ms_file is None or file_kind(ms_file['name']) != file_type:
+        return f"Error importing {file_type} file. Please upload a single {file_type} file.", False
 
+    elif fasta_file is None:
+        return "Error importing fasta file. Please upload a fasta file.", False
 
-def get_peptide_hits(fasta_file, ms_file):
-    peptides = PeptideSearch(fasta_file, ms_file)
-    hits = peptides.peptide_wrapper()[0]
-    peptide_hits = hits.to_html(header="true", table_id="table", index=False)
-    return hits, peptide_hits
+    else:
+        session['file_type'] = file_type
+        session['ms_files'] = ms_file['path']
+        session['fasta_file'] = fasta_file['path']
+        return "File(s) imported successfully!", True
 
 
-def get_proteins(hits):
-    peptide_list = hits['Peptide hit sequence']
-    pro_search = ProteinSearch(peptide_list)
-    pro_search.get_proteins()
-    ans_with_seq = pro_search.ans_df
-    ans_without_seq = ans_with_seq.drop('Sequence', axis=1)
-    proteins = ans_without_seq.to_html(header="true", table_id="table", index=False)
-    return proteins
+def check_uploads():
+    files = uploads.session_files(session_id())
+    return 'ms' in files and 'fasta' in files
 
 
 if __name__ == '__main__':
@@ -146,4 +230,4 @@ if __name__ == '__main__':
         port = flask_port
     else:
         port = 5000
-    app.run(debug=True, host='0.0.0.0', port=port)
+    app.run(debug=True, host='0.0.0.0', port=port, threaded=True)
@@ -0,0 +1,98 @@
+import json
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+MAX_PAGE_SIZE = 500
+
+
+def filter_mask(df: pd.DataFrame, query: str) -> np.ndarray:
+    """Marks the rows in which any column contains the query, ignoring case."""
+    mask = np.zeros(len(df), dtype=bool)
+    for column in df.columns:
+        mask |= df[column].astype(str).str.contains(query, case=False, regex=False, na=False).to_numpy()
+    return mask
+
+
+def filter_table(df: pd.DataFrame, query: str) -> pd.DataFrame:
+    """Keeps the rows in which any column contains the query, ignoring case."""
+    if not query:
+        return df
+    return df[filter_mask(df, query)]
+
+
+def row_order(df: pd.DataFrame, sort: Optional[str] = None, order: str = 'asc', query: str = '',
+              hidden: Sequence[str] = ()) -> np.ndarray:
+    """Positions of the rows of a table that match the query, in the order of the sort column.
+
+    This is the part of a page request that depends on the size of the table, so it can be computed once per
+    view of a table and sliced by every page of the view, see page_table.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        result table
+    sort, order, query:
+        see page_table
+    hidden: Sequence[str]
+        columns that are not shown, and therefore neither searched nor sorted by
+
+    Returns
+    -------
+    positions: np.ndarray
+        row positions of the filtered and sorted table
+    """
+    view = df.drop(columns=list(hidden), errors='ignore') if hidden else df
+    positions = np.arange(len(df))
+    if query:
+        positions = positions[filter_mask(view, query)]
+    if sort in view.columns:
+        values = view[sort].iloc[positions].reset_index(drop=True)
+        values = values.sort_values(ascending=order != 'desc', kind='stable', na_position='last')
+        positions = positions[values.index.to_numpy()]
+    return positions
+
+
+def page_table(df: pd.DataFrame, page: int = 1, size: int = 50, sort: Optional[str] = None, order: str = 'asc',
+               query: str = '', hidden: Sequence[str] = (), positions: Optional[np.ndarray] = None) -> Dict:
+    """Filters, sorts and slices one page out of a result table.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        result table
+    page: int
+        1-based page number
+    size: int
+        number of rows per page, at most MAX_PAGE_SIZE
+    sort: str
+        column to sort by, the table order is kept if None
+    order: str
+        'asc' or 'desc'
+    query: str
+        text that one of the columns of a row has to contain
+    hidden: Sequence[str]
+        columns left out of the page
+    positions: np.ndarray
+        the filtered and sorted row positions of the view as returned by row_order, computed if None
+
+    Returns
+    -------
+    page: Dict
+        json serialisable dict with the columns, the rows of the page and the number of rows
+    """
+    size = max(1, min(size, MAX_PAGE_SIZE))
+    if positions is None:
+        positions = row_order(df, sort, order, query, hidden)
+    columns = [column for column in df.columns if column not in hidden]
+    pages = max(1, -(-len(positions) // size))
+    page = max(1, min(page, pages))
+    rows = df.iloc[positions[(page - 1) * size:page * size]][columns]
+    return {'columns': [str(column) for column in columns],
+            'rows': json.loads(rows.to_json(orient='values')),
+            'page': page,
+            'pages': pages,
+            'size': size,
+            'total': len(df),
+            'filtered': len(positions)}
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the frontend modules import each other by module name, as when run.py is started from this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
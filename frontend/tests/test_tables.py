@@ -0,0 +1,50 @@
+"""Result table paging tests."""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import jobs
+from jobs import JobQueue
+from tables import page_table, row_order
+
+
+def make_table():
+    return pd.DataFrame({'Peptide': ['AAAK', 'CCCK', 'DDDK', 'EEEK', 'FFFK'],
+                         'score': [0.5, np.nan, 0.9, 0.1, 0.9],
+                         'Sequence': ['MAAAK', 'MCCCK', 'MDDDK', 'MEEEK', 'MFFFK']}, index=[3, 3, 1, 0, 2])
+
+
+class TestTables:
+    """A test class which checks filtering, sorting and paging of result tables."""
+
+    def test_row_order(self):
+        """Tests that rows are filtered and sorted by position, with missing values last."""
+        df = make_table()
+        assert row_order(df).tolist() == [0, 1, 2, 3, 4]
+        assert row_order(df, sort='score', order='desc').tolist() == [2, 4, 0, 3, 1]
+        assert row_order(df, sort='score', query='k').tolist() == [3, 0, 2, 4, 1]
+        assert row_order(df, query='mddd').tolist() == [2]
+        assert row_order(df, query='mddd', hidden=['Sequence']).tolist() == []
+
+    def test_page_table(self):
+        """Tests that a page slices the row order and leaves out hidden columns."""
+        page = page_table(make_table(), page=2, size=2, sort='score', hidden=['Sequence'])
+        assert page['columns'] == ['Peptide', 'score']
+        assert page['rows'] == [['DDDK', 0.9], ['FFFK', 0.9]]
+        assert (page['page'], page['pages'], page['total'], page['filtered']) == (2, 3, 5, 5)
+
+    def test_cached_row_order(self, tmp_path):
+        """Tests that further pages of a view do not filter and sort the table again."""
+        queue = JobQueue(db_path=str(tmp_path / 'jobs.sqlite'), result_dir=str(tmp_path / 'results'),
+                         store_dir=str(tmp_path / 'store'))
+        os.makedirs(tmp_path / 'results' / 'job')
+        make_table().to_pickle(str(tmp_path / 'results' / 'job' / 'proteins.pkl'))
+        jobs.load_row_order.cache_clear()
+
+        first = queue.page('job', 'proteins', page=1, size=2, sort='score', order='desc', hidden=('Sequence',))
+        second = queue.page('job', 'proteins', page=2, size=2, sort='score', order='desc', hidden=('Sequence',))
+        info = jobs.load_row_order.cache_info()
+        assert (info.misses, info.hits) == (1, 1)
+        assert [row[0] for row in first['rows'] + second['rows']] == ['DDDK', 'FFFK', 'AAAK', 'EEEK']
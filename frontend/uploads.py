@@ -0,0 +1,182 @@
+import os
+import json
+import uuid
+import fcntl
+import hashlib
+import logging
+from typing import BinaryIO, Dict, Optional
+
+from ms_package.startup import DATA_DIR
+from ms_package.result_store import file_lock
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+UPLOAD_FOLDER = os.path.join(DATA_DIR, 'uploads')
+CHUNK_SIZE = 1024 * 1024
+# file extensions as expected by the Reader and PeptideSearch classes
+EXTENSIONS = {'mzml': '.mzML', 'mzxml': '.mzXML', 'fasta': '.fasta'}
+
+
+def file_kind(filename: str) -> Optional[str]:
+    """Returns 'mzml', 'mzxml' or 'fasta' for allowed file names, otherwise None."""
+    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    return ext if ext in EXTENSIONS else None
+
+
+class UploadStore:
+    """Stores uploaded files by the SHA-256 hash of their content, so identical uploads are stored once and map to
+    the same path (and therefore to the same cached analysis). Each browser session has its own manifest of
+    uploaded files, so users do not overwrite each other's files.
+
+    Large files are uploaded in chunks which are appended to a part file. An interrupted upload is resumed
+    from the size of its part file.
+    """
+
+    def __init__(self, root: str = UPLOAD_FOLDER):
+        """
+        parameters:
+            root = directory containing the content addressed objects, part files and session manifests
+        """
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self.parts_dir = os.path.join(root, 'parts')
+        self.sessions_dir = os.path.join(root, 'sessions')
+        for directory in (self.objects_dir, self.parts_dir, self.sessions_dir):
+            os.makedirs(directory, exist_ok=True)
+
+    def object_path(self, digest: str, kind: str) -> str:
+        """Returns the path of the stored object with the given content hash."""
+        return os.path.join(self.objects_dir, digest[:2], digest + EXTENSIONS[kind])
+
+    def _store(self, tmp_path: str, digest: str, kind: str) -> str:
+        """Moves a completely written temporary file to its content addressed path."""
+        path = self.object_path(digest, kind)
+        if os.path.exists(path):
+            os.remove(tmp_path)  # duplicate upload, keep the existing object and its mtime
+            logger.info(f'Upload {digest} already stored')
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return path
+
+    def save_stream(self, stream: BinaryIO, filename: str) -> str:
+        """Streams a file to disk in chunks while hashing it.
+
+        Parameters
+        ----------
+        stream: BinaryIO
+            file-like object of the upload
+        filename: str
+            original file name, used to determine the file type
+
+        Returns
+        -------
+        path: str
+            content addressed path of the stored file
+        """
+        kind = file_kind(filename)
+        tmp_path = os.path.join(self.parts_dir, uuid.uuid4().hex)
+        sha = hashlib.sha256()
+        with open(tmp_path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                sha.update(chunk)
+                f.write(chunk)
+        return self._store(tmp_path, sha.hexdigest(), kind)
+
+    def _part_paths(self, upload_id: str):
+        if not upload_id.isalnum():
+            raise KeyError(upload_id)
+        part = os.path.join(self.parts_dir, upload_id)
+        return part, part + '.json'
+
+    def start(self, filename: str) -> str:
+        """Starts a chunked upload and returns its id."""
+        upload_id = uuid.uuid4().hex
+        part, meta = self._part_paths(upload_id)
+        open(part, 'wb').close()
+        with open(meta, 'w') as f:
+            json.dump({'filename': filename}, f)
+        return upload_id
+
+    def offset(self, upload_id: str) -> int:
+        """Returns the number of bytes received so far, from which an interrupted upload is resumed."""
+        part, meta = self._part_paths(upload_id)
+        if not os.path.exists(meta):
+            raise KeyError(upload_id)
+        return os.path.getsize(part)
+
+    def append(self, upload_id: str, offset: int, stream: BinaryIO) -> int:
+        """Appends a chunk to a part file. Chunks that do not start at the current end of the part file are
+        ignored, so the client can resume from the returned offset. The part file is locked from the offset check
+        to the end of the write, so concurrent requests with the same offset (e.g. a retry racing a slow request)
+        append the chunk only once.
+
+        Returns
+        -------
+        offset: int
+            number of bytes received so far
+        """
+        self.offset(upload_id)  # raises KeyError for unknown uploads
+        part, _ = self._part_paths(upload_id)
+        with open(part, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                return current
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                f.write(chunk)
+            f.flush()
+            return os.fstat(f.fileno()).st_size
+
+    def finish(self, upload_id: str) -> Dict[str, str]:
+        """Completes a chunked upload by moving it to its content addressed path.
+
+        Returns
+        -------
+        upload: Dict[str, str]
+            original file name and stored path
+        """
+        part, meta = self._part_paths(upload_id)
+        with open(meta) as f:
+            filename = json.load(f)['filename']
+        sha = hashlib.sha256()
+        with open(part, 'rb') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)  # wait for a chunk still being appended
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha.update(chunk)
+            path = self._store(part, sha.hexdigest(), file_kind(filename))
+        os.remove(meta)
+        return {'name': filename, 'path': path}
+
+    def _manifest_path(self, session_id: str) -> str:
+        if not session_id.isalnum():
+            raise KeyError(session_id)
+        return os.path.join(self.sessions_dir, session_id + '.json')
+
+    def session_files(self, session_id: str) -> Dict[str, Dict[str, str]]:
+        """Returns the files uploaded in a session, keyed by 'ms' and 'fasta'."""
+        try:
+            with open(self._manifest_path(session_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return dict()
+
+    def add_to_session(self, session_id: str, filename: str, path: str):
+        """Adds an uploaded file to the session, replacing a previous file of the same kind. The manifest is locked
+        while it is updated, so concurrent requests of a session do not lose each other's files."""
+        manifest = self._manifest_path(session_id)
+        with file_lock(manifest + '.lock'):
+            files = self.session_files(session_id)
+            files['fasta' if file_kind(filename) == 'fasta' else 'ms'] = {'name': filename, 'path': path}
+            tmp_path = f'{manifest}.{uuid.uuid4().hex}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(files, f)
+            os.replace(tmp_path, manifest)
+
+    def clear_session(self, session_id: str):
+        """Removes the uploaded files from the session. The stored objects are kept for other sessions."""
+        try:
+            os.remove(self._manifest_path(session_id))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1 @@
+"""Synthetic mzML/mzXML runs and timed benchmarks of the reader, peptide search and protein mapping."""
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import platform
+import subprocess
+import multiprocessing
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence
+
+from ms_package.startup import DATA_DIR
+from ms_package.profiling import peak_rss_mb
+from ms_package.benchmarks.synthetic import write_run
+
+BENCHMARK_DIR = DATA_DIR.joinpath('benchmarks')
+SCALES = (1_000, 100_000, 1_000_000)
+# benchmarks of the binary arrays and the peptide search need mzML
+FORMAT_BENCHMARKS = {'mzml': ('parse', 'decode', 'summary', 'search', 'proteins'),
+                     'mzxml': ('parse', 'summary')}
+
+
+def bench_parse(run_path: str, fasta_path: str, peptides: List[str]) -> Dict:
+    """Parsing the file into a DOM and collecting the spectra."""
+    from ms_package.reader import Reader
+    reader = Reader(run_path)
+    start = time.perf_counter()
+    spectrum_dict = reader.get_spectrum_dict(reader.get_spectrum_list(reader.parse_file()))
+    return {'seconds': time.perf_counter() - start, 'spectra': len(spectrum_dict)}
+
+
+def bench_decode(run_path: str, fasta_path: str, peptides: List[str]) -> Dict:
+    """Extracting, decoding and decompressing the binary arrays of a parsed mzML file."""
+    from ms_package.reader import Reader
+    reader = Reader(run_path)
+    spectrum_dict = reader.get_spectrum_dict(reader.get_spectrum_list(reader.parse_file()))
+    start = time.perf_counter()
+    reader.get_compression(spectrum_dict)
+    reader.get_binary_spectrum_values(spectrum_dict)
+    reader.decode_decompress()
+    seconds = time.perf_counter() - start
+    _, mz, intensity, _ = reader.get_spectrum_arrays()
+    return {'seconds': seconds, 'spectra': len(spectrum_dict), 'peaks': len(mz),
+            'bytes_decoded': int(mz.nbytes + intensity.nbytes)}
+
+
+def bench_summary(run_path: str, fasta_path: str, peptides: List[str]) -> Dict:
+    """Extracting the summary values and retention times of a parsed file."""
+    from ms_package.reader import Reader
+    reader = Reader(run_path)
+    spectrum_dict = reader.get_spectrum_dict(reader.get_spectrum_list(reader.parse_file()))
+    start = time.perf_counter()
+    reader.get_values(spectrum_dict)
+    reader.get_scan_times(spectrum_dict)
+    return {'seconds': time.perf_counter() - start, 'spectra': len(spectrum_dict)}
+
+
+def bench_search(run_path: str, fasta_path: str, peptides: List[str]) -> Dict:
+    """Peptide search of the run against the synthetic proteome."""
+    from ms_package.peptide_prediction import PeptideSearch
+    start = time.perf_counter()
+    peptide_df, peptide_list = PeptideSearch(fasta_path=fasta_path, mzml_path=run_path).peptide_wrapper()
+    return {'seconds': time.perf_counter() - start, 'hits': len(peptide_list)}
+
+
+def bench_proteins(run_path: str, fasta_path: str, peptides: List[str]) -> Dict:
+    """Offline protein mapping of the peptides of the run against the synthetic proteome."""
+    from ms_package.protein_prediction import ProteinSearch
+    pro_search = ProteinSearch(peptides, fasta_path=fasta_path)
+    start = time.perf_counter()
+    pro_search.get_proteins()
+    return {'seconds': time.perf_counter() - start, 'peptides': len(peptides), 'matches': len(pro_search.ans_df)}
+
+
+BENCHMARKS = {'parse': bench_parse, 'decode': bench_decode, 'summary': bench_summary, 'search': bench_search,
+              'proteins': bench_proteins}
+
+
+def run_benchmark(name: str, run_path: str, fasta_path: str, peptides: List[str]) -> Dict:
+    """Runs one benchmark and adds the memory used on top of the imports. Called in a fresh process."""
+    import ms_package.reader  # noqa: F401
+    import ms_package.peptide_prediction  # noqa: F401
+    import ms_package.protein_prediction  # noqa: F401
+    baseline = peak_rss_mb()
+    result = BENCHMARKS[name](run_path, fasta_path, peptides)
+    peak = peak_rss_mb()
+    result.update(peak_rss_mb=round(peak, 1), rss_increase_mb=round(peak - baseline, 1))
+    return result
+
+
+def measure(name: str, run_path: str, fasta_path: str, peptides: List[str]) -> Dict:
+    """Runs a benchmark in a new interpreter, so its peak memory is not hidden by an earlier benchmark."""
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(run_benchmark, (name, run_path, fasta_path, peptides))
+
+
+def git_commit() -> Optional[str]:
+    """Commit of the working tree the benchmarks ran on, None outside of a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__), capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(scales: Sequence[int] = SCALES, benchmarks: Optional[Sequence[str]] = None,
+              formats: Sequence[str] = ('mzml', 'mzxml'), peaks: int = 100, precision: int = 64,
+              compression: bool = True, ms_levels: Sequence[int] = (1, 2), indexed: bool = True, seed: int = 0,
+              data_dir: Optional[str] = None, echo=print) -> Dict:
+    """Generates synthetic runs at every scale and times the benchmarks on them.
+
+    Parameters
+    ----------
+    scales: Sequence[int]
+        numbers of spectra of the synthetic runs
+    benchmarks: Sequence[str]
+        names of the benchmarks to run, all of BENCHMARKS if None
+    formats: Sequence[str]
+        'mzml' and/or 'mzxml'
+    peaks, precision, compression, ms_levels, indexed, seed:
+        parameters of the synthetic runs, see synthetic.write_mzml
+    data_dir: str
+        directory of the generated runs, which are reused by later calls
+    echo: callable
+        called with a line of text after every benchmark
+
+    Returns
+    -------
+    report: dict
+        environment, run parameters and one result per benchmark, format and scale
+    """
+    data_dir = str(data_dir or BENCHMARK_DIR.joinpath('data'))
+    config = {'peaks': peaks, 'precision': precision, 'compression': compression, 'ms_levels': list(ms_levels),
+              'indexed': indexed, 'seed': seed}
+    report = {'created': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': git_commit(),
+              'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+              'config': config, 'results': list()}
+    for file_format in formats:
+        for spectra in scales:
+            run_path, fasta_path, peptides = write_run(data_dir, spectra, file_format, peaks=peaks,
+                                                       precision=precision, compression=compression,
+                                                       ms_levels=ms_levels, indexed=indexed, seed=seed)
+            ms2 = sum(1 for i in range(spectra) if ms_levels[i % len(ms_levels)] > 1)
+            run_peptides = [peptides[i % len(peptides)] for i in range(ms2)]
+            for name in FORMAT_BENCHMARKS[file_format]:
+                if benchmarks is not None and name not in benchmarks:
+                    continue
+                result = measure(name, run_path, fasta_path, run_peptides)
+                result.update(benchmark=name, format=file_format, scale=spectra,
+                              file_mb=round(os.path.getsize(run_path) / 1024 ** 2, 1),
+                              spectra_per_second=round(spectra / result['seconds'], 1) if result['seconds'] else None)
+                report['results'].append(result)
+                echo(f"{name:<9}{file_format:<7}{spectra:>10} spectra {result['seconds']:>10.3f} s "
+                     f"{result['peak_rss_mb']:>9.1f} MiB peak")
+    return report
+
+
+def save_report(report: Dict, path: Optional[str] = None) -> str:
+    """Saves a report as JSON, by default named after its commit and creation time in BENCHMARK_DIR."""
+    if path is None:
+        stamp = report['created'].replace(':', '').replace('-', '')
+        path = str(BENCHMARK_DIR.joinpath(f"results-{stamp}-{(report['commit'] or 'nogit')[:8]}.json"))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def compare_reports(old: Dict, new: Dict) -> List[Dict]:
+    """Matches the results of two reports by benchmark, format and scale.
+
+    Returns
+    -------
+    rows: List[dict]
+        old and new seconds and peak memory, and the ratio new / old of the seconds
+    """
+    old_results = {(r['benchmark'], r['format'], r['scale']): r for r in old['results']}
+    rows = list()
+    for result in new['results']:
+        before = old_results.get((result['benchmark'], result['format'], result['scale']))
+        if before is None:
+            continue
+        rows.append({'benchmark': result['benchmark'], 'format': result['format'], 'scale': result['scale'],
+                     'old_seconds': before['seconds'], 'new_seconds': result['seconds'],
+                     'ratio': result['seconds'] / before['seconds'] if before['seconds'] else None,
+                     'old_peak_rss_mb': before['peak_rss_mb'], 'new_peak_rss_mb': result['peak_rss_mb']})
+    return rows
@@ -0,0 +1,438 @@
+import os
+import zlib
+import base64
+import hashlib
+import logging
+from typing import BinaryIO, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+# monoisotopic residue masses
+RESIDUE_MASS = {'G': 57.02146, 'A': 71.03711, 'S': 87.03203, 'P': 97.05276, 'V': 99.06841, 'T': 101.04768,
+                'C': 103.00919, 'L': 113.08406, 'I': 113.08406, 'N': 114.04293, 'D': 115.02694, 'Q': 128.05858,
+                'K': 128.09496, 'E': 129.04259, 'M': 131.04049, 'H': 137.05891, 'F': 147.06841, 'R': 156.10111,
+                'Y': 163.06333, 'W': 186.07931}
+WATER = 18.010565
+PROTON = 1.007276
+ISOTOPE_SPACING = 1.0033548
+AVERAGINE_LAMBDA = 0.000594  # mean number of heavy isotopes per Da, for Poisson isotope patterns
+ELUTION_WIDTH = 10.0  # standard deviation of the elution peaks in seconds
+
+MZML_HEADER = """<?xml version="1.0" encoding="utf-8"?>
+{open_indexed}<mzML xmlns="http://psi.hupo.org/ms/mzml" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" \
+xsi:schemaLocation="http://psi.hupo.org/ms/mzml http://psidev.info/files/ms/mzML/xsd/mzML1.1.0.xsd" \
+id="synthetic" version="1.1.0">
+  <cvList count="2">
+    <cv id="MS" fullName="Proteomics Standards Initiative Mass Spectrometry Ontology" version="4.1.0" \
+URI="https://raw.githubusercontent.com/HUPO-PSI/psi-ms-CV/master/psi-ms.obo"/>
+    <cv id="UO" fullName="Unit Ontology" version="releases/2020-03-10" \
+URI="http://ontologies.berkeleybop.org/uo.obo"/>
+  </cvList>
+  <fileDescription>
+    <fileContent>
+      <cvParam cvRef="MS" accession="MS:1000579" name="MS1 spectrum" value=""/>
+      <cvParam cvRef="MS" accession="MS:1000580" name="MSn spectrum" value=""/>
+    </fileContent>
+  </fileDescription>
+  <softwareList count="1">
+    <software id="ms_package" version="0.1.0">
+      <cvParam cvRef="MS" accession="MS:1000799" name="custom unreleased software tool" value="ms_package"/>
+    </software>
+  </softwareList>
+  <instrumentConfigurationList count="1">
+    <instrumentConfiguration id="IC1">
+      <cvParam cvRef="MS" accession="MS:1000031" name="instrument model" value=""/>
+    </instrumentConfiguration>
+  </instrumentConfigurationList>
+  <dataProcessingList count="1">
+    <dataProcessing id="synthetic_processing">
+      <processingMethod order="0" softwareRef="ms_package">
+        <cvParam cvRef="MS" accession="MS:1000544" name="Conversion to mzML" value=""/>
+      </processingMethod>
+    </dataProcessing>
+  </dataProcessingList>
+  <run id="synthetic_run" defaultInstrumentConfigurationRef="IC1">
+    <spectrumList count="{count}" defaultDataProcessingRef="synthetic_processing">
+"""
+
+MZML_SPECTRUM = """      <spectrum index="{index}" id="scan={scan}" defaultArrayLength="{length}">
+        <cvParam cvRef="MS" accession="MS:1000511" name="ms level" value="{ms_level}"/>
+        {spectrum_type}
+        <cvParam cvRef="MS" accession="MS:1000130" name="positive scan" value=""/>
+        <cvParam cvRef="MS" accession="MS:1000127" name="centroid spectrum" value=""/>
+        <userParam name="base peak m/z" value="{base_peak_mz!r}" type="xsd:double"/>
+        <userParam name="base peak intensity" value="{base_peak_intensity!r}" type="xsd:double"/>
+        <userParam name="total ion current" value="{tic!r}" type="xsd:double"/>
+        <userParam name="lowest observed m/z" value="{low_mz!r}" type="xsd:double"/>
+        <userParam name="highest observed m/z" value="{high_mz!r}" type="xsd:double"/>
+        <scanList count="1">
+          <cvParam cvRef="MS" accession="MS:1000795" name="no combination" value=""/>
+          <scan>
+            <cvParam cvRef="MS" accession="MS:1000016" name="scan start time" value="{rt!r}" \
+unitCvRef="UO" unitAccession="UO:0000010" unitName="second"/>
+          </scan>
+        </scanList>
+{precursor}        <binaryDataArrayList count="2">
+          <binaryDataArray encodedLength="{mz_length}">
+            {data_type}
+            {compression}
+            <cvParam cvRef="MS" accession="MS:1000514" name="m/z array" value="" unitCvRef="MS" \
+unitAccession="MS:1000040" unitName="m/z"/>
+            <binary>{mz}</binary>
+          </binaryDataArray>
+          <binaryDataArray encodedLength="{intensity_length}">
+            {data_type}
+            {compression}
+            <cvParam cvRef="MS" accession="MS:1000515" name="intensity array" value="" unitCvRef="MS" \
+unitAccession="MS:1000131" unitName="number of detector counts"/>
+            <binary>{intensity}</binary>
+          </binaryDataArray>
+        </binaryDataArrayList>
+      </spectrum>
+"""
+
+MZML_PRECURSOR = """        <precursorList count="1">
+          <precursor>
+            <selectedIonList count="1">
+              <selectedIon>
+                <cvParam cvRef="MS" accession="MS:1000744" name="selected ion m/z" value="{mz!r}" \
+unitCvRef="MS" unitAccession="MS:1000040" unitName="m/z"/>
+                <cvParam cvRef="MS" accession="MS:1000041" name="charge state" value="{charge}"/>
+              </selectedIon>
+            </selectedIonList>
+            <activation>
+              <cvParam cvRef="MS" accession="MS:1000133" name="collision-induced dissociation" value=""/>
+            </activation>
+          </precursor>
+        </precursorList>
+"""
+
+MZXML_HEADER = """<?xml version="1.0" encoding="ISO-8859-1"?>
+<mzXML xmlns="http://sashimi.sourceforge.net/schema_revision/mzXML_3.2" \
+xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://sashimi.sourceforge.net/\
+schema_revision/mzXML_3.2 http://sashimi.sourceforge.net/schema_revision/mzXML_3.2/mzXML_idx_3.2.xsd">
+  <msRun scanCount="{count}" startTime="PT0S" endTime="PT{end_time!r}S">
+    <parentFile fileName="synthetic" fileType="RAWData" fileSha1="0000000000000000000000000000000000000000"/>
+    <dataProcessing centroided="1">
+      <software type="conversion" name="ms_package" version="0.1.0"/>
+    </dataProcessing>
+"""
+
+MZXML_SCAN = """    <scan num="{scan}" msLevel="{ms_level}" peaksCount="{length}" polarity="+" centroided="1" \
+retentionTime="PT{rt!r}S" lowMz="{low_mz!r}" highMz="{high_mz!r}" basePeakMz="{base_peak_mz!r}" \
+basePeakIntensity="{base_peak_intensity!r}" totIonCurrent="{tic!r}">
+{precursor}      <peaks compressionType="{compression}" compressedLen="{compressed_length}" precision="{precision}" \
+byteOrder="network" contentType="m/z-int">{peaks}</peaks>
+    </scan>
+"""
+
+
+class HashingWriter:
+    """Writes to a binary file, keeping track of the SHA-1 checksum of everything written."""
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.sha1 = hashlib.sha1()
+
+    def write(self, text: str):
+        data = text.encode()
+        self.sha1.update(data)
+        self.f.write(data)
+
+    def tell(self) -> int:
+        return self.f.tell()
+
+
+def synthetic_proteins(count: int = 50, length: int = 400, seed: int = 0) -> List[str]:
+    """Generates random protein sequences with residues drawn uniformly from the 20 amino acids."""
+    rng = np.random.default_rng(seed)
+    letters = np.array(list(AMINO_ACIDS))
+    return [''.join(letters[rng.integers(0, len(letters), length)]) for _ in range(count)]
+
+
+def tryptic_peptides(proteins: Sequence[str], min_length: int = 7, max_length: int = 20) -> List[str]:
+    """Digests the proteins after every K and R not followed by P and returns the unique peptides in order."""
+    peptides = dict()
+    for protein in proteins:
+        start = 0
+        for i, aa in enumerate(protein):
+            if aa in 'KR' and (i + 1 == len(protein) or protein[i + 1] != 'P') or i + 1 == len(protein):
+                peptide = protein[start:i + 1]
+                if min_length <= len(peptide) <= max_length:
+                    peptides[peptide] = None
+                start = i + 1
+    return list(peptides)
+
+
+def peptide_mass(peptide: str) -> float:
+    """Monoisotopic mass of an unmodified peptide."""
+    return sum(RESIDUE_MASS[aa] for aa in peptide) + WATER
+
+
+def fragment_mz(peptide: str) -> np.ndarray:
+    """m/z values of the singly charged b and y ions of a peptide."""
+    masses = np.array([RESIDUE_MASS[aa] for aa in peptide])
+    b = np.cumsum(masses)[:-1] + PROTON
+    y = np.cumsum(masses[::-1])[:-1] + WATER + PROTON
+    return np.concatenate([b, y])
+
+
+def peptide_features(peptides: Sequence[str], duration: float, isotopes: int):
+    """Elution time, abundance, charge and isotope peaks of every peptide of a proteome.
+
+    The features only depend on the peptides, so runs of the same proteome share them.
+
+    Returns
+    -------
+    elution: np.ndarray
+        apex retention time in seconds
+    abundance: np.ndarray
+        intensity of the most intense isotope peak at the apex
+    charge: np.ndarray
+        charge state, 2 or 3
+    mz, pattern: np.ndarray
+        m/z and relative intensity of the first isotopes peaks of every peptide
+    """
+    digest = hashlib.sha1('\n'.join(peptides).encode()).digest()
+    rng = np.random.default_rng(int.from_bytes(digest[:8], 'little'))
+    elution = rng.uniform(0.0, duration, len(peptides))
+    abundance = 10 ** rng.uniform(5.0, 7.0, len(peptides))
+    charge = rng.integers(2, 4, len(peptides))
+    masses = np.array([peptide_mass(peptide) for peptide in peptides])
+    k = np.arange(isotopes)
+    lam = masses[:, None] * AVERAGINE_LAMBDA
+    pattern = np.exp(k * np.log(lam) - lam - np.cumsum(np.log(np.maximum(k, 1))))
+    pattern /= pattern.max(axis=1, keepdims=True)
+    mz = (masses[:, None] + charge[:, None] * PROTON + k * ISOTOPE_SPACING) / charge[:, None]
+    return elution, abundance, charge, mz, pattern
+
+
+def write_fasta(path: str, proteins: Sequence[str]):
+    """Writes the proteins in UniProt FASTA format with accessions SYN00001, SYN00002, ..."""
+    with open(path, 'w') as f:
+        for i, protein in enumerate(proteins, 1):
+            f.write(f'>sp|SYN{i:05d}|SYN{i}_SYNTH Synthetic protein {i} OS=Synthetic OX=32630 PE=1 SV=1\n')
+            for start in range(0, len(protein), 60):
+                f.write(protein[start:start + 60] + '\n')
+
+
+def generate_spectra(count: int, peaks: int = 100, ms_levels: Sequence[int] = (1, 2),
+                     peptides: Optional[Sequence[str]] = None, seed: int = 0, isotopes: int = 0,
+                     rt_scale: float = 1.0, rt_offset: float = 0.0):
+    """Yields the spectra of a synthetic LC-MS/MS run, deterministic for a given seed.
+
+    The run cycles through ms_levels, e.g. one MS1 survey scan followed by an MS2 scan for (1, 2). MS2 spectra
+    contain the b and y ions of a peptide drawn from peptides, filled up with noise peaks. With isotopes, MS1
+    spectra also contain the first isotopes peaks of the peptides eluting at their retention time, see
+    peptide_features; the noise peaks and MS2 spectra stay the same. The peptides elute at
+    elution * rt_scale + rt_offset, to simulate runs whose retention times need to be aligned.
+
+    Yields
+    -------
+    spectrum: dict
+        scan number, ms level, retention time in seconds, sorted m/z and intensity arrays and, for MS2
+        spectra, the precursor m/z, charge, intensity and peptide
+    """
+    rng = np.random.default_rng(seed)
+    if isotopes and peptides:
+        elution, abundance, _, feature_mz, pattern = peptide_features(peptides, count * 0.5, isotopes)
+        elution = elution * rt_scale + rt_offset
+    for index in range(count):
+        ms_level = ms_levels[index % len(ms_levels)]
+        spectrum = {'index': index, 'scan': index + 1, 'ms_level': ms_level, 'rt': round(index * 0.5, 3),
+                    'precursor': None}
+        if ms_level > 1 and peptides:
+            peptide = peptides[rng.integers(len(peptides))]
+            charge = 2
+            fragments = fragment_mz(peptide)[:peaks]
+            noise = rng.uniform(100.0, 2000.0, peaks - len(fragments))
+            mz = np.concatenate([fragments, noise])
+            intensity = np.concatenate([rng.uniform(1e4, 1e5, len(fragments)), rng.uniform(1e2, 1e3, len(noise))])
+            spectrum['precursor'] = {'mz': (peptide_mass(peptide) + charge * PROTON) / charge, 'charge': charge,
+                                     'intensity': float(intensity.sum()), 'peptide': peptide}
+        else:
+            mz = rng.uniform(200.0, 2000.0, peaks)
+            intensity = rng.exponential(1e4, peaks)
+            if isotopes and peptides:
+                profile = np.exp(-0.5 * ((spectrum['rt'] - elution) / ELUTION_WIDTH) ** 2)
+                eluting = np.flatnonzero(profile > 1e-3)
+                mz = np.concatenate([mz, feature_mz[eluting].ravel()])
+                intensity = np.concatenate([intensity, (abundance[eluting, None] * profile[eluting, None] *
+                                                        pattern[eluting]).ravel()])
+        order = np.argsort(mz)
+        spectrum['mz'] = mz[order]
+        spectrum['intensity'] = intensity[order]
+        yield spectrum
+
+
+def summary(spectrum: dict, precision: int) -> dict:
+    """Base peak, total ion current and m/z range of a spectrum, computed from the stored precision."""
+    dtype = np.float32 if precision == 32 else np.float64
+    mz = spectrum['mz'].astype(dtype).astype(np.float64)
+    intensity = spectrum['intensity'].astype(dtype).astype(np.float64)
+    if len(mz) == 0:
+        return {'base_peak_mz': 0.0, 'base_peak_intensity': 0.0, 'tic': 0.0, 'low_mz': 0.0, 'high_mz': 0.0}
+    top = int(np.argmax(intensity))
+    return {'base_peak_mz': float(mz[top]), 'base_peak_intensity': float(intensity[top]),
+            'tic': float(intensity.sum()), 'low_mz': float(mz[0]), 'high_mz': float(mz[-1])}
+
+
+def encode_array(values: np.ndarray, dtype: str, compress: bool) -> str:
+    """Encodes an array as base64 of the (zlib compressed) raw bytes."""
+    data = np.ascontiguousarray(values, dtype=dtype).tobytes()
+    if compress:
+        data = zlib.compress(data)
+    return base64.standard_b64encode(data).decode('ascii')
+
+
+def write_mzml(path: str, spectra: int = 1000, peaks: int = 100, precision: int = 64, compression: bool = True,
+               ms_levels: Sequence[int] = (1, 2), indexed: bool = True, peptides: Optional[Sequence[str]] = None,
+               seed: int = 0, isotopes: int = 0, rt_scale: float = 1.0, rt_offset: float = 0.0):
+    """Writes a synthetic run as mzML, one spectrum at a time, so runs of millions of spectra fit in memory.
+
+    Parameters
+    ----------
+    path: str
+        output file, should end with .mzML
+    spectra: int
+        number of spectra
+    peaks: int
+        number of peaks per spectrum
+    precision: int
+        32 or 64 bit floats for the binary arrays
+    compression: bool
+        zlib compress the binary arrays
+    ms_levels: Sequence[int]
+        ms levels of one acquisition cycle
+    indexed: bool
+        wrap the file in indexedmzML with a spectrum offset index and checksum
+    peptides: Sequence[str]
+        peptides to generate MS2 spectra of, see tryptic_peptides
+    seed: int
+        seed of the random number generator
+    isotopes: int
+        number of isotope peaks of the peptides in the MS1 spectra, none if 0
+    rt_scale, rt_offset: float
+        retention time distortion of the peptides in the MS1 spectra, see generate_spectra
+    """
+    if precision not in (32, 64):
+        raise ValueError('precision must be 32 or 64')
+    dtype = '<f4' if precision == 32 else '<f8'
+    data_type = (f'<cvParam cvRef="MS" accession="MS:100052{1 if precision == 32 else 3}" '
+                 f'name="{precision}-bit float" value=""/>')
+    compression_param = ('<cvParam cvRef="MS" accession="MS:1000574" name="zlib compression" value=""/>'
+                         if compression else
+                         '<cvParam cvRef="MS" accession="MS:1000576" name="no compression" value=""/>')
+    offsets = list()
+    with open(path, 'wb') as f:
+        out = HashingWriter(f)
+        out.write(MZML_HEADER.format(count=spectra, open_indexed=(
+            '<indexedmzML xmlns="http://psi.hupo.org/ms/mzml" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            'xsi:schemaLocation="http://psi.hupo.org/ms/mzml '
+            'http://psidev.info/files/ms/mzML/xsd/mzML1.1.2_idx.xsd">\n' if indexed else '')))
+        for spectrum in generate_spectra(spectra, peaks, ms_levels, peptides, seed, isotopes, rt_scale, rt_offset):
+            offsets.append((spectrum['scan'], out.tell() + len('      ')))
+            mz = encode_array(spectrum['mz'], dtype, compression)
+            intensity = encode_array(spectrum['intensity'], dtype, compression)
+            precursor = spectrum['precursor']
+            out.write(MZML_SPECTRUM.format(
+                index=spectrum['index'], scan=spectrum['scan'], length=len(spectrum['mz']),
+                ms_level=spectrum['ms_level'], rt=spectrum['rt'],
+                spectrum_type=(
+                    '<cvParam cvRef="MS" accession="MS:1000579" name="MS1 spectrum" value=""/>'
+                    if spectrum['ms_level'] == 1 else
+                    '<cvParam cvRef="MS" accession="MS:1000580" name="MSn spectrum" value=""/>'),
+                precursor=MZML_PRECURSOR.format(**precursor) if precursor else '',
+                data_type=data_type, compression=compression_param,
+                mz=mz, mz_length=len(mz), intensity=intensity, intensity_length=len(intensity),
+                **summary(spectrum, precision)))
+        out.write('    </spectrumList>\n  </run>\n</mzML>\n')
+        if indexed:
+            index_offset = out.tell()
+            out.write('<indexList count="1">\n  <index name="spectrum">\n')
+            for scan, offset in offsets:
+                out.write(f'    <offset idRef="scan={scan}">{offset}</offset>\n')
+            out.write(f'  </index>\n</indexList>\n<indexListOffset>{index_offset}</indexListOffset>\n'
+                      f'<fileChecksum>')
+            f.write(f'{out.sha1.hexdigest()}</fileChecksum>\n</indexedmzML>\n'.encode())
+    logger.info(f'Wrote {spectra} synthetic spectra to {path}')
+
+
+def write_mzxml(path: str, spectra: int = 1000, peaks: int = 100, precision: int = 32, compression: bool = True,
+                ms_levels: Sequence[int] = (1, 2), indexed: bool = True, peptides: Optional[Sequence[str]] = None,
+                seed: int = 0, isotopes: int = 0, rt_scale: float = 1.0, rt_offset: float = 0.0):
+    """Writes a synthetic run as mzXML, see write_mzml for the parameters. Peaks are stored as interleaved
+    m/z-intensity pairs in network byte order."""
+    if precision not in (32, 64):
+        raise ValueError('precision must be 32 or 64')
+    dtype = '>f4' if precision == 32 else '>f8'
+    offsets = list()
+    with open(path, 'wb') as f:
+        out = HashingWriter(f)
+        out.write(MZXML_HEADER.format(count=spectra, end_time=round(max(spectra - 1, 0) * 0.5, 3)))
+        for spectrum in generate_spectra(spectra, peaks, ms_levels, peptides, seed, isotopes, rt_scale, rt_offset):
+            offsets.append((spectrum['scan'], out.tell() + len('    ')))
+            pairs = np.empty(2 * len(spectrum['mz']), dtype=np.float64)
+            pairs[0::2] = spectrum['mz']
+            pairs[1::2] = spectrum['intensity']
+            data = np.ascontiguousarray(pairs, dtype=dtype).tobytes()
+            if compression:
+                data = zlib.compress(data)
+            precursor = spectrum['precursor']
+            out.write(MZXML_SCAN.format(
+                scan=spectrum['scan'], ms_level=spectrum['ms_level'], length=len(spectrum['mz']), rt=spectrum['rt'],
+                precursor=(f'      <precursorMz precursorIntensity="{precursor["intensity"]!r}" '
+                           f'precursorCharge="{precursor["charge"]}" activationMethod="CID">'
+                           f'{precursor["mz"]!r}</precursorMz>\n' if precursor else ''),
+                compression='zlib' if compression else 'none', compressed_length=len(data) if compression else 0,
+                precision=precision, peaks=base64.standard_b64encode(data).decode('ascii'),
+                **summary(spectrum, precision)))
+        out.write('  </msRun>\n')
+        if indexed:
+            index_offset = out.tell()
+            out.write('  <index name="scan">\n')
+            for scan, offset in offsets:
+                out.write(f'    <offset id="{scan}">{offset}</offset>\n')
+            out.write(f'  </index>\n  <indexOffset>{index_offset}</indexOffset>\n  <sha1>')
+            f.write(f'{out.sha1.hexdigest()}</sha1>\n'.encode())
+        f.write(b'</mzXML>\n')
+    logger.info(f'Wrote {spectra} synthetic scans to {path}')
+
+
+def write_run(directory: str, spectra: int, file_format: str = 'mzml', peaks: int = 100, precision: int = 64,
+              compression: bool = True, ms_levels: Sequence[int] = (1, 2), indexed: bool = True, proteins: int = 50,
+              seed: int = 0, isotopes: int = 0) -> Tuple[str, str, List[str]]:
+    """Writes a synthetic run and the FASTA file of its proteins into directory, unless they already exist.
+    See write_mzml for the parameters.
+
+    Returns
+    -------
+    run_path: str
+        mzML or mzXML file
+    fasta_path: str
+        FASTA file of the proteins the MS2 spectra were generated from
+    peptides: List[str]
+        tryptic peptides of the proteins
+    """
+    os.makedirs(directory, exist_ok=True)
+    protein_list = synthetic_proteins(proteins, seed=seed)
+    peptides = tryptic_peptides(protein_list)
+    fasta_path = os.path.join(directory, f'synthetic_{proteins}_{seed}.fasta')
+    if not os.path.exists(fasta_path):
+        write_fasta(fasta_path, protein_list)
+
+    extension = {'mzml': 'mzML', 'mzxml': 'mzXML'}[file_format]
+    name = (f'synthetic_{spectra}_{peaks}p_{precision}bit_{"zlib" if compression else "raw"}_'
+            f'ms{"".join(map(str, ms_levels))}_{"idx" if indexed else "noidx"}_{proteins}_{seed}'
+            f'{f"_iso{isotopes}" if isotopes else ""}.{extension}')
+    run_path = os.path.join(directory, name)
+    if not os.path.exists(run_path):
+        writer = write_mzml if file_format == 'mzml' else write_mzxml
+        writer(run_path + '.tmp', spectra=spectra, peaks=peaks, precision=precision, compression=compression,
+               ms_levels=ms_levels, indexed=indexed, peptides=peptides, seed=seed, isotopes=isotopes)
+        os.replace(run_path + '.tmp', run_path)
+    return run_path, fasta_path, peptides
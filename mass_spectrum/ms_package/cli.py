@@ -1,8 +1,12 @@
+import os
+import sys
+import time
+import subprocess
+
 import click
-import ms_package.startup
-from ms_package.reader import Reader
-from ms_package.peptide_prediction import PeptideSearch
-from ms_package.protein_prediction import ProteinSearch
+from ms_package import startup
+from ms_package import daemon
+from ms_package.profiling import profiler
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,9 +14,26 @@ logger.setLevel(logging.DEBUG)
 
 
 @click.group()
-def main():
+@click.option('--profile', default=False, is_flag=True,
+              help='Print the time spent in each stage, counters and peak memory to STDERR.')
+@click.option('--trace', default=None, help='Save the profile as Chrome trace JSON to this file (implies --profile).')
+@click.pass_context
+def main(ctx: click.Context, profile: bool, trace: str):
     """Entry method"""
-    pass
+    # The heavy modules (pyopenms, pandas, requests) are imported by the commands that need them,
+    # so --help and the commands that do not use them start fast.
+    startup.init()
+    if profile or trace:
+        profiler.enable()
+        ctx.call_on_close(lambda: report_profile(trace))
+
+
+def report_profile(trace: str):
+    """Prints the profile of the command and saves the trace."""
+    click.echo(profiler.format_summary(), err=True)
+    if trace:
+        profiler.save(trace)
+        click.echo(f'Trace saved to {trace}', err=True)
 
 
 @main.command()
@@ -20,20 +41,28 @@ def main():
 @click.option('-v', '--verbose', default=False, is_flag=True, help="When used, will print the paths to STDOUT.")
 def get_spectrum_values(path: str, verbose: bool = False):
     """Generates dataframe consisting of the spectrum values from the input mzml/mzxml file."""
-    reader = Reader(path=path)
-    data = reader.analyse_spectrum()
+    data = daemon.run('spectrum_values', path=os.path.abspath(path))
     if verbose:
         click.echo(data)
 
 
+def fasta_paths(fasta_path: str, extra_fasta: tuple):
+    """The FASTA file argument, or a list of it and the further FASTA files of a command."""
+    if not extra_fasta:
+        return os.path.abspath(fasta_path)
+    return [os.path.abspath(path) for path in (fasta_path,) + tuple(extra_fasta)]
+
+
 @main.command()
 @click.argument('fasta_path')
 @click.argument('mzml_path')
+@click.option('-e', '--extra-fasta', multiple=True,
+              help='Further FASTA file searched together with FASTA_PATH, e.g. contaminants. Can be repeated.')
 @click.option('-v', '--verbose', default=False, is_flag=True, help='When used, will print to STDOUT.')
-def peptide_info(fasta_path: str, mzml_path: str, verbose: bool = False):
+def peptide_info(fasta_path: str, mzml_path: str, extra_fasta: tuple, verbose: bool = False):
     """Generates dataframe consisting of peptide properties and list of peptide hit sequences"""
-    search = PeptideSearch(fasta_path=fasta_path, mzml_path=mzml_path)
-    info = search.peptide_wrapper()[0]
+    info = daemon.run('peptide_info', fasta_path=fasta_paths(fasta_path, extra_fasta),
+                      mzml_path=os.path.abspath(mzml_path))[0]
     if verbose:
         click.echo(info)
 
@@ -41,11 +70,14 @@ def peptide_info(fasta_path: str, mzml_path: str, verbose: bool = False):
 @main.command()
 @click.option('-f', '--fasta', default=None, help='FASTA file of protein, submitted along MZML file')
 @click.option('-m', '--mzml', default=None, help='MZML file containing spectrum information, submitted along FASTA file')
-@click.option('-p', '--peptide', default=None, help='List of peptides to map to proteins')
+@click.option('-p', '--peptide', default=None, help='Comma or space separated list of peptides to map to proteins')
+@click.option('-d', '--database', default=None,
+              help='Local FASTA file to map the peptides offline instead of calling The Proteins API')
 @click.option('-v', '--verbose', default=False, is_flag=True, help='When used, prints table to STDOUT.')
 @click.option('-s', '--sequence', default=False, is_flag=True, help='Option to print protein sequence.')
 @click.option('-o', '--output', default=None, help='File path to save protein information')
-def protein_info(fasta: str, mzml: str, peptide: list,  output: str, verbose: bool = False, sequence: bool = False):
+def protein_info(fasta: str, mzml: str, peptide: str, database: str, output: str, verbose: bool = False,
+                 sequence: bool = False):
     """Generates dataframe of peptide mapping to get proteins.
     """
     info = None
@@ -55,20 +87,19 @@ def protein_info(fasta: str, mzml: str, peptide: list,  output: str, verbose: bo
     if peptide and (fasta and mzml):
         raise ImportError("Please load either a Peptide list OR a FASTA and MZML file, not all 3!")
 
+    if database:
+        database = os.path.abspath(database)
+
     if fasta and mzml:
-        pep_search = PeptideSearch(fasta_path=fasta, mzml_path=mzml)
-        info = pep_search.peptide_wrapper()[0]
-        peptide_list = pep_search.peptide_wrapper()[1]
-        pro_search = ProteinSearch(peptide_list)
-        pro_search.get_proteins()
-        ans_with_seq = pro_search.ans_df
+        info, peptide_list = daemon.run('peptide_info', fasta_path=os.path.abspath(fasta),
+                                        mzml_path=os.path.abspath(mzml))
+        ans_with_seq = daemon.run('protein_info', peptides=peptide_list, database=database)
         ans_without_seq = ans_with_seq.drop('Sequence', axis=1)
 
     if peptide:
-        pro_search = ProteinSearch(peptide)
-        pro_search.get_proteins()
-        ans_with_seq = pro_search.ans_df
-        ans_without_seq = pro_search.ans_df.drop('Sequence', axis=1)
+        # one string on the command line, which would otherwise be mapped character by character
+        ans_with_seq = daemon.run('protein_info', peptides=peptide.replace(',', ' ').split(), database=database)
+        ans_without_seq = ans_with_seq.drop('Sequence', axis=1)
 
     if verbose:
         if info is not None:
@@ -86,5 +117,323 @@ def protein_info(fasta: str, mzml: str, peptide: list,  output: str, verbose: bo
                 ans_without_seq.to_csv(output, index=False)
 
 
+@main.command()
+@click.argument('path')
+@click.option('-i', '--interval', default=2.0, show_default=True, help='Seconds between two reads of the file.')
+@click.option('-t', '--idle-timeout', default=None, type=float,
+              help='Stop after this many seconds without new spectra, by default only at the end of the run.')
+@click.option('-c', '--checkpoint', default=None, help='JSON file keeping the read position between runs.')
+@click.option('-o', '--output', default=None, help='CSV file the summary rows are appended to.')
+def follow(path: str, interval: float, idle_timeout: float, checkpoint: str, output: str):
+    """Prints the spectrum values of an mzML file that is still being written as new spectra arrive."""
+    from ms_package.follow import SpectrumFollower
+
+    follower = SpectrumFollower(path, checkpoint_path=checkpoint, decode=False)
+    header = True
+    for df_values, _ in follower.follow(interval=interval, idle_timeout=idle_timeout):
+        click.echo(df_values.to_string(header=header))
+        if output:
+            df_values.to_csv(output, mode='a', header=not os.path.exists(output), index=False)
+        header = False
+
+
+@main.command()
+@click.argument('fasta_path')
+@click.argument('mzml_path')
+@click.option('-e', '--extra-fasta', multiple=True,
+              help='Further FASTA file searched together with FASTA_PATH, e.g. contaminants. Can be repeated.')
+@click.option('-d', '--database', default=None,
+              help='Local FASTA file to map the peptides offline instead of calling The Proteins API')
+@click.option('-w', '--workers', default=None, type=int, help='Number of peptide search processes.')
+@click.option('--shard-size', default=500, show_default=True, help='Number of spectra searched together.')
+@click.option('--work-dir', default=None,
+              help='Directory of the checkpoints, kept in a subdirectory derived from the inputs.')
+@click.option('--no-resume', default=False, is_flag=True, help='Discard the checkpoints of an earlier run.')
+@click.option('-c', '--cluster', default=False, is_flag=True,
+              help='Search one consensus spectrum per cluster of repeated MS2 spectra.')
+@click.option('-v', '--verbose', default=False, is_flag=True, help='When used, prints tables to STDOUT.')
+@click.option('-s', '--sequence', default=False, is_flag=True, help='Option to print protein sequence.')
+@click.option('-o', '--output', default=None, help='File path to save protein information')
+def run_pipeline(fasta_path: str, mzml_path: str, extra_fasta: tuple, database: str, workers: int, shard_size: int,
+                 work_dir: str, no_resume: bool, cluster: bool, output: str, verbose: bool = False,
+                 sequence: bool = False):
+    """Runs peptide search and protein mapping as a streaming pipeline over shards of the mzML file.
+    The stages run concurrently and are checkpointed per shard, so an interrupted run resumes where it stopped."""
+    from ms_package.pipeline import run_pipeline as pipeline
+
+    info, ans_with_seq = pipeline(fasta_paths(fasta_path, extra_fasta), os.path.abspath(mzml_path),
+                                  database=os.path.abspath(database) if database else None, work_dir=work_dir,
+                                  shard_size=shard_size, workers=workers, resume=not no_resume, cluster=cluster)
+    ans = ans_with_seq if sequence else ans_with_seq.drop('Sequence', axis=1)
+    if verbose:
+        click.echo(info)
+        click.echo(ans)
+    if output:
+        ans.to_csv(output, index=False)
+
+
+@main.command()
+@click.argument('path')
+@click.option('-o', '--output', required=True, help='mzML file of the consensus spectra.')
+@click.option('-t', '--tolerance', default=10.0, show_default=True, help='Precursor m/z tolerance in ppm.')
+@click.option('-r', '--rt-tolerance', default=30.0, show_default=True, help='Retention time tolerance in seconds.')
+@click.option('-s', '--min-similarity', default=0.7, show_default=True,
+              help='Minimum cosine similarity of two spectra of a cluster.')
+@click.option('-a', '--assignments', default=None, help='CSV file to save the cluster of every spectrum.')
+def cluster(path: str, output: str, tolerance: float, rt_tolerance: float, min_similarity: float, assignments: str):
+    """Clusters repeated MS2 spectra of an mzML file and writes one consensus spectrum per cluster."""
+    from ms_package.clustering import cluster_file
+
+    df_assignments = cluster_file(path, output, tolerance=tolerance, rt_tolerance=rt_tolerance,
+                                  min_similarity=min_similarity)
+    click.echo(f"Wrote {df_assignments['cluster'].nunique()} consensus spectra of {len(df_assignments)} MS2 spectra "
+               f"to {output}")
+    if assignments:
+        df_assignments.to_csv(assignments, index=False)
+
+
+@main.command()
+@click.argument('path')
+@click.option('-f', '--format', 'file_format', default='bgzf', type=click.Choice(['bgzf', 'zstd']),
+              show_default=True, help='BGZF (gzip compatible) or zstd seekable frames.')
+@click.option('-o', '--output', default=None, help='File path of the compressed file, PATH with .gz or .zst by default.')
+def compress(path: str, file_format: str, output: str):
+    """Compresses a (gzip/zstd compressed) mzML/mzXML file into blocks that allow random access to its spectra."""
+    from ms_package.compressed import strip_compression, write_bgzf, write_zstd_seekable
+
+    if output is None:
+        output = strip_compression(path) + ('.gz' if file_format == 'bgzf' else '.zst')
+    if os.path.abspath(output) == os.path.abspath(path):
+        raise click.ClickException('Please choose an output path different from the input file.')
+    (write_bgzf if file_format == 'bgzf' else write_zstd_seekable)(path, output)
+    click.echo(f'Compressed {path} to {output}')
+
+
+@main.command()
+@click.argument('path')
+@click.option('-z', '--max-charge', default=6, show_default=True, help='Highest charge state tested.')
+@click.option('-t', '--tolerance', default=10.0, show_default=True, help='m/z tolerance of the isotope peaks in ppm.')
+@click.option('--min-peaks', default=3, show_default=True, help='Minimum number of isotope peaks of an envelope.')
+@click.option('--min-score', default=0.8, show_default=True,
+              help='Minimum similarity of an envelope with the averagine isotope distribution.')
+@click.option('-w', '--workers', default=1, show_default=True, help='Number of processes.')
+@click.option('-v', '--verbose', default=False, is_flag=True, help='When used, prints table to STDOUT.')
+@click.option('-o', '--output', default=None, help='File path to save the neutral masses')
+def deconvolve(path: str, max_charge: int, tolerance: float, min_peaks: int, min_score: float, workers: int,
+               output: str, verbose: bool = False):
+    """Finds the isotope envelopes of the MS1 spectra of an mzML file and their charge and neutral mass."""
+    from ms_package.deconvolution import deconvolve_file
+
+    masses = deconvolve_file(path, workers=workers, max_charge=max_charge, tolerance=tolerance, min_peaks=min_peaks,
+                             min_score=min_score)
+    if verbose:
+        click.echo(masses)
+    if output:
+        masses.to_csv(output, index=False)
+
+
+@main.command()
+@click.argument('paths', nargs=-1, required=True)
+@click.option('-i', '--identifications', required=True,
+              help='CSV file with the columns run (name of the run), peptide, charge, m/z and rt.')
+@click.option('-t', '--tolerance', default=10.0, show_default=True, help='m/z tolerance of the XICs in ppm.')
+@click.option('-r', '--rt-window', default=30.0, show_default=True,
+              help='Seconds around the expected retention time the XICs are integrated over.')
+@click.option('-w', '--workers', default=None, type=int, help='Number of processes, one per CPU by default.')
+@click.option('-n', '--names', default=None,
+              help='Comma separated names of the runs in the order of the paths, the file names by default.')
+@click.option('-v', '--verbose', default=False, is_flag=True, help='When used, prints table to STDOUT.')
+@click.option('-o', '--output', default=None, help='File path to save the intensity matrix (.npz, or .csv)')
+def quantify(paths: tuple, identifications: str, tolerance: float, rt_window: float, workers: int, names: str,
+             output: str, verbose: bool = False):
+    """Label-free quantification of identified peptides across the MS1 spectra of several mzML runs."""
+    import pandas as pd
+    from ms_package.quantification import quantify as quantify_runs, save_matrix
+
+    matrix = quantify_runs(paths, pd.read_csv(identifications), workers=workers, tolerance=tolerance,
+                           rt_window=rt_window, names=names.split(',') if names else None)
+    if verbose:
+        click.echo(matrix)
+    if output and output.endswith('.csv'):
+        matrix.to_csv(output, index=False)
+    elif output:
+        save_matrix(output, matrix)
+
+
+@main.group()
+def library():
+    """Spectral libraries of identified MS2 spectra."""
+    pass
+
+
+@library.command(name='build')
+@click.argument('path')
+@click.option('-o', '--output', required=True, help='Directory the library is saved to.')
+@click.option('-l', '--labels', default=None,
+              help='CSV file with the columns spectrum and peptide, only these spectra are added to the library.')
+@click.option('--bin-width', default=1.0005079, show_default=True, help='m/z width of the bins.')
+@click.option('--index-peaks', default=5, show_default=True,
+              help='Most intense bins of every spectrum in the approximate index.')
+def library_build(path: str, output: str, labels: str, bin_width: float, index_peaks: int):
+    """Builds a spectral library from the MS2 spectra of an mzML file."""
+    import pandas as pd
+    from ms_package.library import SpectralLibrary
+
+    peptides = None
+    if labels:
+        df_labels = pd.read_csv(labels)
+        peptides = dict(zip(df_labels['spectrum'].astype(int), df_labels['peptide'].astype(str)))
+    spectral_library = SpectralLibrary.from_file(path, peptides=peptides, index_peaks=index_peaks,
+                                                 bin_width=bin_width)
+    spectral_library.save(output)
+    click.echo(f'Saved a library of {len(spectral_library)} spectra to {output}')
+
+
+@library.command(name='search')
+@click.argument('library_dir')
+@click.argument('path')
+@click.option('-t', '--tolerance', default=0.05, show_default=True, help='Precursor m/z tolerance.')
+@click.option('-u', '--unit', default='Da', type=click.Choice(['Da', 'ppm']), show_default=True,
+              help='Unit of the precursor tolerance.')
+@click.option('--top', default=1, show_default=True, help='Number of matches reported per spectrum.')
+@click.option('-a', '--approximate', default=False, is_flag=True,
+              help='Only score library spectra sharing an intense peak with the query, for wide tolerances.')
+@click.option('-w', '--workers', default=1, show_default=True, help='Number of search processes.')
+@click.option('-v', '--verbose', default=False, is_flag=True, help='When used, prints table to STDOUT.')
+@click.option('-o', '--output', default=None, help='File path to save the matches')
+def library_search(library_dir: str, path: str, tolerance: float, unit: str, top: int, approximate: bool,
+                   workers: int, output: str, verbose: bool = False):
+    """Matches the MS2 spectra of an mzML file against a spectral library by cosine similarity."""
+    from ms_package.library import search_file
+
+    matches = search_file(library_dir, path, workers=workers, tolerance=tolerance, unit=unit, top=top,
+                          approximate=approximate)
+    if verbose:
+        click.echo(matches)
+    if output:
+        matches.to_csv(output, index=False)
+
+
+@main.group()
+def benchmark():
+    """Benchmarks on synthetic runs of increasing size."""
+    pass
+
+
+@benchmark.command(name='run')
+@click.option('--scales', default='1000,100000,1000000', show_default=True,
+              help='Comma separated numbers of spectra of the synthetic runs.')
+@click.option('-b', '--benchmarks', default=None,
+              help='Comma separated benchmarks to run (parse, decode, summary, search, proteins), all by default.')
+@click.option('--formats', default='mzml,mzxml', show_default=True, help='Comma separated file formats.')
+@click.option('--peaks', default=100, show_default=True, help='Number of peaks per spectrum.')
+@click.option('--precision', default=64, type=click.Choice(['32', '64']), show_default=True,
+              help='Bits of the binary array values.')
+@click.option('--no-compression', default=False, is_flag=True, help='Do not zlib compress the binary arrays.')
+@click.option('--ms-levels', default='1,2', show_default=True, help='Comma separated ms levels of one cycle.')
+@click.option('--no-index', default=False, is_flag=True, help='Write the runs without an offset index.')
+@click.option('--seed', default=0, show_default=True, help='Seed of the synthetic runs.')
+@click.option('-o', '--output', default=None, help='File path of the JSON results.')
+def benchmark_run(scales: str, benchmarks: str, formats: str, peaks: int, precision: str, no_compression: bool,
+                  ms_levels: str, no_index: bool, seed: int, output: str):
+    """Times parsing, decoding, summary values, peptide search and protein mapping and saves the results."""
+    from ms_package.benchmarks.suite import run_suite, save_report
+
+    report = run_suite(scales=[int(scale) for scale in scales.split(',')],
+                       benchmarks=benchmarks.split(',') if benchmarks else None, formats=formats.split(','),
+                       peaks=peaks, precision=int(precision), compression=not no_compression,
+                       ms_levels=[int(level) for level in ms_levels.split(',')], indexed=not no_index, seed=seed,
+                       echo=click.echo)
+    click.echo(f'Results saved to {save_report(report, output)}')
+
+
+@benchmark.command(name='compare')
+@click.argument('old_path')
+@click.argument('new_path')
+@click.option('-t', '--threshold', default=0.1, show_default=True,
+              help='Relative slowdown reported as a regression.')
+def benchmark_compare(old_path: str, new_path: str, threshold: float):
+    """Compares two benchmark results, e.g. of two commits."""
+    import json
+    from ms_package.benchmarks.suite import compare_reports
+
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    regressions = 0
+    for row in compare_reports(old, new):
+        flag = ''
+        if row['ratio'] is not None and row['ratio'] > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        ratio = f"{row['ratio']:.2f}x" if row['ratio'] is not None else '-'
+        click.echo(f"{row['benchmark']:<9}{row['format']:<7}{row['scale']:>10} spectra "
+                   f"{row['old_seconds']:>10.3f} s -> {row['new_seconds']:>10.3f} s {ratio:>7} "
+                   f"{row['old_peak_rss_mb']:>9.1f} -> {row['new_peak_rss_mb']:>9.1f} MiB{flag}")
+    if regressions:
+        raise click.ClickException(f'{regressions} benchmarks slowed down by more than {threshold:.0%}')
+
+
+@main.group(name='daemon')
+def daemon_group():
+    """Manages the optional background daemon that keeps libraries and caches loaded between calls.
+    get-spectrum-values, peptide-info and protein-info are forwarded to it while it is running."""
+    pass
+
+
+@daemon_group.command()
+@click.option('--foreground', default=False, is_flag=True, help='Run the daemon in this process.')
+@click.option('--socket', 'socket_path', default=daemon.SOCKET_PATH, help='File path of the Unix socket.')
+def start(foreground: bool, socket_path: str):
+    """Starts the daemon."""
+    try:
+        daemon.call('ping', socket_path=socket_path)
+        click.echo(f'Daemon already running on {socket_path}')
+        return
+    except daemon.DaemonUnavailable:
+        pass
+    if foreground:
+        daemon.Daemon(socket_path).serve()
+        return
+    subprocess.Popen([sys.executable, '-m', 'ms_package.cli', 'daemon', 'start', '--foreground',
+                      '--socket', socket_path],
+                     start_new_session=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL)
+    for _ in range(300):
+        time.sleep(0.1)
+        try:
+            info = daemon.call('ping', socket_path=socket_path)
+            click.echo(f"Daemon started with pid {info['pid']} on {socket_path}")
+            return
+        except daemon.DaemonUnavailable:
+            continue
+    raise click.ClickException('Daemon did not start, see the log file for details.')
+
+
+@daemon_group.command()
+@click.option('--socket', 'socket_path', default=daemon.SOCKET_PATH, help='File path of the Unix socket.')
+def stop(socket_path: str):
+    """Stops the daemon."""
+    try:
+        daemon.call('shutdown', socket_path=socket_path)
+        click.echo('Daemon stopped')
+    except daemon.DaemonUnavailable:
+        click.echo('No daemon running')
+
+
+@daemon_group.command()
+@click.option('--socket', 'socket_path', default=daemon.SOCKET_PATH, help='File path of the Unix socket.')
+def status(socket_path: str):
+    """Shows whether the daemon is running and its cache statistics."""
+    try:
+        info = daemon.call('ping', socket_path=socket_path)
+    except daemon.DaemonUnavailable:
+        click.echo('No daemon running')
+        return
+    click.echo(f"Daemon running with pid {info['pid']} for {info['uptime']:.0f} s, "
+               f"{info['cache_hits']} cache hits, {info['cache_misses']} cache misses")
+
+
 if __name__ == '__main__':
     main()
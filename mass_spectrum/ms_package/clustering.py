@@ -0,0 +1,214 @@
+import os
+import logging
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ms_package.library import BIN_WIDTH, BIN_OFFSET, bin_spectra, read_spectra
+from ms_package.profiling import profiled, profiler
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+PRECURSOR_TOLERANCE = 10.0  # ppm
+RT_TOLERANCE = 30.0  # seconds
+MIN_SIMILARITY = 0.7
+MIN_FRACTION = 0.5  # share of the cluster members a consensus peak has to be found in
+
+
+@profiled()
+def similar_pairs(vectors: Dict[str, np.ndarray], tolerance: float = PRECURSOR_TOLERANCE,
+                  rt_tolerance: float = RT_TOLERANCE,
+                  min_similarity: float = MIN_SIMILARITY) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Finds the pairs of similar spectra in one sweep over the spectra sorted by precursor m/z.
+
+    Every spectrum is only compared with the following spectra within the precursor tolerance, which are a
+    contiguous slice of the sorted vectors and are scored with one sparse dot product each.
+
+    Parameters
+    ----------
+    vectors: Dict[str, np.ndarray]
+        binned spectra sorted by precursor m/z, see library.run_vectors
+    tolerance: float
+        precursor m/z tolerance in ppm
+    rt_tolerance: float
+        retention time tolerance in seconds
+    min_similarity: float
+        minimum cosine similarity of a pair
+
+    Returns
+    -------
+    first, second: np.ndarray
+        positions of the two spectra of every pair
+    similarity: np.ndarray
+        cosine similarity of every pair
+    """
+    precursor_mz, rt, charge = vectors['precursor_mz'], vectors['rt'], vectors['charge']
+    indptr, indices, data = vectors['indptr'], vectors['indices'], vectors['data']
+    window_hi = np.searchsorted(precursor_mz, precursor_mz * (1 + tolerance * 1e-6), side='right')
+    rows = np.repeat(np.arange(len(precursor_mz)), np.diff(indptr))
+    dense = np.zeros(int(indices.max()) + 1 if len(indices) else 1, dtype=np.float32)
+    first, second, similarity = list(), list(), list()
+    for i in range(len(precursor_mz)):
+        hi = int(window_hi[i])
+        if hi <= i + 1:
+            continue
+        bins = indices[indptr[i]:indptr[i + 1]]
+        dense[bins] = data[indptr[i]:indptr[i + 1]]
+        positions = slice(indptr[i + 1], indptr[hi])
+        scores = np.bincount(rows[positions] - (i + 1), weights=data[positions] * dense[indices[positions]],
+                             minlength=hi - i - 1)
+        dense[bins] = 0.0
+        candidates = np.arange(i + 1, hi)
+        keep = ((scores >= min_similarity) & (np.abs(rt[candidates] - rt[i]) <= rt_tolerance) &
+                ((charge[candidates] == charge[i]) | (charge[candidates] == 0) | (charge[i] == 0)))
+        first.append(np.full(keep.sum(), i))
+        second.append(candidates[keep])
+        similarity.append(scores[keep])
+    if not first:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    return np.concatenate(first), np.concatenate(second), np.concatenate(similarity)
+
+
+def connected_components(count: int, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """Labels the connected components of a graph given as edge lists, numbered 0, 1, ... in order of their
+    first node."""
+    labels = np.arange(count)
+    while True:
+        low = np.minimum(labels[first], labels[second])
+        if np.all(labels[first] == labels[second]):
+            break
+        # hook the roots of both ends to the smaller label, then shorten the paths to the roots
+        np.minimum.at(labels, labels[first], low)
+        np.minimum.at(labels, labels[second], low)
+        while np.any(labels != labels[labels]):
+            labels = labels[labels]
+    return np.unique(labels, return_inverse=True)[1]
+
+
+@profiled()
+def consensus_spectra(spectra: Dict[str, np.ndarray], labels: np.ndarray, bin_width: float = BIN_WIDTH / 50,
+                      min_fraction: float = MIN_FRACTION) -> Dict[str, np.ndarray]:
+    """Merges the spectra of every cluster into a consensus spectrum.
+
+    The peaks of the members are grouped in narrow m/z bins. A consensus peak is kept if it was found in at least
+    min_fraction of the members, with the intensity weighted mean m/z and the mean intensity of the members.
+
+    Parameters
+    ----------
+    spectra: Dict[str, np.ndarray]
+        spectra as returned by library.read_spectra
+    labels: np.ndarray
+        cluster of every spectrum
+    bin_width: float
+        m/z width of the bins the peaks are merged in
+    min_fraction: float
+        share of the members a peak has to be found in
+
+    Returns
+    -------
+    consensus: Dict[str, np.ndarray]
+        'cluster', 'size', 'precursor_mz' (mean), 'charge', 'rt' (median) and the flat peak arrays 'mz',
+        'intensity' and 'offsets' of the consensus spectra
+    """
+    clusters = int(labels.max()) + 1 if len(labels) else 0
+    size = np.bincount(labels, minlength=clusters)
+    order = np.argsort(labels, kind='stable')
+    rt = np.array([np.median(part) for part in np.split(spectra['rt'][order], np.cumsum(size)[:-1])]) \
+        if clusters else np.zeros(0)
+    charge = np.zeros(clusters, dtype=np.int16)
+    np.maximum.at(charge, labels, spectra['charge'])
+    peak_cluster = np.repeat(labels, np.diff(spectra['offsets']))
+    mz, intensity = spectra['mz'], spectra['intensity']
+    bins = np.floor(mz / bin_width).astype(np.int64)
+    keys = peak_cluster * (int(bins.max()) + 1 if len(bins) else 1) + bins
+    peak_order = np.argsort(keys, kind='stable')
+    keys = keys[peak_order]
+    first = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+    summed = np.add.reduceat(intensity[peak_order], first) if len(first) else np.zeros(0)
+    weighted = np.add.reduceat((mz * intensity)[peak_order], first) if len(first) else np.zeros(0)
+    found = np.diff(np.r_[first, len(keys)])
+    peak_cluster = peak_cluster[peak_order][first]
+    keep = (found >= min_fraction * size[peak_cluster]) & (summed > 0)
+    peak_cluster, summed, weighted = peak_cluster[keep], summed[keep], weighted[keep]
+    offsets = np.zeros(clusters + 1, dtype=np.int64)
+    np.cumsum(np.bincount(peak_cluster, minlength=clusters), out=offsets[1:])
+    return {'cluster': np.arange(clusters), 'size': size,
+            'precursor_mz': np.bincount(labels, weights=spectra['precursor_mz'], minlength=clusters) / size,
+            'charge': charge, 'rt': rt, 'mz': weighted / summed, 'intensity': summed / size[peak_cluster],
+            'offsets': offsets}
+
+
+def write_consensus(path: str, consensus: Dict[str, np.ndarray]):
+    """Writes consensus spectra as MS2 spectra of an mzML file, which PeptideSearch can search."""
+    from pyopenms import MSExperiment, MSSpectrum, MzMLFile, Precursor
+
+    experiment = MSExperiment()
+    offsets = consensus['offsets']
+    for i in range(len(consensus['cluster'])):
+        spectrum = MSSpectrum()
+        spectrum.setMSLevel(2)
+        spectrum.setRT(float(consensus['rt'][i]))
+        spectrum.setNativeID(f'scan={i + 1}')
+        precursor = Precursor()
+        precursor.setMZ(float(consensus['precursor_mz'][i]))
+        if consensus['charge'][i]:
+            precursor.setCharge(int(consensus['charge'][i]))
+        spectrum.setPrecursors([precursor])
+        mz = consensus['mz'][offsets[i]:offsets[i + 1]]
+        intensity = consensus['intensity'][offsets[i]:offsets[i + 1]]
+        spectrum.set_peaks((mz, intensity))
+        if len(mz):
+            # summary values of the spectrum, written as cvParams
+            top = int(np.argmax(intensity))
+            for name, value in (('base peak m/z', mz[top]), ('base peak intensity', intensity[top]),
+                                ('total ion current', intensity.sum()), ('lowest observed m/z', mz[0]),
+                                ('highest observed m/z', mz[-1])):
+                spectrum.setMetaValue(name, float(value))
+        experiment.addSpectrum(spectrum)
+    MzMLFile().store(path + '.tmp.mzML', experiment)
+    os.replace(path + '.tmp.mzML', path)
+
+
+def cluster_file(path: str, output: str, tolerance: float = PRECURSOR_TOLERANCE, rt_tolerance: float = RT_TOLERANCE,
+                 min_similarity: float = MIN_SIMILARITY, min_fraction: float = MIN_FRACTION) -> pd.DataFrame:
+    """Clusters the MS2 spectra of an mzML file and writes one consensus spectrum per cluster.
+
+    Parameters
+    ----------
+    path: str
+        mzML file of the spectra
+    output: str
+        mzML file of the consensus spectra
+    tolerance, rt_tolerance, min_similarity:
+        see similar_pairs, the clusters are the connected components of the similar pairs
+    min_fraction: float
+        see consensus_spectra
+
+    Returns
+    -------
+    assignments: pd.DataFrame
+        spectrum id, cluster and cluster size of every MS2 spectrum; the consensus spectrum of cluster c is the
+        c-th spectrum of the output file
+    """
+    spectra = read_spectra(path)
+    order = np.argsort(spectra['precursor_mz'], kind='stable')
+    with profiler.stage('clustering.bin_spectra'):
+        lengths = np.diff(spectra['offsets'])[order]
+        peaks = np.repeat(spectra['offsets'][order] - (np.cumsum(lengths) - lengths), lengths) + \
+            np.arange(lengths.sum())
+        indptr, indices, data = bin_spectra(spectra['mz'][peaks], spectra['intensity'][peaks],
+                                            np.r_[0, np.cumsum(lengths)], bin_width=BIN_WIDTH,
+                                            bin_offset=BIN_OFFSET)
+    vectors = {'precursor_mz': spectra['precursor_mz'][order], 'rt': spectra['rt'][order],
+               'charge': spectra['charge'][order], 'indptr': indptr, 'indices': indices, 'data': data}
+    first, second, _ = similar_pairs(vectors, tolerance, rt_tolerance, min_similarity)
+    labels = np.empty(len(order), dtype=np.int64)
+    labels[order] = connected_components(len(order), first, second)
+    consensus = consensus_spectra(spectra, labels, min_fraction=min_fraction)
+    write_consensus(output, consensus)
+    profiler.count('clustering.spectra', len(labels))
+    profiler.count('clustering.clusters', len(consensus['cluster']))
+    logger.info(f'Clustered {len(labels)} MS2 spectra of {path} into {len(consensus["cluster"])} consensus spectra')
+    return pd.DataFrame({'spectrum': spectra['keys'], 'cluster': labels, 'cluster_size': consensus['size'][labels]})
@@ -0,0 +1,273 @@
+import os
+import re
+import gzip
+import zlib
+import struct
+import bisect
+import logging
+from xml.dom import minidom as md
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+COMPRESSED_EXTENSIONS = {'.gz': 'gzip', '.bgz': 'gzip', '.zst': 'zstd'}
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+SEEK_TABLE_MAGIC = 0x184D2A5E  # skippable frame holding the seek table of the zstd seekable format
+SEEKABLE_MAGIC = 0x8F92EAB1
+BGZF_BLOCK_SIZE = 0xff00  # uncompressed bytes per block, as written by bgzip
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+ZSTD_FRAME_SIZE = 1 << 20
+
+
+def strip_compression(path: str) -> str:
+    """File path without the .gz/.bgz/.zst extension, e.g. to check the extension of the contained file."""
+    root, ext = os.path.splitext(path)
+    return root if ext.lower() in COMPRESSED_EXTENSIONS else path
+
+
+def import_zstandard():
+    """Imports the optional zstandard package."""
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError('Reading and writing .zst files requires the zstandard package: '
+                          'pip install zstandard') from e
+    return zstandard
+
+
+def compression_of(path: str) -> Optional[str]:
+    """Detects 'gzip' (including BGZF) or 'zstd' compression from the first bytes, None for plain files."""
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic[:2] == GZIP_MAGIC:
+        return 'gzip'
+    if magic == ZSTD_MAGIC or (len(magic) == 4 and struct.unpack('<I', magic)[0] & 0xFFFFFFF0 == 0x184D2A50):
+        return 'zstd'  # zstd frame or skippable frame
+    return None
+
+
+def open_input(path: str) -> BinaryIO:
+    """Opens a plain, gzip or zstd compressed file for sequential reading of the decompressed content."""
+    compression = compression_of(path)
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'zstd':
+        zstandard = import_zstandard()
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True,
+                                                          closefd=True)
+    return open(path, 'rb')
+
+
+class PlainFile:
+    """Random access to an uncompressed file, with the same interface as BlockFile."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+
+class BlockFile:
+    """Random access to a file made of independently compressed blocks (BGZF blocks or zstd seekable frames).
+
+    Only the blocks overlapping a requested range are read and decompressed; the last block is kept, since
+    consecutive reads usually fall into the same block.
+    """
+
+    def __init__(self, path: str, blocks: List[Tuple[int, int, int]], decompress):
+        """
+        parameters:
+            path = file path of the compressed file
+            blocks = (compressed offset, compressed size, decompressed size) of every block
+            decompress = function decompressing the bytes of one block
+        """
+        self.path = path
+        self.blocks = blocks
+        self.decompress = decompress
+        self.starts = list()  # decompressed offset of every block
+        size = 0
+        for _, _, block_size in blocks:
+            self.starts.append(size)
+            size += block_size
+        self.size = size
+        self.cached = (None, b'')
+
+    def block(self, index: int) -> bytes:
+        if self.cached[0] != index:
+            offset, compressed_size, _ = self.blocks[index]
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                self.cached = (index, self.decompress(f.read(compressed_size)))
+        return self.cached[1]
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        """Reads size decompressed bytes starting at a decompressed offset."""
+        end = min(offset + size, self.size)
+        parts = list()
+        index = bisect.bisect_right(self.starts, offset) - 1
+        while offset < end and index < len(self.blocks):
+            data = self.block(index)
+            start = offset - self.starts[index]
+            part = data[start:start + end - offset]
+            parts.append(part)
+            offset += len(part)
+            index += 1
+        return b''.join(parts)
+
+
+def bgzf_blocks(path: str) -> Optional[List[Tuple[int, int, int]]]:
+    """Reads the block table of a BGZF file from the block headers and footers, None if it is not BGZF."""
+    blocks = list()
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset < file_size:
+            f.seek(offset)
+            header = f.read(18)
+            # gzip member with FEXTRA and a 'BC' subfield holding the block size
+            if len(header) < 18 or header[:4] != b'\x1f\x8b\x08\x04' or header[12:14] != b'BC':
+                return None
+            block_size = struct.unpack('<H', header[16:18])[0] + 1
+            f.seek(offset + block_size - 4)
+            decompressed_size = struct.unpack('<I', f.read(4))[0]
+            if decompressed_size:
+                blocks.append((offset, block_size, decompressed_size))
+            offset += block_size
+    return blocks
+
+
+def zstd_seek_table(path: str) -> Optional[List[Tuple[int, int, int]]]:
+    """Reads the frame table of a file in the zstd seekable format, None if it has no seek table."""
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if file_size < 17:
+            return None
+        f.seek(file_size - 9)
+        frames, descriptor, magic = struct.unpack('<IBI', f.read(9))
+        if magic != SEEKABLE_MAGIC:
+            return None
+        entry_size = 12 if descriptor & 0x80 else 8  # with or without checksums
+        table_size = frames * entry_size
+        f.seek(file_size - 9 - table_size)
+        table = f.read(table_size)
+    blocks = list()
+    offset = 0
+    for i in range(frames):
+        compressed_size, decompressed_size = struct.unpack_from('<II', table, i * entry_size)
+        blocks.append((offset, compressed_size, decompressed_size))
+        offset += compressed_size
+    return blocks
+
+
+def open_seekable(path: str):
+    """Opens a file for random access to its decompressed content.
+
+    Raises
+    -------
+    ValueError: if the file is compressed in a format without random access, e.g. plain gzip
+    """
+    compression = compression_of(path)
+    if compression is None:
+        return PlainFile(path)
+    if compression == 'gzip':
+        blocks = bgzf_blocks(path)
+        if blocks is not None:
+            return BlockFile(path, blocks, lambda data: zlib.decompress(data, wbits=31))
+    elif compression == 'zstd':
+        blocks = zstd_seek_table(path)
+        if blocks is not None:
+            zstandard = import_zstandard()
+            decompressor = zstandard.ZstdDecompressor()
+            return BlockFile(path, blocks,
+                             lambda data: decompressor.decompressobj().decompress(data))
+    raise ValueError(f'{path} is compressed without random access, convert it with write_bgzf or '
+                     f'write_zstd_seekable')
+
+
+def write_bgzf(source: str, destination: str, level: int = 6):
+    """Compresses a file (plain, gzip or zstd) into BGZF, which is gzip compatible and allows random access."""
+    with open_input(source) as src, open(destination, 'wb') as dst:
+        while True:
+            data = src.read(BGZF_BLOCK_SIZE)
+            if not data:
+                break
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+            deflated = compressor.compress(data) + compressor.flush()
+            header = struct.pack('<4BI2BH2BH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2)
+            block_size = len(header) + 2 + len(deflated) + 8
+            dst.write(header + struct.pack('<H', block_size - 1) + deflated +
+                      struct.pack('<II', zlib.crc32(data), len(data)))
+        dst.write(BGZF_EOF)
+
+
+def write_zstd_seekable(source: str, destination: str, level: int = 3, frame_size: int = ZSTD_FRAME_SIZE):
+    """Compresses a file into independent zstd frames followed by a seek table (the zstd seekable format)."""
+    zstandard = import_zstandard()
+    compressor = zstandard.ZstdCompressor(level=level)
+    entries = list()
+    with open_input(source) as src, open(destination, 'wb') as dst:
+        while True:
+            data = src.read(frame_size)
+            if not data:
+                break
+            frame = compressor.compress(data)
+            dst.write(frame)
+            entries.append(struct.pack('<II', len(frame), len(data)))
+        table = b''.join(entries) + struct.pack('<IBI', len(entries), 0, SEEKABLE_MAGIC)
+        dst.write(struct.pack('<II', SEEK_TABLE_MAGIC, len(table)) + table)
+
+
+class IndexedMzML:
+    """Random access to the spectra of an indexed mzML file through its spectrum offset index. Works on plain
+    files and on BGZF and seekable zstd compressed files, which are decompressed block by block."""
+
+    OFFSET = re.compile(rb'<offset\s+idRef="([^"]*)"[^>]*>\s*(\d+)\s*</offset>')
+
+    def __init__(self, path: str):
+        """
+        parameters:
+            path = file path of the (compressed) indexed mzML file
+
+        Raises
+        -------
+        ValueError: if the file has no spectrum offset index or is compressed without random access
+        """
+        self.path = path
+        self.data = open_seekable(path)
+        tail = self.data.read_at(max(self.data.size - 4096, 0), 4096)
+        match = re.search(rb'<indexListOffset>\s*(\d+)\s*</indexListOffset>', tail)
+        if match is None:
+            raise ValueError(f'{path} is not an indexed mzML file')
+        self.index_offset = int(match.group(1))
+        index = self.data.read_at(self.index_offset, self.data.size - self.index_offset)
+        start = index.find(b'<index name="spectrum"')
+        end = index.find(b'</index>', start)
+        if start < 0:
+            raise ValueError(f'{path} has no spectrum index')
+        entries = self.OFFSET.findall(index, start, end)
+        self.ids = [native_id.decode() for native_id, _ in entries]
+        self.offsets = [int(offset) for _, offset in entries]
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def read_element(self, i: int) -> bytes:
+        """Bytes of the i-th <spectrum> element."""
+        start = self.offsets[i]
+        end = self.offsets[i + 1] if i + 1 < len(self.offsets) else self.index_offset
+        data = self.data.read_at(start, end - start)
+        return data[:data.index(b'</spectrum>') + len(b'</spectrum>')]
+
+    def get_spectrum_dict(self, indices) -> Dict[int, md.Element]:
+        """Parses the given spectra into a spectrum dictionary as returned by Reader.get_spectrum_dict."""
+        spectrum_dict = dict()
+        for i in indices:
+            spectrum = md.parseString(self.read_element(i)).documentElement
+            spectrum_dict[int(spectrum.getAttribute('index'))] = spectrum
+        return spectrum_dict
@@ -0,0 +1,205 @@
+import io
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import socketserver
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from ms_package.startup import PROJECT_DIR
+from ms_package.profiling import profiler
+from ms_package.result_store import file_signature
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+SOCKET_PATH = os.environ.get('MS_PACKAGE_SOCKET', str(PROJECT_DIR.joinpath('ms_package.sock')))
+CACHE_SIZE = 16
+
+
+class DaemonUnavailable(ConnectionError):
+    """Raised by the client if no daemon is listening on the socket."""
+
+
+class DaemonError(RuntimeError):
+    """Raised by the client if a command failed inside the daemon."""
+
+
+class ResultCache:
+    """Thread-safe LRU cache of command results keyed by the signatures of the input files."""
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Tuple, compute: Callable[[], Any]) -> Any:
+        """Returns the cached result for the key, computing and caching it if missing."""
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return self.results[key]
+            self.misses += 1
+        result = compute()
+        with self.lock:
+            self.results[key] = result
+            while len(self.results) > self.size:
+                self.results.popitem(last=False)
+        return result
+
+
+cache = ResultCache()
+
+
+def spectrum_values(path: str):
+    """Spectrum values of an mzML/mzXML file, see Reader.analyse_spectrum."""
+    from ms_package.reader import Reader
+    return cache.get(('spectrum_values', file_signature(path)), lambda: Reader(path=path).analyse_spectrum())
+
+
+def peptide_info(fasta_path: Union[str, List[str]], mzml_path: str):
+    """Peptide hits and hit sequences, see PeptideSearch.peptide_wrapper. Several fasta files are searched as one
+    deduplicated digest."""
+    from ms_package.peptide_prediction import PeptideSearch
+    fasta_paths = [fasta_path] if isinstance(fasta_path, str) else fasta_path
+    key = ('peptide_info', tuple(file_signature(path) for path in fasta_paths), file_signature(mzml_path))
+    return cache.get(key, lambda: PeptideSearch(fasta_path=fasta_path, mzml_path=mzml_path).peptide_wrapper())
+
+
+def protein_info(peptides: List[str], database: Optional[str] = None):
+    """Proteins of the peptides, see ProteinSearch.get_proteins. The Proteins API results are cached by
+    ProteinCache and the index of a local FASTA database by fasta_index.get_index."""
+    from ms_package.protein_prediction import ProteinSearch
+    pro_search = ProteinSearch(peptides, fasta_path=database)
+    pro_search.get_proteins()
+    return pro_search.ans_df
+
+
+COMMANDS = {'spectrum_values': spectrum_values,
+            'peptide_info': peptide_info,
+            'protein_info': protein_info}
+
+
+def encode(value: Any) -> Any:
+    """Converts command results into json serialisable values."""
+    import pandas as pd
+    if isinstance(value, pd.DataFrame):
+        return {'__dataframe__': value.to_json(orient='split', double_precision=15)}
+    if isinstance(value, (list, tuple)):
+        return [encode(v) for v in value]
+    return value
+
+
+def decode(value: Any) -> Any:
+    """Restores command results encoded by encode."""
+    if isinstance(value, dict) and '__dataframe__' in value:
+        import pandas as pd
+        return pd.read_json(io.StringIO(value['__dataframe__']), orient='split')
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    return value
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    """Executes one json command per connection and answers with a json response."""
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        command = request.get('command')
+        try:
+            if command == 'ping':
+                result = {'pid': os.getpid(), 'uptime': time.time() - self.server.started,
+                          'cache_hits': cache.hits, 'cache_misses': cache.misses}
+            elif command == 'shutdown':
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                result = None
+            else:
+                result = encode(COMMANDS[command](**request.get('args', {})))
+            response = {'ok': True, 'result': result}
+        except Exception as e:
+            logger.error(f'Daemon command {command} failed: {e}')
+            response = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+        self.wfile.write(json.dumps(response).encode())
+
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Long-lived local server that keeps pyopenms, pandas and the result caches loaded between CLI calls."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str = SOCKET_PATH):
+        """
+        parameters:
+            socket_path = file path of the Unix socket
+        """
+        if os.path.exists(socket_path):
+            os.remove(socket_path)  # stale socket of a daemon that did not shut down cleanly
+        os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+        super().__init__(socket_path, DaemonHandler)
+        os.chmod(socket_path, 0o600)
+        self.socket_path = socket_path
+        self.started = time.time()
+
+    def serve(self, preload: bool = True):
+        """Serves commands until a shutdown command is received."""
+        if preload:
+            import ms_package.reader  # noqa: F401
+            import ms_package.peptide_prediction  # noqa: F401
+            import ms_package.protein_prediction  # noqa: F401
+        logger.info(f'Daemon listening on {self.socket_path}')
+        try:
+            self.serve_forever()
+        finally:
+            self.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def call(command: str, socket_path: str = SOCKET_PATH, **args) -> Any:
+    """Sends a command to the daemon and returns its result.
+
+    Raises
+    -------
+    DaemonUnavailable: if no daemon is listening on the socket
+    DaemonError: if the command failed inside the daemon
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise DaemonUnavailable(socket_path) from e
+        try:
+            sock.sendall(json.dumps({'command': command, 'args': args}).encode() + b'\n')
+            sock.shutdown(socket.SHUT_WR)
+            with sock.makefile('rb') as f:
+                data = f.read()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise DaemonUnavailable(socket_path) from e
+        if not data:  # the daemon is shutting down
+            raise DaemonUnavailable(socket_path)
+        response = json.loads(data)
+    finally:
+        sock.close()
+    if not response['ok']:
+        raise DaemonError(response['error'])
+    return decode(response['result'])
+
+
+def run(command: str, socket_path: str = SOCKET_PATH, **args) -> Any:
+    """Runs a command in the daemon if one is running, otherwise in this process. Commands always run in this
+    process while it is profiled."""
+    try:
+        if profiler.enabled:
+            raise DaemonUnavailable(socket_path)
+        return call(command, socket_path=socket_path, **args)
+    except DaemonUnavailable:
+        logger.info(f'No daemon running, executing {command} in process')
+        result = COMMANDS[command](**args)
+        return list(result) if isinstance(result, tuple) else result
@@ -0,0 +1,225 @@
+import os
+import re
+import uuid
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from ms_package.startup import DATA_DIR
+from ms_package.fasta_index import parse_header, read_fasta
+from ms_package.peptide_masses import MODIFICATION_PATTERN, peptide_masses
+from ms_package.profiling import profiled, profiler
+from ms_package.result_store import file_lock, file_signature
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+DIGEST_DIR = DATA_DIR.joinpath('digests')
+CLEAVAGE = re.compile(r'(?<=[KR])(?!P)')  # Trypsin as in SimpleSearchEngineAlgorithm
+MISSED_CLEAVAGES = 1
+MIN_LENGTH = 7
+MAX_LENGTH = 40
+SHARD_PEPTIDES = 1000000
+PEPTIDE_COLUMNS = ['Peptide ID m/z', 'Peptide ID rt', 'Peptide hit sequence', 'Peptide hit score']
+
+
+def digest_protein(sequence: str, missed_cleavages: int = MISSED_CLEAVAGES, min_length: int = MIN_LENGTH,
+                   max_length: int = MAX_LENGTH) -> List[str]:
+    """Tryptic peptides of a protein with up to missed_cleavages missed cleavage sites."""
+    pieces = [piece for piece in CLEAVAGE.split(sequence) if piece]  # no empty piece after a C-terminal K or R
+    peptides = list()
+    for start in range(len(pieces)):
+        peptide = ''
+        for piece in pieces[start:start + missed_cleavages + 1]:
+            peptide += piece
+            if len(peptide) > max_length:
+                break
+            if len(peptide) >= min_length:
+                peptides.append(peptide)
+    return peptides
+
+
+class Digest:
+    """The peptides of several FASTA files, digested once and deduplicated, with references to their proteins.
+
+    Overlapping databases (a proteome, contaminants, custom sequences) share most of their peptides, which are
+    searched only once. The peptides are sorted by mass, so every shard covers a narrow mass range.
+    """
+
+    def __init__(self, fasta_paths: Union[str, List[str]], missed_cleavages: int = MISSED_CLEAVAGES,
+                 min_length: int = MIN_LENGTH, max_length: int = MAX_LENGTH):
+        """
+        parameters:
+            fasta_paths = file path(s) of FASTA files
+            missed_cleavages, min_length, max_length = digestion settings, the defaults of the peptide search
+        """
+        if isinstance(fasta_paths, str):
+            fasta_paths = [fasta_paths]
+        self.fasta_paths = [str(path) for path in fasta_paths]
+        self.settings = (missed_cleavages, min_length, max_length)
+
+        self.accessions = list()
+        peptides, proteins = list(), list()
+        for path in self.fasta_paths:
+            for header, sequence in read_fasta(path):
+                digested = digest_protein(sequence.upper(), missed_cleavages, min_length, max_length)
+                peptides.extend(digested)
+                proteins.extend([len(self.accessions)] * len(digested))
+                self.accessions.append(parse_header(header)[0])
+        unique, inverse = np.unique(np.array(peptides, dtype=str), return_inverse=True)
+        masses = peptide_masses(list(unique))
+        # peptides with unknown residues cannot be searched
+        order = np.argsort(masses, kind='stable')[:int(np.isfinite(masses).sum())]
+        self.peptides = unique[order]
+        self.masses = masses[order]
+        self.alphabetical = np.argsort(order)  # positions of the peptides in alphabetical order
+        position = np.full(len(unique), -1, dtype=np.int64)
+        position[order] = np.arange(len(order))
+        inverse = position[inverse]
+        proteins = np.array(proteins, dtype=np.int64)
+        pairs = np.unique(np.stack([inverse, proteins], axis=1)[inverse >= 0], axis=0) if len(peptides) else \
+            np.zeros((0, 2), dtype=np.int64)
+        # proteins of peptide i are protein_indices[protein_indptr[i]:protein_indptr[i + 1]]
+        self.protein_indptr = np.zeros(len(self.peptides) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs[:, 0], minlength=len(self.peptides)), out=self.protein_indptr[1:])
+        self.protein_indices = pairs[:, 1]
+        profiler.count('digest.peptides', len(peptides))
+        profiler.count('digest.unique_peptides', len(self.peptides))
+        logger.info(f'Digested {len(self.accessions)} proteins of {self.fasta_paths} into {len(self.peptides)} '
+                    f'unique peptides ({len(peptides)} before deduplication)')
+
+    def __len__(self) -> int:
+        return len(self.peptides)
+
+    def proteins(self, peptides: Sequence[str]) -> List[List[str]]:
+        """Accessions of the proteins of every peptide, empty for peptides not in the digest. A protein found in
+        several databases is listed once. Modifications written into the sequences are ignored."""
+        stripped = np.array([MODIFICATION_PATTERN.sub('', peptide) for peptide in peptides], dtype=str)
+        ordered = self.peptides[self.alphabetical]
+        found = np.minimum(np.searchsorted(ordered, stripped), max(len(ordered) - 1, 0))
+        accessions = list()
+        for peptide, position in zip(stripped, found):
+            if len(ordered) == 0 or ordered[position] != peptide:
+                accessions.append(list())
+                continue
+            i = self.alphabetical[position]
+            proteins = self.protein_indices[self.protein_indptr[i]:self.protein_indptr[i + 1]]
+            accessions.append(list(dict.fromkeys(self.accessions[protein] for protein in proteins)))
+        return accessions
+
+    def write_shards(self, shard_dir: str, shard_peptides: int = SHARD_PEPTIDES) -> List[str]:
+        """Writes the peptides as FASTA files of shard_peptides entries each, in order of their mass, and returns
+        their paths. Shards that already exist are not written again. The shard directory is locked while writing,
+        so processes writing the same shards wait for the first one."""
+        os.makedirs(shard_dir, exist_ok=True)
+        paths = list()
+        with file_lock(os.path.join(shard_dir, '.lock')):
+            for index, start in enumerate(range(0, len(self.peptides), shard_peptides)):
+                path = os.path.join(shard_dir, f'shard-{index:05d}.fasta')
+                if not os.path.exists(path):
+                    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+                    with open(tmp_path, 'w') as f:
+                        for number, peptide in enumerate(self.peptides[start:start + shard_peptides], start=start):
+                            f.write(f'>{number}\n{peptide}\n')
+                    os.replace(tmp_path, path)
+                paths.append(path)
+        return paths
+
+
+@lru_cache(maxsize=4)
+def _load_digest(signatures: Tuple[Tuple[str, int, int], ...], settings: Tuple[int, int, int]) -> Digest:
+    return Digest([signature[0] for signature in signatures], *settings)
+
+
+def get_digest(fasta_paths: Union[str, List[str]], missed_cleavages: int = MISSED_CLEAVAGES,
+               min_length: int = MIN_LENGTH, max_length: int = MAX_LENGTH) -> Digest:
+    """Returns the digest of the FASTA files, reusing a digest built before if the files did not change."""
+    if isinstance(fasta_paths, str):
+        fasta_paths = [fasta_paths]
+    signatures = tuple(file_signature(path) for path in fasta_paths)
+    return _load_digest(signatures, (missed_cleavages, min_length, max_length))
+
+
+def shard_dir_for(digest: Digest, shard_peptides: int) -> str:
+    """Directory of the shards of a digest, which changes whenever a FASTA file or the sharding changes."""
+    key = [file_signature(path) for path in digest.fasta_paths] + [digest.settings, shard_peptides]
+    return str(DIGEST_DIR.joinpath(hashlib.sha256(repr(key).encode()).hexdigest()[:16]))
+
+
+def search_shard(job: Tuple[str, str]) -> pd.DataFrame:
+    """Searches the spectra of an mzML file against one shard in a worker process.
+
+    Returns
+    -------
+    hits: pd.DataFrame
+        the columns of PeptideSearch.peptide_wrapper, the spectrum reference (or m/z and retention time) of
+        every identified spectrum and the sequences of all its hits
+    """
+    from ms_package.peptide_prediction import PeptideSearch
+    shard_path, mzml_path = job
+    search = PeptideSearch(fasta_path=shard_path, mzml_path=mzml_path)
+    peptide_ids = search.peptide_search()[1]
+    info = search.get_peptide_identification_values(peptide_ids)
+    spectra = [peptide_id.getSpectrumReference() or f'{peptide_id.getMZ()}@{peptide_id.getRT()}'
+               for peptide_id in peptide_ids]
+    sequences = [[str(hit.getSequence()) for hit in peptide_id.getHits()] for peptide_id in peptide_ids]
+    hits = pd.DataFrame.from_dict(info, orient='index', columns=PEPTIDE_COLUMNS)
+    hits['spectrum'] = pd.Series(spectra, index=list(info), dtype=object)
+    hits['sequences'] = pd.Series(sequences, index=list(info), dtype=object)
+    return hits.dropna(subset=['Peptide hit sequence'])
+
+
+def merge_hits(shard_hits: List[pd.DataFrame]) -> pd.DataFrame:
+    """Keeps the best scoring hit of every spectrum over the shards, in order of the spectra."""
+    hits = pd.concat(shard_hits, ignore_index=True) if shard_hits else \
+        pd.DataFrame(columns=PEPTIDE_COLUMNS + ['spectrum', 'sequences'])
+    best = hits.sort_values('Peptide hit score', ascending=False, kind='stable').drop_duplicates('spectrum')
+    return best.sort_values(['Peptide ID rt', 'Peptide ID m/z'], kind='stable', ignore_index=True)
+
+
+@profiled()
+def search_databases(fasta_paths: Union[str, List[str]], mzml_path: str, workers: Optional[int] = None,
+                     shard_peptides: int = SHARD_PEPTIDES) -> Tuple[pd.DataFrame, List[str]]:
+    """Searches the spectra of an mzML file against the merged digest of several FASTA files.
+
+    Parameters
+    ----------
+    fasta_paths: Union[str, List[str]]
+        FASTA files of the proteins, e.g. a proteome, contaminants and custom sequences
+    mzml_path: str
+        mzML file of the spectra
+    workers: int
+        number of processes searching shards, the number of CPUs if None
+    shard_peptides: int
+        number of peptides searched together, so the index of one shard fits in memory
+
+    Returns
+    -------
+    peptide_df: pd.DataFrame
+        best hit of every identified spectrum with the columns of PeptideSearch.peptide_wrapper and the proteins
+        of all databases the peptide is found in ('Peptide hit proteins', separated by ';')
+    peptide_list: list
+        sequences of all hits of the identified spectra
+    """
+    digest = get_digest(fasta_paths)
+    shards = digest.write_shards(shard_dir_for(digest, shard_peptides), shard_peptides)
+    jobs = [(shard, str(mzml_path)) for shard in shards]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    if workers == 1:
+        shard_hits = [search_shard(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            shard_hits = list(executor.map(search_shard, jobs))
+    hits = merge_hits(shard_hits)
+    peptide_df = hits[PEPTIDE_COLUMNS].copy()
+    peptide_df.insert(0, 'Hit_id', np.arange(len(peptide_df)))
+    peptide_df['Peptide hit proteins'] = [';'.join(accessions) for accessions in
+                                          digest.proteins(peptide_df['Peptide hit sequence'])]
+    peptide_list = [sequence for sequences in hits['sequences'] for sequence in sequences]
+    logger.info(f'Identified {len(peptide_df)} spectra in {len(shards)} shards of {len(digest)} peptides')
+    return peptide_df, peptide_list
@@ -0,0 +1,164 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from ms_package.library import read_spectra
+from ms_package.profiling import profiled, profiler
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+PROTON = 1.007276
+ISOTOPE_SPACING = 1.0033548  # mass difference of 13C and 12C
+AVERAGINE_LAMBDA = 0.000594  # mean number of heavy isotopes per Da of an averagine peptide (Poisson model)
+MAX_CHARGE = 6
+MAX_ISOTOPES = 6
+MIN_PEAKS = 3
+MIN_SCORE = 0.8
+TOLERANCE = 10.0  # ppm
+MASS_COLUMNS = ['spectrum', 'rt', 'neutral_mass', 'charge', 'monoisotopic_m/z', 'intensity', 'isotopes', 'score']
+
+
+def averagine(masses: np.ndarray, isotopes: int) -> np.ndarray:
+    """Relative intensities of the first isotope peaks of averagine peptides of the given neutral masses,
+    approximated by a Poisson distribution of the number of heavy isotopes."""
+    lam = np.maximum(masses * AVERAGINE_LAMBDA, 1e-3)[:, None]
+    k = np.arange(isotopes)[None, :]
+    log_factorial = np.cumsum(np.log(np.maximum(np.arange(isotopes), 1)))[None, :]
+    return np.exp(k * np.log(lam) - lam - log_factorial)
+
+
+@profiled()
+def deconvolve(mz: np.ndarray, intensity: np.ndarray, offsets: np.ndarray, max_charge: int = MAX_CHARGE,
+               tolerance: float = TOLERANCE, max_isotopes: int = MAX_ISOTOPES, min_peaks: int = MIN_PEAKS,
+               min_score: float = MIN_SCORE) -> Dict[str, np.ndarray]:
+    """Detects isotope envelopes in centroided spectra and reports their monoisotopic neutral masses.
+
+    For every charge, all peaks of all spectra are tested at once as the monoisotopic peak of an envelope: the
+    following isotope peaks are looked up with one binary search per isotope, and the envelope is scored by the
+    cosine similarity of its intensities with the averagine isotope distribution of its mass. Overlapping
+    envelopes are resolved greedily, envelopes with more peaks and higher scores first, so every peak belongs to
+    at most one envelope.
+
+    Parameters
+    ----------
+    mz, intensity, offsets: np.ndarray
+        flat peak arrays of the spectra as returned by Reader.get_spectrum_arrays
+    max_charge: int
+        charges 1..max_charge are tested
+    tolerance: float
+        m/z tolerance of the isotope peaks in ppm
+    max_isotopes: int
+        maximum number of peaks of an envelope
+    min_peaks: int
+        minimum number of consecutive isotope peaks of an envelope
+    min_score: float
+        minimum cosine similarity with the averagine distribution
+
+    Returns
+    -------
+    envelopes: Dict[str, np.ndarray]
+        'spectrum' (position of the spectrum in offsets), 'neutral_mass', 'charge', 'monoisotopic_m/z',
+        'intensity' (summed over the envelope), 'isotopes' (number of peaks) and 'score' of every envelope
+    """
+    count = len(offsets) - 1
+    spectrum = np.repeat(np.arange(count), np.diff(offsets))
+    # one sorted key for the peaks of all spectra; the spectra are further apart than any isotope spacing
+    span = float(mz.max()) + 2 * ISOTOPE_SPACING if len(mz) else 1.0
+    keys = spectrum * span + mz
+    order = np.argsort(keys, kind='stable')
+    keys, mz, intensity, spectrum = keys[order], mz[order], intensity[order], spectrum[order]
+    peaks = np.arange(len(keys))
+    candidates = list()
+    for charge in range(1, max_charge + 1):
+        matched = np.full((len(keys), max_isotopes), -1, dtype=np.int64)
+        matched[:, 0] = peaks
+        for k in range(1, max_isotopes):
+            target = keys + k * ISOTOPE_SPACING / charge
+            right = np.minimum(np.searchsorted(keys, target), len(keys) - 1)
+            left = np.maximum(right - 1, 0)
+            nearest = np.where(np.abs(keys[left] - target) < np.abs(keys[right] - target), left, right)
+            found = ((np.abs(keys[nearest] - target) <= (mz + k * ISOTOPE_SPACING / charge) * tolerance * 1e-6) &
+                     (matched[:, k - 1] >= 0))
+            matched[:, k] = np.where(found, nearest, -1)
+        isotopes = (matched >= 0).sum(axis=1)
+        selected = np.flatnonzero(isotopes >= min_peaks)
+        matched, isotopes = matched[selected], isotopes[selected]
+        observed = np.where(matched >= 0, intensity[np.maximum(matched, 0)], 0.0)
+        masses = (mz[selected] - PROTON) * charge
+        expected = averagine(masses, max_isotopes) * (matched >= 0)
+        norms = np.sqrt((observed ** 2).sum(axis=1) * (expected ** 2).sum(axis=1))
+        score = np.divide((observed * expected).sum(axis=1), norms, out=np.zeros(len(norms)), where=norms > 0)
+        good = score >= min_score
+        candidates.append((matched[good], isotopes[good], score[good], masses[good], np.full(good.sum(), charge),
+                           observed[good].sum(axis=1)))
+    matched, isotopes, score, masses, charges, summed = (np.concatenate(parts) for parts in zip(*candidates))
+    priority = np.lexsort((-score, -isotopes))
+    used = np.zeros(len(keys), dtype=bool)
+    accepted = list()
+    for i in priority:
+        members = matched[i, :isotopes[i]]
+        if not used[members].any():
+            used[members] = True
+            accepted.append(i)
+    accepted = np.array(accepted, dtype=np.int64)
+    first = matched[accepted, 0] if len(accepted) else np.zeros(0, dtype=np.int64)
+    profiler.count('deconvolution.envelopes', len(accepted))
+    return {'spectrum': spectrum[first], 'neutral_mass': masses[accepted], 'charge': charges[accepted],
+            'monoisotopic_m/z': mz[first], 'intensity': summed[accepted], 'isotopes': isotopes[accepted],
+            'score': score[accepted]}
+
+
+def deconvolve_chunk(mz: np.ndarray, intensity: np.ndarray, offsets: np.ndarray, options: Dict) -> Dict:
+    """Deconvolves a part of the spectra in a worker process."""
+    return deconvolve(mz, intensity, offsets, **options)
+
+
+def deconvolve_file(path: str, workers: Optional[int] = 1, **options) -> pd.DataFrame:
+    """Deconvolves the MS1 spectra of an mzML file, split between workers processes.
+
+    See deconvolve for the options.
+
+    Returns
+    -------
+    masses: pd.DataFrame
+        spectrum id, retention time, neutral mass, charge, monoisotopic m/z, summed intensity, number of isotope
+        peaks and averagine score of every envelope, sorted by neutral mass, see find_masses
+    """
+    spectra = read_spectra(path, ms_level=1)
+    offsets = spectra['offsets']
+    count = len(spectra['keys'])
+    workers = max(1, min(workers or 1, count))
+    bounds = np.linspace(0, count, workers + 1).astype(np.int64)
+    chunks = [(spectra['mz'][offsets[start]:offsets[end]], spectra['intensity'][offsets[start]:offsets[end]],
+               offsets[start:end + 1] - offsets[start], options) for start, end in zip(bounds[:-1], bounds[1:])]
+    if workers == 1:
+        parts = [deconvolve_chunk(*chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(deconvolve_chunk, *zip(*chunks)))
+    for part, start in zip(parts, bounds[:-1]):
+        part['spectrum'] = part['spectrum'] + start
+    envelopes = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]} if parts else \
+        {name: np.zeros(0) for name in MASS_COLUMNS}
+    position = envelopes['spectrum'].astype(np.int64)
+    masses = pd.DataFrame({
+        'spectrum': spectra['keys'][position].astype(np.int32), 'rt': spectra['rt'][position].astype(np.float32),
+        'neutral_mass': envelopes['neutral_mass'].astype(np.float64),
+        'charge': envelopes['charge'].astype(np.int8),
+        'monoisotopic_m/z': envelopes['monoisotopic_m/z'].astype(np.float64),
+        'intensity': envelopes['intensity'].astype(np.float32), 'isotopes': envelopes['isotopes'].astype(np.int8),
+        'score': envelopes['score'].astype(np.float32)}, columns=MASS_COLUMNS)
+    logger.info(f'Found {len(masses)} isotope envelopes in {count} MS1 spectra of {path}')
+    return masses.sort_values('neutral_mass', kind='stable', ignore_index=True)
+
+
+def find_masses(masses: pd.DataFrame, mass: float, tolerance: float = TOLERANCE) -> pd.DataFrame:
+    """Envelopes of a mass table sorted by neutral mass within tolerance ppm of a neutral mass."""
+    values = masses['neutral_mass'].to_numpy()
+    width = mass * tolerance * 1e-6
+    return masses.iloc[np.searchsorted(values, mass - width, side='left'):
+                       np.searchsorted(values, mass + width, side='right')]
@@ -0,0 +1,56 @@
+import logging
+from typing import Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def minmax_downsample(x: np.ndarray, y: np.ndarray, width: int, x_min: Optional[float] = None,
+                      x_max: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Reduces a trace to the minimum and maximum point of every pixel column, so the plotted shape, including
+    every peak apex, looks the same as when plotting all points.
+
+    Parameters
+    ----------
+    x: np.ndarray
+        sorted x values, e.g. m/z values of a spectrum or retention times of a chromatogram
+    y: np.ndarray
+        y values, e.g. intensities
+    width: int
+        number of pixel columns of the plot
+    x_min, x_max: float
+        visible x range, the full range of the trace if None
+
+    Returns
+    -------
+    x, y: np.ndarray
+        at most 2 * width points inside the visible range, sorted by x
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(x) == 0:
+        return x, y
+    x_min = x[0] if x_min is None else x_min
+    x_max = x[-1] if x_max is None else x_max
+    lo = np.searchsorted(x, x_min, side='left')
+    hi = np.searchsorted(x, x_max, side='right')
+    x, y = x[lo:hi], y[lo:hi]
+    if len(x) <= 2 * width or x_max <= x_min:
+        return x, y
+
+    bins = ((x - x_min) * (width / (x_max - x_min))).astype(np.int64)
+    np.clip(bins, 0, width - 1, out=bins)
+    # x is sorted, so every pixel column is a contiguous segment
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    lengths = np.diff(np.r_[starts, len(x)])
+    keep = np.unique(np.concatenate([segment_arg(y, np.minimum.reduceat(y, starts), starts, lengths),
+                                     segment_arg(y, np.maximum.reduceat(y, starts), starts, lengths)]))
+    return x[keep], y[keep]
+
+
+def segment_arg(y: np.ndarray, extremes: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Returns the index of the first occurrence of each segment's extreme value."""
+    hits = np.flatnonzero(y == np.repeat(extremes, lengths))
+    return hits[np.searchsorted(hits, starts)]
@@ -0,0 +1,216 @@
+import os
+import re
+import logging
+from functools import lru_cache
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from ms_package.protein_cache import PROTEIN_COLUMNS
+from ms_package.profiling import profiled
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Amino acid letters are encoded as 1..26 (5 bits), 0 marks protein boundaries and unknown characters
+AA_CODES = np.zeros(256, dtype=np.int64)
+AA_CODES[np.frombuffer(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ", dtype=np.uint8)] = np.arange(1, 27)
+LETTER_CODES = {aa: code for code, aa in enumerate("ABCDEFGHIJKLMNOPQRSTUVWXYZ", start=1)}
+BITS = 5
+
+
+def read_fasta(fasta_path: str) -> List[Tuple[str, str]]:
+    """Reads the entries of a FASTA file.
+
+    Parameters
+    ----------
+    fasta_path: str
+        file path of the FASTA file
+
+    Returns
+    -------
+    entries: List[Tuple[str, str]]
+        list of (header, sequence) tuples
+    """
+    entries = list()
+    header, lines = None, list()
+    with open(fasta_path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('>'):
+                if header is not None:
+                    entries.append((header, ''.join(lines)))
+                header, lines = line[1:], list()
+            elif line:
+                lines.append(line)
+    if header is not None:
+        entries.append((header, ''.join(lines)))
+    return entries
+
+
+def parse_header(header: str) -> Tuple[str, Union[int, None]]:
+    """Extracts the accession and taxonomy id from a UniProt style FASTA header.
+
+    Parameters
+    ----------
+    header: str
+        FASTA header without the leading '>'
+
+    Returns
+    -------
+    accession: str
+        protein accession, e.g. P02769 for 'sp|P02769|ALBU_BOVIN ...'
+    taxid: int or None
+        taxonomy id from the OX= field if present
+    """
+    identifier = header.split()[0] if header else ''
+    parts = identifier.split('|')
+    accession = parts[1] if len(parts) >= 3 else identifier
+    taxid = re.search(r'\bOX=(\d+)', header)
+    return accession, int(taxid.group(1)) if taxid else None
+
+
+def encode_peptides(peptides: List[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Encodes the first k residues of each peptide into the range of k-mer codes starting with the peptide.
+
+    Parameters
+    ----------
+    peptides: List[str]
+        peptide sequences
+    k: int
+        k-mer length of the index
+
+    Returns
+    -------
+    low, high: np.ndarray
+        half open ranges [low, high) of k-mer codes matching each peptide prefix
+    """
+    low = np.zeros(len(peptides), dtype=np.int64)
+    high = np.zeros(len(peptides), dtype=np.int64)
+    for i, pep in enumerate(peptides):
+        prefix = pep[:k]
+        code = 0
+        for aa in prefix:
+            c = LETTER_CODES.get(aa)
+            if c is None:
+                break
+            code = (code << BITS) | c
+        else:
+            if prefix:  # empty peptides and unknown characters never match
+                shift = BITS * (k - len(prefix))
+                low[i], high[i] = code << shift, (code + 1) << shift
+    return low, high
+
+
+class ProteomeIndex:
+    """Maps peptides to the proteins of local FASTA files without The Proteins API.
+
+    The concatenated proteome is indexed by the k-mer starting at every position (a suffix array truncated
+    to k residues), so each peptide is located with a binary search over the sorted k-mer codes and only
+    the candidate positions are verified.
+    """
+
+    def __init__(self, fasta_paths: Union[str, List[str]], k: int = 6):
+        """
+        parameters:
+            fasta_paths = file path(s) of FASTA files, e.g. a UniProt proteome
+            k = number of residues in the index keys, at most 12
+        """
+        if isinstance(fasta_paths, str):
+            fasta_paths = [fasta_paths]
+        self.fasta_paths = [str(path) for path in fasta_paths]
+        self.k = k
+
+        self.accessions = list()
+        self.taxids = list()
+        self.sources = list()
+        self.sequences = list()
+        for path in self.fasta_paths:
+            for header, sequence in read_fasta(path):
+                accession, taxid = parse_header(header)
+                self.accessions.append(accession)
+                self.taxids.append(taxid)
+                self.sources.append(os.path.basename(path))
+                self.sequences.append(sequence.upper())
+
+        # proteins are separated by a 0 code, so no k-mer with a match spans two proteins
+        self.text = '\0'.join(self.sequences) + '\0'
+        lengths = np.array([len(seq) + 1 for seq in self.sequences], dtype=np.int64)
+        self.starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+
+        encoded = AA_CODES[np.frombuffer(self.text.encode('ascii', 'replace'), dtype=np.uint8)]
+        encoded = np.concatenate([encoded, np.zeros(k, dtype=np.int64)])
+        n = len(self.text)
+        kmers = np.zeros(n, dtype=np.int64)
+        for j in range(k):
+            kmers = (kmers << BITS) | encoded[j:j + n]
+        self.positions = np.argsort(kmers, kind='stable').astype(np.int64)
+        self.kmers = kmers[self.positions]
+        logger.info(f'Indexed {len(self.sequences)} proteins with {n} residues from {self.fasta_paths}')
+
+    def find(self, peptides: List[str]) -> Dict[str, np.ndarray]:
+        """Finds all occurrences of the peptides in the proteome.
+
+        Parameters
+        ----------
+        peptides: List[str]
+            peptide sequences
+
+        Returns
+        -------
+        occurrences: Dict[str, np.ndarray]
+            positions in the concatenated proteome for each peptide with at least one match
+        """
+        unique = list(dict.fromkeys(peptides))
+        low, high = encode_peptides(unique, self.k)
+        first = np.searchsorted(self.kmers, low, side='left')
+        last = np.searchsorted(self.kmers, high, side='left')
+        occurrences = dict()
+        for pep, i, j in zip(unique, first, last):
+            if i == j:
+                continue
+            candidates = self.positions[i:j]
+            if len(pep) > self.k:
+                text = self.text
+                candidates = np.array([p for p in candidates if text.startswith(pep, p)], dtype=np.int64)
+            if len(candidates):
+                occurrences[pep] = np.sort(candidates)
+        return occurrences
+
+    @profiled()
+    def map_peptides(self, peptides: List[str]) -> pd.DataFrame:
+        """Maps the peptides to proteins.
+
+        Parameters
+        ----------
+        peptides: List[str]
+            peptide sequences
+
+        Returns
+        -------
+        dataframe :
+            Dataframe of protein identification values with the same columns as ProteinSearch.parse_content.
+        """
+        rows = list()
+        for pep, positions in self.find(peptides).items():
+            proteins = np.searchsorted(self.starts, positions, side='right') - 1
+            for protein, position in zip(proteins, positions):
+                begin = int(position - self.starts[protein]) + 1
+                rows.append((pep, self.accessions[protein], self.taxids[protein], self.sources[protein],
+                             f"{begin} to {begin + len(pep) - 1}", self.sequences[protein]))
+        logger.info(f'Mapped {len(rows)} peptide occurrences to the local proteome')
+        return pd.DataFrame(rows, columns=PROTEIN_COLUMNS)
+
+
+@lru_cache(maxsize=8)
+def _load_index(fasta_paths: Tuple[str, ...], mtimes: Tuple[float, ...], k: int) -> ProteomeIndex:
+    return ProteomeIndex(list(fasta_paths), k=k)
+
+
+def get_index(fasta_paths: Union[str, List[str]], k: int = 6) -> ProteomeIndex:
+    """Returns the index of the FASTA files, reusing an index built before if the files did not change."""
+    if isinstance(fasta_paths, str):
+        fasta_paths = [fasta_paths]
+    fasta_paths = tuple(str(path) for path in fasta_paths)
+    return _load_index(fasta_paths, tuple(os.path.getmtime(path) for path in fasta_paths), k)
@@ -0,0 +1,148 @@
+import os
+import re
+import json
+import time
+import logging
+import argparse
+from xml.dom import minidom as md
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ms_package.reader import Reader, VALUE_COLUMNS
+from ms_package.compressed import compression_of, strip_compression
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+SPECTRUM_START = re.compile(rb'<spectrum[\s>]')
+SPECTRUM_END = b'</spectrum>'
+SPECTRUM_LIST_END = b'</spectrumList>'
+COLUMNS = VALUE_COLUMNS + ['scan_time']  # columns of the values returned by SpectrumFollower.poll
+
+
+class SpectrumFollower:
+    """Reads the spectra appended to an mzML file that is still being written, e.g. by the instrument.
+
+    Every poll reads the file from the end of the last complete <spectrum> element, so a spectrum that is only
+    partly written is picked up by the next poll and nothing is read twice. The byte position can be saved to a
+    checkpoint file to continue after a restart.
+    """
+
+    def __init__(self, path: str, checkpoint_path: Optional[str] = None, decode: bool = True):
+        """
+        parameters:
+            path = file path of the uncompressed mzML file
+            checkpoint_path = JSON file to keep the byte position in between runs, not saved if None
+            decode = decode the m/z and intensity arrays of the new spectra
+        """
+        self.reader = Reader(path)
+        if not self.reader.check_extension() or self.reader.format != 'mzml':
+            logger.warning('Following a file is only available for .mzML files.')
+            raise argparse.ArgumentTypeError('Following a file is only available for .mzML files.')
+        if strip_compression(path) != path or (os.path.exists(path) and compression_of(path) is not None):
+            # the byte positions of the follower are those of the plain file
+            logger.warning('Following a file is not available for compressed files.')
+            raise argparse.ArgumentTypeError('Following a file is not available for compressed files, '
+                                             'follow the uncompressed .mzML file.')
+        self.path = path
+        self.checkpoint_path = checkpoint_path
+        self.decode = decode
+        self.position = 0  # byte offset after the last complete spectrum
+        self.count = 0  # number of spectra read so far
+        self.finished = False  # True once the end of the spectrum list was written
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            self.load_checkpoint()
+
+    def load_checkpoint(self):
+        """Restores the byte position of an earlier run."""
+        with open(self.checkpoint_path) as f:
+            state = json.load(f)
+        if state.get('path') == os.path.abspath(self.path):
+            self.position, self.count, self.finished = state['position'], state['count'], state['finished']
+
+    def save_checkpoint(self):
+        """Saves the byte position atomically."""
+        state = {'path': os.path.abspath(self.path), 'position': self.position, 'count': self.count,
+                 'finished': self.finished}
+        with open(self.checkpoint_path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+    def read_new(self) -> list:
+        """Reads the complete spectrum elements appended since the last call and advances the position."""
+        size = os.path.getsize(self.path)
+        if size < self.position:
+            logger.warning(f'{self.path} was truncated, reading it from the start')
+            self.position, self.count, self.finished = 0, 0, False
+        if size == self.position:
+            return list()
+        with open(self.path, 'rb') as f:
+            f.seek(self.position)
+            data = f.read(size - self.position)
+        elements = list()
+        end = 0
+        while True:
+            start = SPECTRUM_START.search(data, end)
+            if start is None:
+                break
+            stop = data.find(SPECTRUM_END, start.start())
+            if stop < 0:
+                break  # not completely written yet
+            end = stop + len(SPECTRUM_END)
+            elements.append(data[start.start():end])
+        if SPECTRUM_LIST_END in data[end:]:
+            self.finished = True
+        self.position += end
+        return elements
+
+    def poll(self) -> Tuple[pd.DataFrame, Dict[int, Dict]]:
+        """Reads and analyses the spectra appended since the last poll.
+
+        Returns
+        -------
+        df_values: pd.DataFrame
+            summary values of the new spectra as in Reader.analyse_spectrum and their scan time in seconds
+        spectrum_data: Dict[int, Dict]
+            decoded m/z and intensity arrays of the new spectra, empty if decode is False
+        """
+        elements = self.read_new()
+        spectrum_dict = dict()
+        for element in elements:
+            spectrum = md.parseString(element).documentElement
+            spectrum_dict[int(spectrum.getAttribute('index'))] = spectrum
+        spectrum_data = dict()
+        if spectrum_dict and self.decode:
+            self.reader.get_compression(spectrum_dict)
+            self.reader.get_binary_spectrum_values(spectrum_dict)
+            self.reader.decode_decompress()
+            spectrum_data = self.reader.spectrum_data
+        values = self.reader.get_values(spectrum_dict)
+        values['spectra_id'] += self.count  # get_values numbers the spectra of this poll from 0
+        scan_times = self.reader.get_scan_times(spectrum_dict)
+        values['scan_time'] = np.array([scan_times[key] for key in values.index], dtype=np.float64)
+        self.count += len(spectrum_dict)
+        if self.checkpoint_path:
+            self.save_checkpoint()
+        if spectrum_dict:
+            logger.info(f'Read {len(spectrum_dict)} new spectra from {self.path}, {self.count} so far')
+        return values[COLUMNS], spectrum_data
+
+    def follow(self, interval: float = 2.0, idle_timeout: Optional[float] = None) -> Iterator[Tuple[pd.DataFrame,
+                                                                                                      Dict[int, Dict]]]:
+        """Polls the file every interval seconds and yields the new spectra of each poll that found some.
+
+        Stops when the end of the spectrum list was written or no spectra were appended for idle_timeout seconds.
+        """
+        last_change = time.monotonic()
+        while not self.finished:
+            df_values, spectrum_data = self.poll()
+            if len(df_values):
+                last_change = time.monotonic()
+                yield df_values, spectrum_data
+            elif idle_timeout is not None and time.monotonic() - last_change > idle_timeout:
+                logger.info(f'No new spectra in {self.path} for {idle_timeout} s, stopped following')
+                return
+            if not self.finished:
+                time.sleep(interval)
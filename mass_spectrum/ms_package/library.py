@@ -0,0 +1,357 @@
+import os
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ms_package.reader import Reader
+from ms_package.profiling import profiled, profiler
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# binning of the fragment m/z values, the unit mass bins of low resolution searches by default
+BIN_WIDTH = 1.0005079
+BIN_OFFSET = 0.4
+MIN_MZ = 100.0
+MAX_MZ = 2000.0
+MAX_PEAKS = 150  # most intense peaks kept per spectrum
+INDEX_PEAKS = 5  # most intense bins of every spectrum in the approximate index
+LIBRARY_ARRAYS = ('keys', 'precursor_mz', 'charge', 'peptides', 'indptr', 'indices', 'data', 'rows',
+                  'postings_indptr', 'postings_rows')
+
+
+def top_in_rows(rows: np.ndarray, values: np.ndarray, count: int) -> np.ndarray:
+    """Mask of the count largest values of every row, for sorted row numbers and positive values."""
+    if len(rows) == 0:
+        return np.zeros(0, dtype=bool)
+    first = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    sizes = np.diff(np.r_[first, len(rows)])
+    scale = np.repeat(np.maximum.reduceat(values, first), sizes)
+    # one float sort key (row, then decreasing value) sorts much faster than np.lexsort
+    order = np.argsort(rows + 0.5 * (1.0 - values / scale), kind='stable')
+    keep = np.zeros(len(rows), dtype=bool)
+    keep[order[np.arange(len(rows)) - np.repeat(first, sizes) < count]] = True
+    return keep
+
+
+def bin_spectra(mz: np.ndarray, intensity: np.ndarray, offsets: np.ndarray, bin_width: float = BIN_WIDTH,
+                bin_offset: float = BIN_OFFSET, min_mz: float = MIN_MZ, max_mz: float = MAX_MZ,
+                max_peaks: Optional[int] = MAX_PEAKS) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Turns spectra into L2 normalised sparse vectors of the square root intensities binned by m/z.
+
+    The vectors are stored like a CSR matrix: the bins of the i-th spectrum are indices[indptr[i]:indptr[i + 1]],
+    sorted, with their values at the same positions in data. The dot product of two vectors is their cosine
+    similarity.
+
+    Parameters
+    ----------
+    mz, intensity, offsets: np.ndarray
+        flat peak arrays of the spectra as returned by Reader.get_spectrum_arrays
+    bin_width, bin_offset: float
+        m/z width of a bin and offset of the bin boundaries in units of the bin width
+    min_mz, max_mz: float
+        m/z range of the vectors, peaks outside are dropped
+    max_peaks: int
+        number of most intense peaks kept per spectrum, all if None
+
+    Returns
+    -------
+    indptr: np.ndarray
+        the vector of the i-th spectrum is stored at indptr[i]:indptr[i + 1]
+    indices: np.ndarray
+        bins of the non-zero values
+    data: np.ndarray
+        normalised values
+    """
+    count = len(offsets) - 1
+    rows = np.repeat(np.arange(count, dtype=np.int64), np.diff(offsets))
+    keep = (mz >= min_mz) & (mz < max_mz) & (intensity > 0)
+    rows, mz, intensity = rows[keep], mz[keep], intensity[keep]
+    if max_peaks is not None and len(rows) and np.bincount(rows).max() > max_peaks:
+        keep = top_in_rows(rows, intensity, max_peaks)
+        rows, mz, intensity = rows[keep], mz[keep], intensity[keep]
+    bins = np.floor(mz / bin_width + bin_offset).astype(np.int64)
+    # one value per spectrum and bin, summing the peaks falling into the same bin
+    keys = rows * (int(max_mz / bin_width + bin_offset) + 1) + bins
+    if np.all(keys[1:] >= keys[:-1]):  # decoded spectra are sorted by m/z
+        order = np.arange(len(keys))
+    else:
+        order = np.argsort(keys, kind='stable')
+    keys, values = keys[order], np.sqrt(intensity[order])
+    first = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+    data = np.add.reduceat(values, first) if len(first) else np.zeros(0)
+    rows, indices = rows[order][first], bins[order][first]
+    norms = np.sqrt(np.bincount(rows, weights=data ** 2, minlength=count))
+    data = data / np.where(norms > 0, norms, 1.0)[rows]
+    indptr = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=count), out=indptr[1:])
+    return indptr, indices.astype(np.int32), data.astype(np.float32)
+
+
+def read_spectra(path: str, ms_level: int = 2) -> Dict[str, np.ndarray]:
+    """Reads the decoded spectra of one ms level of an mzML file.
+
+    Parameters
+    ----------
+    path: str
+        file path of the mzML file
+    ms_level: int
+        1 for the survey spectra (spectra without ms level count as MS1), 2 for the MS2 spectra with a precursor
+
+    Returns
+    -------
+    spectra: Dict[str, np.ndarray]
+        'keys' (spectrum ids), 'precursor_mz' (NaN for MS1), 'charge' (0 if not annotated), 'rt' (seconds) and
+        the flat peak arrays 'mz', 'intensity' and 'offsets' as returned by Reader.get_spectrum_arrays
+    """
+    reader = Reader(path)
+    if not reader.check_extension() or reader.format != 'mzml':
+        raise ValueError('Decoded spectra are only available for .mzML files.')
+    reader.analyse_spectrum()
+    keys, mz, intensity, offsets = reader.get_spectrum_arrays()
+    if ms_level == 1:
+        selected = np.flatnonzero([(reader.precursors[key]['ms_level'] or 1) == 1 for key in keys])
+    else:
+        selected = np.flatnonzero([reader.precursors[key]['ms_level'] == ms_level and
+                                   reader.precursors[key]['precursor_mz'] is not None for key in keys])
+    lengths = np.diff(offsets)[selected]
+    peaks = np.repeat(offsets[selected] - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+    keys = keys[selected]
+    return {'keys': keys,
+            'precursor_mz': np.array([reader.precursors[key]['precursor_mz'] or np.nan for key in keys],
+                                     dtype=np.float64),
+            'charge': np.array([reader.precursors[key]['charge'] or 0 for key in keys], dtype=np.int16),
+            'rt': np.array([reader.scan_times.get(key, np.nan) for key in keys], dtype=np.float64),
+            'mz': mz[peaks], 'intensity': intensity[peaks], 'offsets': np.r_[0, np.cumsum(lengths)]}
+
+
+def run_vectors(path: str, **binning) -> Dict[str, np.ndarray]:
+    """Reads an mzML file and bins its MS2 spectra.
+
+    Returns
+    -------
+    vectors: Dict[str, np.ndarray]
+        'keys', 'precursor_mz', 'charge' and 'rt' as returned by read_spectra and the sparse vectors 'indptr',
+        'indices' and 'data' as returned by bin_spectra
+    """
+    spectra = read_spectra(path)
+    with profiler.stage('library.bin_spectra'):
+        indptr, indices, data = bin_spectra(spectra['mz'], spectra['intensity'], spectra['offsets'], **binning)
+    profiler.count('library.spectra', len(spectra['keys']))
+    vectors = {name: spectra[name] for name in ('keys', 'precursor_mz', 'charge', 'rt')}
+    vectors.update(indptr=indptr, indices=indices, data=data)
+    return vectors
+
+
+class SpectralLibrary:
+    """Spectral library of binned MS2 spectra, searchable by cosine similarity.
+
+    The spectra are sorted by precursor m/z, so the candidates of a query within the precursor tolerance are a
+    contiguous slice of the vectors and are scored exactly with one sparse dot product per candidate. For wide
+    precursor windows (open modification search) the approximate index lists the spectra by their most intense
+    bins and only spectra sharing one of the most intense bins with the query are scored.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], params: Dict):
+        """
+        parameters:
+            arrays = library arrays sorted by precursor m/z, see LIBRARY_ARRAYS
+            params = binning parameters and number of bins per spectrum in the approximate index
+        """
+        self.keys = arrays['keys']  # spectrum ids in the run the library was built from
+        self.precursor_mz = arrays['precursor_mz']
+        self.charge = arrays['charge']
+        self.peptides = arrays['peptides']
+        self.indptr = arrays['indptr']
+        self.indices = arrays['indices']
+        self.data = arrays['data']
+        self.rows = arrays['rows']  # spectrum of every non-zero value
+        self.postings_indptr = arrays['postings_indptr']  # spectra with the bin b in their most intense bins
+        self.postings_rows = arrays['postings_rows']  # are postings_rows[postings_indptr[b]:postings_indptr[b + 1]]
+        self.params = params
+        self.n_bins = int(params['max_mz'] / params['bin_width'] + params['bin_offset']) + 1
+
+    def __len__(self) -> int:
+        return len(self.precursor_mz)
+
+    @classmethod
+    @profiled()
+    def build(cls, vectors: Dict[str, np.ndarray], peptides: Optional[Dict[int, str]] = None,
+              index_peaks: int = INDEX_PEAKS, **binning) -> 'SpectralLibrary':
+        """Builds a library from binned spectra.
+
+        Parameters
+        ----------
+        vectors: Dict[str, np.ndarray]
+            binned spectra as returned by run_vectors
+        peptides: Dict[int, str]
+            peptide identified for the spectrum ids, unidentified spectra are left out of the library.
+            All spectra are kept with an empty peptide if None
+        index_peaks: int
+            number of most intense bins of every spectrum in the approximate index
+        binning:
+            parameters passed to bin_spectra for the vectors
+        """
+        params = {'bin_width': BIN_WIDTH, 'bin_offset': BIN_OFFSET, 'min_mz': MIN_MZ, 'max_mz': MAX_MZ,
+                  'max_peaks': MAX_PEAKS}
+        params.update(binning)
+        params['index_peaks'] = index_peaks
+        keys = vectors['keys']
+        labels = np.array([peptides.get(int(key), '') if peptides else '' for key in keys], dtype=str)
+        selected = np.flatnonzero(labels != '') if peptides else np.arange(len(keys))
+        selected = selected[np.argsort(vectors['precursor_mz'][selected], kind='stable')]
+        indptr = vectors['indptr']
+        lengths = indptr[selected + 1] - indptr[selected]
+        new_indptr = np.zeros(len(selected) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=new_indptr[1:])
+        positions = np.repeat(indptr[selected] - new_indptr[:-1], lengths) + np.arange(new_indptr[-1])
+        indices, data = vectors['indices'][positions], vectors['data'][positions]
+        rows = np.repeat(np.arange(len(selected), dtype=np.int32), lengths)
+        # approximate index: (bin, spectrum) pairs of the most intense bins, grouped by bin
+        top = np.flatnonzero(top_in_rows(rows, data, index_peaks))
+        top = top[np.argsort(indices[top], kind='stable')]  # by bin, then spectrum
+        library = cls({'keys': keys[selected], 'precursor_mz': vectors['precursor_mz'][selected],
+                       'charge': vectors['charge'][selected], 'peptides': labels[selected], 'indptr': new_indptr,
+                       'indices': indices, 'data': data, 'rows': rows, 'postings_indptr': None,
+                       'postings_rows': rows[top]}, params)
+        postings_indptr = np.zeros(library.n_bins + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indices[top], minlength=library.n_bins), out=postings_indptr[1:])
+        library.postings_indptr = postings_indptr
+        logger.info(f'Built a spectral library of {len(library)} spectra')
+        return library
+
+    @classmethod
+    def from_file(cls, path: str, peptides: Optional[Dict[int, str]] = None, index_peaks: int = INDEX_PEAKS,
+                  **binning) -> 'SpectralLibrary':
+        """Builds a library from the MS2 spectra of an mzML file, see build."""
+        return cls.build(run_vectors(path, **binning), peptides=peptides, index_peaks=index_peaks, **binning)
+
+    def save(self, directory: str):
+        """Saves the library as one .npy file per array, which load memory maps."""
+        os.makedirs(directory, exist_ok=True)
+        for name in LIBRARY_ARRAYS:
+            np.save(os.path.join(directory, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(directory, 'library.json'), 'w') as f:
+            json.dump(self.params, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> 'SpectralLibrary':
+        """Loads a saved library, memory mapped by default so that processes searching it share the pages."""
+        with open(os.path.join(directory, 'library.json')) as f:
+            params = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r' if mmap else None)
+                  for name in LIBRARY_ARRAYS}
+        return cls(arrays, params)
+
+    def candidates(self, query_indices: np.ndarray, query_data: np.ndarray, lo: int, hi: int) -> np.ndarray:
+        """Spectra in [lo, hi) sharing one of the most intense bins of the query, from the approximate index."""
+        top = query_indices[np.argsort(-query_data, kind='stable')[:self.params['index_peaks']]]
+        found = list()
+        for b in top[top < self.n_bins]:
+            rows = self.postings_rows[self.postings_indptr[b]:self.postings_indptr[b + 1]]
+            found.append(rows[np.searchsorted(rows, lo):np.searchsorted(rows, hi)])
+        return np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+    @profiled()
+    def search(self, queries: Dict[str, np.ndarray], tolerance: float = 0.05, unit: str = 'Da', top: int = 1,
+               approximate: bool = False, min_score: float = 0.0) -> pd.DataFrame:
+        """Matches binned query spectra against the library.
+
+        Parameters
+        ----------
+        queries: Dict[str, np.ndarray]
+            binned query spectra as returned by run_vectors, with the same binning as the library
+        tolerance: float
+            precursor m/z tolerance
+        unit: str
+            'Da' or 'ppm'
+        top: int
+            number of best matches reported per query
+        approximate: bool
+            only score the spectra sharing one of the most intense bins with the query, for wide tolerances
+        min_score: float
+            matches with a lower cosine similarity are not reported
+
+        Returns
+        -------
+        matches: pd.DataFrame
+            query spectrum id, rank, library index and spectrum id, peptide, precursor m/z and charge of the
+            library spectrum and the cosine similarity
+        """
+        if unit not in ('Da', 'ppm'):
+            raise ValueError(f"unit must be 'Da' or 'ppm', not {unit!r}")
+        precursor_mz, charge = queries['precursor_mz'], queries['charge']
+        width = tolerance if unit == 'Da' else precursor_mz * tolerance * 1e-6
+        window_lo = np.searchsorted(self.precursor_mz, precursor_mz - width, side='left')
+        window_hi = np.searchsorted(self.precursor_mz, precursor_mz + width, side='right')
+        dense = np.zeros(self.n_bins, dtype=np.float32)
+        q_indptr, q_indices, q_data = queries['indptr'], queries['indices'], queries['data']
+        results = list()
+        for q in range(len(precursor_mz)):
+            lo, hi = int(window_lo[q]), int(window_hi[q])
+            if lo == hi:
+                continue
+            bins, values = q_indices[q_indptr[q]:q_indptr[q + 1]], q_data[q_indptr[q]:q_indptr[q + 1]]
+            inside = bins < self.n_bins
+            dense[bins[inside]] = values[inside]
+            if approximate:
+                rows = self.candidates(bins, values, lo, hi)
+                lengths = self.indptr[rows + 1] - self.indptr[rows]
+                positions = (np.repeat(self.indptr[rows] - (np.cumsum(lengths) - lengths), lengths) +
+                             np.arange(lengths.sum()))
+                local = np.repeat(np.arange(len(rows)), lengths)
+            else:
+                rows = np.arange(lo, hi)
+                positions = slice(self.indptr[lo], self.indptr[hi])
+                local = self.rows[positions] - lo
+            products = self.data[positions] * dense[self.indices[positions]]
+            scores = np.bincount(local, weights=products, minlength=len(rows))
+            dense[bins[inside]] = 0.0
+            if charge[q] > 0:
+                library_charge = self.charge[rows]
+                scores[(library_charge > 0) & (library_charge != charge[q])] = -1.0
+            best = np.argsort(-scores, kind='stable')[:top]
+            best = best[scores[best] > min_score]
+            for rank, i in enumerate(best, start=1):
+                results.append((int(queries['keys'][q]), rank, int(rows[i]), float(scores[i])))
+        profiler.count('library.queries', len(precursor_mz))
+        matches = pd.DataFrame(results, columns=['query', 'rank', 'library_index', 'score'])
+        index = matches['library_index'].to_numpy()
+        matches.insert(3, 'library_spectrum', np.asarray(self.keys)[index])
+        matches.insert(4, 'peptide', np.asarray(self.peptides)[index])
+        matches.insert(5, 'precursor_m/z', np.asarray(self.precursor_mz)[index])
+        matches.insert(6, 'charge', np.asarray(self.charge)[index])
+        return matches
+
+
+def search_chunk(library_dir: str, queries: Dict[str, np.ndarray], options: Dict) -> pd.DataFrame:
+    """Searches a part of the queries against a saved library in a worker process."""
+    return SpectralLibrary.load(library_dir).search(queries, **options)
+
+
+def search_file(library_dir: str, path: str, workers: int = 1, **options) -> pd.DataFrame:
+    """Searches the MS2 spectra of an mzML file against a saved library.
+
+    The queries are binned like the library and split between workers processes, which memory map the library.
+    See SpectralLibrary.search for the options and the returned matches.
+    """
+    library = SpectralLibrary.load(library_dir)
+    binning = {name: library.params[name] for name in ('bin_width', 'bin_offset', 'min_mz', 'max_mz', 'max_peaks')}
+    queries = run_vectors(path, **binning)
+    if workers <= 1 or len(queries['keys']) < 2 * workers:
+        return library.search(queries, **options)
+    bounds = np.linspace(0, len(queries['keys']), workers + 1).astype(np.int64)
+    chunks = list()
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        indptr = queries['indptr'][start:end + 1]
+        chunks.append({'keys': queries['keys'][start:end], 'precursor_mz': queries['precursor_mz'][start:end],
+                       'charge': queries['charge'][start:end], 'indptr': indptr - indptr[0],
+                       'indices': queries['indices'][indptr[0]:indptr[-1]],
+                       'data': queries['data'][indptr[0]:indptr[-1]]})
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parts = list(executor.map(search_chunk, [library_dir] * len(chunks), chunks, [options] * len(chunks)))
+    return pd.concat(parts, ignore_index=True)
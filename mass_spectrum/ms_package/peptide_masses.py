@@ -0,0 +1,211 @@
+import re
+import logging
+from functools import lru_cache
+from itertools import product
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ms_package.profiling import profiled
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+PROTON = 1.007276
+WATER = {False: 18.010565, True: 18.01528}  # monoisotopic and average
+RESIDUE_MASSES = {  # monoisotopic and average residue masses
+    'G': (57.021464, 57.0519), 'A': (71.037114, 71.0788), 'S': (87.032028, 87.0782), 'P': (97.052764, 97.1167),
+    'V': (99.068414, 99.1326), 'T': (101.047679, 101.1051), 'C': (103.009185, 103.1388),
+    'L': (113.084064, 113.1594), 'I': (113.084064, 113.1594), 'N': (114.042927, 114.1038),
+    'D': (115.026943, 115.0886), 'Q': (128.058578, 128.1307), 'K': (128.094963, 128.1741),
+    'E': (129.042593, 129.1155), 'M': (131.040485, 131.1926), 'H': (137.058912, 137.1411),
+    'F': (147.068414, 147.1766), 'U': (150.953636, 150.0379), 'R': (156.101111, 156.1875),
+    'Y': (163.06332, 163.1760), 'W': (186.079313, 186.2132), 'O': (237.147727, 237.2982)}
+MODIFICATION_MASSES = {  # monoisotopic and average mass differences of the modifications named in sequences
+    'Oxidation': (15.994915, 15.9994), 'Carbamidomethyl': (57.021464, 57.0513), 'Phospho': (79.966331, 79.9799),
+    'Acetyl': (42.010565, 42.0367), 'Deamidated': (0.984016, 0.9848), 'Amidated': (-0.984016, -0.9848),
+    'Methyl': (14.01565, 14.0266), 'Dimethyl': (28.0313, 28.0532), 'Gln->pyro-Glu': (-17.026549, -17.0305),
+    'Glu->pyro-Glu': (-18.010565, -18.0153), 'Carbamyl': (43.005814, 43.0247)}
+MODIFICATION_PATTERN = re.compile(r'\(([^()]*)\)|\[([^\[\]]*)\]|\.')
+MAX_MODIFICATIONS = 2
+SPECIAL_CODES = np.zeros(256, dtype=bool)  # characters starting a modification in a sequence
+SPECIAL_CODES[[ord('('), ord('['), ord('.')]] = True
+
+
+@lru_cache(maxsize=None)
+def residue_table(average: bool = False, fixed: Tuple[Tuple[str, float], ...] = ()) -> np.ndarray:
+    """Residue masses indexed by the ASCII code of the one letter code, NaN for unknown residues.
+
+    Memoized for every mass type and set of fixed modifications (residue, mass difference), the returned array
+    is read only.
+    """
+    table = np.full(256, np.nan)
+    for residue, masses in RESIDUE_MASSES.items():
+        table[ord(residue)] = masses[average]
+    for residue, delta in fixed:
+        table[ord(residue)] += delta
+    table.setflags(write=False)
+    return table
+
+
+@lru_cache(maxsize=None)
+def modification_combinations(modifications: int, max_modifications: int) -> np.ndarray:
+    """Every number of sites of each of the modifications with at most max_modifications in total, one row per
+    combination and the unmodified combination first."""
+    combinations = [counts for counts in product(range(max_modifications + 1), repeat=modifications)
+                    if sum(counts) <= max_modifications]
+    combinations = np.array(sorted(combinations, key=sum), dtype=np.int64).reshape(-1, modifications)
+    combinations.setflags(write=False)
+    return combinations
+
+
+def modification_mass(name: str, average: bool = False) -> float:
+    """Mass difference of a modification named in a sequence, a name of MODIFICATION_MASSES or a signed number
+    as in PEPM[+15.995]K, NaN if unknown."""
+    if name in MODIFICATION_MASSES:
+        return MODIFICATION_MASSES[name][average]
+    try:
+        return float(name)
+    except ValueError:
+        return np.nan
+
+
+def join_sequences(sequences: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """ASCII codes of the upper case residues of all sequences and the offsets of every sequence."""
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    codes = np.frombuffer(''.join(sequences).upper().encode('ascii', errors='replace'), dtype=np.uint8)
+    return codes, offsets
+
+
+def segment_sums(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Sums of the segments values[offsets[i]:offsets[i + 1]], 0 for empty segments."""
+    sums = np.zeros(len(offsets) - 1, dtype=values.dtype)
+    filled = np.flatnonzero(offsets[1:] > offsets[:-1])
+    if len(filled):
+        sums[filled] = np.add.reduceat(values, offsets[filled])
+    return sums
+
+
+def encode(sequences: Sequence[str], average: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Encodes peptide sequences into one flat array of residue codes.
+
+    Modifications written into a sequence, like PEPM(Oxidation)K, .(Acetyl)PEPTIDE or PEPM[+15.995]K, are removed
+    from the residues and their mass differences summed per peptide.
+
+    Parameters
+    ----------
+    sequences: Sequence[str]
+        one letter code peptide sequences
+    average: bool
+        sum average instead of monoisotopic mass differences of the modifications
+
+    Returns
+    -------
+    codes: np.ndarray
+        ASCII codes (uint8) of the residues of all peptides
+    offsets: np.ndarray
+        the residues of peptide i are codes[offsets[i]:offsets[i + 1]]
+    deltas: np.ndarray
+        summed mass difference of the modifications written into every sequence
+    """
+    sequences = sequences if isinstance(sequences, list) else list(sequences)
+    deltas = np.zeros(len(sequences))
+    codes, offsets = join_sequences(sequences)
+    annotated = SPECIAL_CODES[codes]
+    if annotated.any():
+        # only the few sequences with modifications are parsed one at a time
+        sequences = list(sequences)
+        for i in np.unique(np.searchsorted(offsets, np.flatnonzero(annotated), side='right') - 1):
+            names = [groups[0] or groups[1] for groups in MODIFICATION_PATTERN.findall(sequences[i])]
+            deltas[i] = sum(modification_mass(name, average) for name in names if name)
+            sequences[i] = MODIFICATION_PATTERN.sub('', sequences[i])
+        codes, offsets = join_sequences(sequences)
+    return codes, offsets, deltas
+
+
+def fixed_tuple(fixed_modifications: Optional[Dict[str, float]]) -> Tuple[Tuple[str, float], ...]:
+    """Hashable form of fixed modifications for the memoized residue tables."""
+    return tuple(sorted((fixed_modifications or {}).items()))
+
+
+@profiled()
+def peptide_masses(sequences: Sequence[str], average: bool = False,
+                   fixed_modifications: Optional[Dict[str, float]] = None) -> np.ndarray:
+    """Neutral masses of peptides in one vectorised pass over their encoded residues.
+
+    Parameters
+    ----------
+    sequences: Sequence[str]
+        one letter code peptide sequences, see encode for modifications written into them
+    average: bool
+        average instead of monoisotopic masses
+    fixed_modifications: Dict[str, float]
+        mass difference added to every residue of a one letter code, e.g. {'C': 57.021464}
+
+    Returns
+    -------
+    masses: np.ndarray
+        neutral mass of every peptide, NaN for sequences with unknown residues or modifications
+    """
+    codes, offsets, deltas = encode(sequences, average)
+    table = residue_table(average, fixed_tuple(fixed_modifications))
+    return segment_sums(table[codes], offsets) + WATER[average] + deltas
+
+
+def mz_values(masses: np.ndarray, charges: Sequence[int] = (1, 2, 3)) -> np.ndarray:
+    """m/z of [M + zH]z+ ions of neutral masses, one column per charge."""
+    charges = np.asarray(charges, dtype=np.float64)
+    return (np.asarray(masses, dtype=np.float64)[:, None] + charges[None, :] * PROTON) / charges[None, :]
+
+
+def modification_sites(codes: np.ndarray, offsets: np.ndarray, residues: Sequence[str]) -> np.ndarray:
+    """Number of residues of every encoded peptide (rows, see encode) that each of the residue sets (columns,
+    e.g. 'M' or 'STY') can be modified at."""
+    sites = np.zeros((len(offsets) - 1, len(residues)), dtype=np.int64)
+    for column, residue_set in enumerate(residues):
+        targets = np.zeros(256, dtype=np.int64)
+        targets[[ord(residue) for residue in residue_set.upper()]] = 1
+        sites[:, column] = segment_sums(targets[codes], offsets)
+    return sites
+
+
+@profiled()
+def variable_masses(sequences: Sequence[str], variable_modifications: Dict[str, float],
+                    max_modifications: int = MAX_MODIFICATIONS, average: bool = False,
+                    fixed_modifications: Optional[Dict[str, float]] = None) -> Dict[str, np.ndarray]:
+    """Neutral masses of the peptides with every possible number of variable modifications.
+
+    The combinations of modification counts are the same for all peptides, so every peptide is tested against
+    all of them at once and only the combinations with enough modifiable residues are kept.
+
+    Parameters
+    ----------
+    sequences: Sequence[str]
+        one letter code peptide sequences
+    variable_modifications: Dict[str, float]
+        mass difference of every variable modification by the residues it can modify, e.g. {'M': 15.994915,
+        'STY': 79.966331}
+    max_modifications: int
+        maximum number of variable modifications per peptide
+    average, fixed_modifications:
+        see peptide_masses
+
+    Returns
+    -------
+    forms: Dict[str, np.ndarray]
+        'peptide' (position in sequences), 'mass' and 'modifications' (count of each variable modification, one
+        column per entry of variable_modifications) of every modified form, the unmodified forms included
+    """
+    codes, offsets, written = encode(sequences, average)
+    table = residue_table(average, fixed_tuple(fixed_modifications))
+    masses = segment_sums(table[codes], offsets) + WATER[average] + written
+    residues = list(variable_modifications)
+    deltas = np.array([variable_modifications[residue] for residue in residues], dtype=np.float64)
+    sites = modification_sites(codes, offsets, residues)
+    combinations = modification_combinations(len(residues), max_modifications)
+    possible = np.all(combinations[None, :, :] <= sites[:, None, :], axis=2)
+    peptide, combination = np.nonzero(possible)
+    return {'peptide': peptide, 'mass': masses[peptide] + combinations[combination] @ deltas,
+            'modifications': combinations[combination]}
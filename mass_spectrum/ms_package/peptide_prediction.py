@@ -1,9 +1,11 @@
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 from pyopenms import *
 import pandas as pd
 import numpy as np
 import logging
 
+from ms_package.profiling import profiled, profiler
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
@@ -12,15 +14,24 @@ class PeptideSearch:
     """Compares experimental mass spectrums from
     mzml file and fasta file to obtain peptide and peptide values."""
 
-    def __init__(self, fasta_path: str, mzml_path: str):
+    def __init__(self, fasta_path: Union[str, List[str]], mzml_path: str, workers: Optional[int] = None,
+                 shard_peptides: Optional[int] = None):
         """
         parameters:
-            fasta_path = file path of input fasta file
+            fasta_path = file path of input fasta file, or a list of several fasta files (e.g. proteome and
+                contaminants) which are searched as one deduplicated digest, see databases.search_databases
             mzml_path = file path of input mzml file consisting of mass spectrums
+            workers = number of processes searching the shards of the digest, the number of CPUs if None
+            shard_peptides = number of peptides per shard of the digest, also to shard a single large fasta file
         """
+        if not isinstance(fasta_path, str) and len(fasta_path) == 1:
+            fasta_path = str(fasta_path[0])
         self.fasta_path = fasta_path
         self.mzml_path = mzml_path
+        self.workers = workers
+        self.shard_peptides = shard_peptides
 
+    @profiled()
     def peptide_search(self) -> tuple[list, list]:
         """ This method uses SimpleSearchEngineAlgorithm that compares experimental spectrum data from mzml file
         with theoretical data from fasta file of protein sequences.
@@ -34,6 +45,9 @@ class PeptideSearch:
         protein_ids = list()
         peptide_ids = list()
 
+        if not isinstance(self.fasta_path, str):
+            raise ValueError('Several fasta files are searched as a digest by peptide_wrapper, '
+                             'see databases.search_databases')
         assert self.mzml_path.endswith('.mzML')
         assert self.fasta_path.endswith('.fasta')
 
@@ -42,6 +56,7 @@ class PeptideSearch:
         else:
             SimpleSearchEngineAlgorithm().search(self.mzml_path, self.fasta_path, protein_ids, peptide_ids)
             logger.info('mzml file and fasta file exists')
+            profiler.count('peptide_ids', len(peptide_ids))
             return protein_ids, peptide_ids
 
     @staticmethod
@@ -108,6 +123,10 @@ class PeptideSearch:
         peptide_list : list
             List of peptide hits.
         """
+        if not isinstance(self.fasta_path, str) or self.shard_peptides:
+            from ms_package.databases import SHARD_PEPTIDES, search_databases
+            return search_databases(self.fasta_path, self.mzml_path, workers=self.workers,
+                                    shard_peptides=self.shard_peptides or SHARD_PEPTIDES)
         peptide_ids = self.peptide_search()[1]
         peptide_info = self.get_peptide_identification_values(peptide_ids=peptide_ids)
         peptide_df = pd.DataFrame.from_dict(peptide_info, orient='index', columns=['Peptide ID m/z',
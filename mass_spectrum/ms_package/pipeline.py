@@ -0,0 +1,334 @@
+import os
+import glob
+import uuid
+import queue
+import pickle
+import hashlib
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+from ms_package.startup import DATA_DIR
+from ms_package.result_store import file_signature
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+PIPELINE_DIR = DATA_DIR.joinpath('pipeline')
+SHARD_SIZE = 500
+QUEUE_SIZE = 4
+DONE = object()  # end of stream marker passed between the stages
+
+
+class Stage:
+    """One step of a pipeline, applied to every item of the stream."""
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1, processes: bool = False):
+        """
+        parameters:
+            name = name of the stage, also used for the checkpoint files
+            func = function applied to each item, must be picklable if processes is True
+            workers = number of items processed concurrently
+            processes = run func in a process pool (CPU bound stages) instead of a thread pool (IO bound stages)
+        """
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.processes = processes
+
+
+class Checkpoints:
+    """Stores the output of every stage for every item, so an interrupted run resumes where it stopped."""
+
+    def __init__(self, work_dir: str):
+        self.work_dir = str(work_dir)
+        os.makedirs(self.work_dir, exist_ok=True)
+
+    def path(self, stage: str, index: int) -> str:
+        return os.path.join(self.work_dir, f'{stage}-{index:05d}.pkl')
+
+    def done(self, stage: str, index: int) -> bool:
+        return os.path.exists(self.path(stage, index))
+
+    def load(self, stage: str, index: int) -> Any:
+        with open(self.path(stage, index), 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, stage: str, index: int, value: Any):
+        """Writes the checkpoint atomically, so a killed run never leaves a truncated file behind. The temporary
+        file is unique, so runs of the same inputs sharing the work directory do not write into each other's."""
+        path = self.path(stage, index)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+
+def put(q: queue.Queue, item: Any, stop: threading.Event):
+    """Puts an item into a bounded queue, blocking while it is full unless the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def get(q: queue.Queue, stop: threading.Event) -> Any:
+    """Takes an item from a queue, returns DONE if the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return DONE
+
+
+def run_stages(source: Iterable, stages: List[Stage], checkpoints: Optional[Checkpoints] = None,
+               queue_size: int = QUEUE_SIZE) -> Iterator[Tuple[int, Any]]:
+    """Streams the items of source through the stages and yields (index, result) in source order.
+
+    Every stage runs in its own thread and passes its results to the next stage through a bounded queue, so all
+    stages work at the same time on different items and a slow stage holds back the ones before it instead of
+    letting the intermediate results pile up in memory. The throughput is that of the slowest stage.
+
+    Parameters
+    ----------
+    source: Iterable
+        items to process, read lazily in a separate thread
+    stages: List[Stage]
+        stages applied one after the other
+    checkpoints: Checkpoints
+        if given, results of finished items are saved and loaded instead of computed again
+    queue_size: int
+        maximum number of items waiting between two stages
+
+    Raises
+    -------
+    Exception: the first exception raised by the source or a stage, after all stages have stopped
+    """
+    stop = threading.Event()
+    errors = list()
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+    def read():
+        try:
+            for item in enumerate(source):
+                put(queues[0], item, stop)
+                if stop.is_set():
+                    return
+            put(queues[0], DONE, stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    def work(stage: Stage, inbox: queue.Queue, outbox: queue.Queue):
+        executor = (ProcessPoolExecutor if stage.processes else ThreadPoolExecutor)(max_workers=stage.workers)
+        pending = deque()
+
+        def forward():
+            index, future, cached = pending.popleft()
+            result = future.result()
+            if checkpoints is not None and not cached:
+                checkpoints.save(stage.name, index, result)
+            put(outbox, (index, result), stop)
+
+        try:
+            while True:
+                item = get(inbox, stop)
+                if item is DONE:
+                    break
+                index, value = item
+                if checkpoints is not None and checkpoints.done(stage.name, index):
+                    future = Future()
+                    future.set_result(checkpoints.load(stage.name, index))
+                    pending.append((index, future, True))
+                else:
+                    pending.append((index, executor.submit(stage.func, value), False))
+                # keep at most `workers` items in flight and pass finished ones on in order
+                while pending and (len(pending) >= stage.workers or pending[0][1].done()):
+                    forward()
+            while pending and not stop.is_set():
+                forward()
+            put(outbox, DONE, stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    threads = [threading.Thread(target=read, name='pipeline-source', daemon=True)]
+    for i, stage in enumerate(stages):
+        threads.append(threading.Thread(target=work, args=(stage, queues[i], queues[i + 1]),
+                                        name=f'pipeline-{stage.name}', daemon=True))
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            item = get(queues[-1], stop)
+            if item is DONE:
+                break
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
+
+def shard_spectra(mzml_path: str, shard_dir: str, shard_size: int = SHARD_SIZE) -> Iterator[str]:
+    """Splits an mzML file into mzML files of shard_size spectra each and yields their paths.
+
+    Indexed mzML files are read spectrum by spectrum through the index, so only one shard is held in memory.
+    Shards that already exist are not written again.
+    """
+    from pyopenms import MSExperiment, MzMLFile, OnDiscMSExperiment
+
+    os.makedirs(shard_dir, exist_ok=True)
+    experiment = OnDiscMSExperiment()
+    if experiment.openFile(str(mzml_path)):
+        count = experiment.getNrSpectra()
+        get_spectrum = experiment.getSpectrum
+    else:
+        logger.warning(f'{mzml_path} has no index, loading all spectra to split it')
+        experiment = MSExperiment()
+        MzMLFile().load(str(mzml_path), experiment)
+        count = experiment.getNrSpectra()
+        get_spectrum = experiment.getSpectrum
+    logger.info(f'Splitting {count} spectra of {mzml_path} into shards of {shard_size}')
+    for index, start in enumerate(range(0, count, shard_size)):
+        path = os.path.join(shard_dir, f'shard-{index:05d}.mzML')
+        if not os.path.exists(path):
+            shard = MSExperiment()
+            shard.setSpectra([get_spectrum(i) for i in range(start, min(start + shard_size, count))])
+            tmp_path = f'{path}.{uuid.uuid4().hex}.tmp.mzML'  # unique for runs sharing the work directory
+            MzMLFile().store(tmp_path, shard)
+            os.replace(tmp_path, path)
+        yield path
+
+
+def search_shard(fasta_path: Union[str, List[str]], shard_path: str):
+    """Peptide search stage, see PeptideSearch.peptide_wrapper. Runs in a worker process, which searches the
+    shards of the digest of several fasta files one after the other."""
+    from ms_package.peptide_prediction import PeptideSearch
+    return PeptideSearch(fasta_path=fasta_path, mzml_path=shard_path, workers=1).peptide_wrapper()
+
+
+def map_shard(database: Optional[str], search_result):
+    """Protein mapping stage, see ProteinSearch.get_proteins. Peptides seen in earlier shards are answered by the
+    protein cache or the FASTA index without calling The Proteins API again."""
+    from ms_package.protein_prediction import ProteinSearch
+    hits, peptides = search_result
+    pro_search = ProteinSearch(peptides, fasta_path=database)
+    pro_search.get_proteins()
+    return hits, pro_search.ans_df
+
+
+def cluster_settings() -> Tuple[float, float, float, float]:
+    """Settings of the clustering of the pipeline, which the consensus spectra and their shards depend on."""
+    from ms_package.clustering import MIN_FRACTION, MIN_SIMILARITY, PRECURSOR_TOLERANCE, RT_TOLERANCE
+    return PRECURSOR_TOLERANCE, RT_TOLERANCE, MIN_SIMILARITY, MIN_FRACTION
+
+
+def work_dir_for(fasta_path: Union[str, List[str]], mzml_path: str, database: Optional[str], shard_size: int,
+                 cluster: bool = False, root: Optional[str] = None) -> str:
+    """Checkpoint directory of a run inside root (PIPELINE_DIR if None), which changes whenever an input file, the
+    sharding or the clustering settings change. The consensus spectra of a clustered run are kept in it, so they
+    are only reused for the same mzML file and settings."""
+    if isinstance(fasta_path, str):
+        key = [file_signature(fasta_path), file_signature(mzml_path), shard_size]
+    else:
+        key = [[file_signature(path) for path in fasta_path], file_signature(mzml_path), shard_size]
+    if database:
+        key.append(file_signature(database))
+    if cluster:
+        key.append(('cluster', cluster_settings()))
+    return os.path.join(str(root or PIPELINE_DIR), hashlib.sha256(repr(key).encode()).hexdigest()[:16])
+
+
+def clear_work_dir(work_dir: str, stages: List[Stage]):
+    """Removes the shards, consensus spectra and checkpoints of a run. Other files in work_dir are kept."""
+    patterns = ['shard-*.mzML', 'consensus*.mzML'] + [f'{glob.escape(stage.name)}-*.pkl*' for stage in stages]
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(glob.escape(work_dir), pattern)):
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+def run_pipeline(fasta_path: Union[str, List[str]], mzml_path: str, database: Optional[str] = None,
+                 work_dir: Optional[str] = None, shard_size: int = SHARD_SIZE, workers: Optional[int] = None,
+                 queue_size: int = QUEUE_SIZE, resume: bool = True, cluster: bool = False):
+    """Runs reader -> peptide search -> protein mapping as a streaming pipeline over shards of the mzML file.
+
+    Parameters
+    ----------
+    fasta_path: Union[str, List[str]]
+        FASTA file of the proteins to search the spectra against, or several FASTA files searched as one
+        deduplicated digest, see databases.search_databases
+    mzml_path: str
+        mzML file of the spectra
+    database: str
+        local FASTA file to map the peptides offline, The Proteins API is used if None
+    work_dir: str
+        directory of the shards and checkpoints of all runs, PIPELINE_DIR if None; every run uses a subdirectory
+        derived from its inputs
+    shard_size: int
+        number of spectra searched together
+    workers: int
+        number of processes of the peptide search, the number of CPUs if None
+    queue_size: int
+        maximum number of shards waiting between two stages
+    resume: bool
+        reuse the checkpoints of an earlier run with the same inputs
+    cluster: bool
+        search one consensus spectrum per cluster of repeated MS2 spectra instead of every spectrum, see
+        clustering.cluster_file
+
+    Returns
+    -------
+    peptide_df: pd.DataFrame
+        peptide hits of all shards, as returned by PeptideSearch.peptide_wrapper
+    protein_df: pd.DataFrame
+        proteins of all hit peptides, as returned by ProteinSearch.get_proteins
+    """
+    import pandas as pd
+    import numpy as np
+    from ms_package.protein_cache import PROTEIN_COLUMNS
+
+    work_dir = work_dir_for(fasta_path, mzml_path, database, shard_size, cluster, root=work_dir)
+    checkpoints = Checkpoints(work_dir)
+    stages = [Stage('search', partial(search_shard, fasta_path), workers=workers or os.cpu_count() or 1,
+                    processes=True),
+              Stage('proteins', partial(map_shard, database))]
+    if not resume:
+        clear_work_dir(work_dir, stages)
+    if not isinstance(fasta_path, str) and len(fasta_path) > 1:
+        # digest the databases and write their shards once, before the search processes read them
+        from ms_package.databases import SHARD_PEPTIDES, get_digest, shard_dir_for
+        digest = get_digest(fasta_path)
+        digest.write_shards(shard_dir_for(digest, SHARD_PEPTIDES))
+
+    hit_frames, protein_frames = list(), list()
+    if cluster:
+        from ms_package.clustering import cluster_file
+        consensus_path = os.path.join(work_dir, 'consensus.mzML')
+        if not os.path.exists(consensus_path):
+            cluster_file(mzml_path, consensus_path)
+        mzml_path = consensus_path
+    source = shard_spectra(mzml_path, work_dir, shard_size)
+    for index, (hits, proteins) in run_stages(source, stages, checkpoints=checkpoints, queue_size=queue_size):
+        logger.info(f'Shard {index}: {len(hits)} peptide hits, {len(proteins)} protein matches')
+        hit_frames.append(hits)
+        protein_frames.append(proteins)
+
+    peptide_df = pd.concat(hit_frames, ignore_index=True) if hit_frames else pd.DataFrame()
+    if 'Hit_id' in peptide_df:
+        peptide_df['Hit_id'] = np.arange(len(peptide_df))
+    protein_frames = [frame for frame in protein_frames if len(frame)]
+    protein_df = (pd.concat(protein_frames, ignore_index=True).drop_duplicates(ignore_index=True)
+                  if protein_frames else pd.DataFrame(columns=PROTEIN_COLUMNS))
+    return peptide_df, protein_df
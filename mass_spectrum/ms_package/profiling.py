@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import time
+import resource
+import functools
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+# stages whose time counts towards the spectra per second of the reader
+READER_STAGES = ('Reader.parse_file', 'Reader.get_compression', 'Reader.get_binary_spectrum_values',
+                 'Reader.decode_decompress', 'Reader.get_values')
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KiB on Linux
+
+
+class Profiler:
+    """Collects stage timings and counters of this process while enabled.
+
+    Disabled, a profiled function costs one attribute lookup per call and a counter one method call, so the
+    instrumentation stays in place in normal runs.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = list()  # (name, start, end, thread id) in perf_counter seconds
+        self.counters = Counter()
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def enable(self):
+        """Starts a new profile."""
+        with self.lock:
+            self.events = list()
+            self.counters = Counter()
+            self.origin = time.perf_counter()
+            self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    @contextmanager
+    def stage(self, name: str):
+        """Times the enclosed block as one call of the stage."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                self.events.append((name, start, end, threading.get_ident()))
+
+    def count(self, name: str, value: float = 1):
+        """Adds value to a counter, e.g. bytes decoded or cache hits."""
+        if self.enabled:
+            with self.lock:
+                self.counters[name] += value
+
+    def summary(self) -> Dict:
+        """Per-stage breakdown, counters and derived rates of the profile.
+
+        Returns
+        -------
+        summary: dict
+            wall time in seconds, stages (calls, seconds and share of the wall time, in order of their
+            first call), counters, spectra per second of the reader stages and peak RSS in MiB
+        """
+        with self.lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+        wall = time.perf_counter() - self.origin
+        stages = OrderedDict()
+        for name, start, end, _ in sorted(events, key=lambda event: event[1]):
+            stage = stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            stage['calls'] += 1
+            stage['seconds'] += end - start
+        for stage in stages.values():
+            stage['share'] = stage['seconds'] / wall if wall else 0.0
+        reader_seconds = sum(stages[name]['seconds'] for name in READER_STAGES if name in stages)
+        spectra = counters.get('spectra')
+        return {'wall_seconds': wall, 'stages': stages, 'counters': counters,
+                'spectra_per_second': spectra / reader_seconds if spectra and reader_seconds else None,
+                'peak_rss_mb': peak_rss_mb()}
+
+    def format_summary(self) -> str:
+        """Summary as a table for the terminal."""
+        summary = self.summary()
+        lines = [f"{'stage':<40}{'calls':>7}{'seconds':>11}{'share':>8}"]
+        for name, stage in summary['stages'].items():
+            lines.append(f"{name:<40}{stage['calls']:>7}{stage['seconds']:>11.3f}{stage['share']:>8.1%}")
+        lines.append(f"{'wall time':<47}{summary['wall_seconds']:>11.3f}")
+        for name, value in sorted(summary['counters'].items()):
+            lines.append(f'{name:<47}{value:>11.0f}')
+        if summary['spectra_per_second'] is not None:
+            lines.append(f"{'spectra per second':<47}{summary['spectra_per_second']:>11.1f}")
+        lines.append(f"{'peak RSS (MiB)':<47}{summary['peak_rss_mb']:>11.1f}")
+        return '\n'.join(lines)
+
+    def chrome_trace(self) -> Dict:
+        """Profile in the Chrome trace event format, viewable in chrome://tracing or Perfetto."""
+        pid = os.getpid()
+        with self.lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+        trace = [{'name': name, 'ph': 'X', 'pid': pid, 'tid': tid, 'ts': (start - self.origin) * 1e6,
+                  'dur': (end - start) * 1e6} for name, start, end, tid in events]
+        if counters:
+            trace.append({'name': 'counters', 'ph': 'C', 'pid': pid, 'tid': 0,
+                          'ts': (time.perf_counter() - self.origin) * 1e6, 'args': counters})
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms', 'otherData': {'summary': self.summary()}}
+
+    def save(self, path: str):
+        """Saves the profile as Chrome trace JSON, which also carries the summary in otherData."""
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+profiler = Profiler()
+
+
+def profiled(name: Optional[str] = None) -> Callable:
+    """Decorator timing every call of a function as a stage of the profile, named after its qualified name."""
+    def decorator(func: Callable) -> Callable:
+        stage = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            with profiler.stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,266 @@
+import os
+import time
+import sqlite3
+import logging
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+from ms_package.startup import DATA_DIR
+from ms_package.profiling import profiler
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+PROTEIN_COLUMNS = ["Peptide", "Protein_Accession", "Taxonomy_ID", "Data Source", "Peptide Position", "Sequence"]
+CACHE_PATH = os.path.join(DATA_DIR, "proteins", "protein_data.sqlite")
+LEGACY_CSV_PATH = os.path.join(DATA_DIR, "proteins", "protein_data.csv")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS peptides (
+    peptide TEXT PRIMARY KEY,
+    updated REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS peptides_updated ON peptides (updated);
+CREATE TABLE IF NOT EXISTS proteins (
+    peptide TEXT NOT NULL,
+    accession TEXT NOT NULL,
+    taxid INTEGER,
+    source TEXT,
+    position TEXT NOT NULL,
+    PRIMARY KEY (peptide, accession, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sequences (
+    accession TEXT PRIMARY KEY,
+    sequence TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS claims (
+    peptide TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    claimed REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class ProteinCache:
+    """Indexed local store of peptide to protein mappings received from The Proteins API.
+
+    Peptides are stored with a primary key, so lookups do not depend on the size of the cache. Peptides
+    without any protein match are stored as well, so they are not queried again. Writes happen in
+    transactions, so several workers can share one cache file. Peptides being queried are claimed by one
+    worker, so concurrent workers missing the same peptides wait for its result instead of querying them again.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, ttl: Optional[float] = None, max_peptides: Optional[int] = None,
+                 timeout: float = 30.0, claim_timeout: float = 600.0):
+        """
+        parameters:
+            path = file path of the SQLite database
+            ttl = time in seconds after which cached peptides are queried again, never expire if None
+            max_peptides = maximum number of cached peptides, the oldest are evicted first, unlimited if None
+            timeout = time in seconds to wait for a lock held by another worker
+            claim_timeout = time in seconds after which the claims of a worker that did not finish its query are
+                taken over by other workers
+        """
+        self.path = str(path)
+        self.ttl = ttl
+        self.max_peptides = max_peptides
+        self.timeout = timeout
+        self.claim_timeout = claim_timeout
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        exists = os.path.exists(self.path)
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+        if not exists and self.path == CACHE_PATH and os.path.exists(LEGACY_CSV_PATH):
+            self.import_csv(LEGACY_CSV_PATH)
+
+    def connect(self) -> sqlite3.Connection:
+        """Opens a connection in autocommit mode, transactions are started explicitly."""
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def lookup(self, peptides: List[str]) -> Tuple[pd.DataFrame, List[str]]:
+        """Looks up the proteins of the given peptides.
+
+        Parameters
+        ----------
+        peptides: List[str]
+            List of peptide sequences.
+
+        Returns
+        -------
+        cached_df: pd.DataFrame
+            Protein identification values of the cached peptides, in the order of the peptide list.
+        missing: List[str]
+            Unique peptides that are not cached or expired and need to be queried.
+        """
+        unique = list(dict.fromkeys(peptides))
+        min_updated = time.time() - self.ttl if self.ttl is not None else float("-inf")
+        conn = self.connect()
+        try:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS query (idx INTEGER PRIMARY KEY, peptide TEXT)")
+            conn.execute("DELETE FROM query")
+            conn.executemany("INSERT INTO query VALUES (?, ?)", enumerate(unique))
+            cached = {row[0] for row in conn.execute(
+                "SELECT q.peptide FROM query q JOIN peptides p ON p.peptide = q.peptide WHERE p.updated >= ?",
+                (min_updated,))}
+            rows = conn.execute(
+                "SELECT q.peptide, r.accession, r.taxid, r.source, r.position, s.sequence "
+                "FROM query q JOIN peptides p ON p.peptide = q.peptide "
+                "JOIN proteins r ON r.peptide = q.peptide "
+                "LEFT JOIN sequences s ON s.accession = r.accession "
+                "WHERE p.updated >= ? ORDER BY q.idx", (min_updated,)).fetchall()
+        finally:
+            conn.close()
+        missing = [pep for pep in unique if pep not in cached]
+        logger.info(f"{len(cached)} of {len(unique)} peptides found in the protein cache")
+        profiler.count('protein_cache_hits', len(cached))
+        profiler.count('protein_cache_misses', len(missing))
+        return pd.DataFrame(rows, columns=PROTEIN_COLUMNS), missing
+
+    def upsert(self, protein_df: pd.DataFrame, peptides: List[str]):
+        """Stores the proteins of the queried peptides, replacing previously cached entries.
+
+        Parameters
+        ----------
+        protein_df: pd.DataFrame
+            Protein identification values as returned by ProteinSearch.parse_content.
+        peptides: List[str]
+            All queried peptides, including those without a protein match.
+        """
+        now = time.time()
+        peptides = list(dict.fromkeys(peptides))
+        if protein_df is not None and not protein_df.empty:
+            proteins = protein_df[PROTEIN_COLUMNS[:-1]].itertuples(index=False, name=None)
+            sequences = protein_df[["Protein_Accession", "Sequence"]].drop_duplicates("Protein_Accession")
+            sequences = sequences.itertuples(index=False, name=None)
+        else:
+            proteins, sequences = [], []
+
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("DELETE FROM proteins WHERE peptide = ?", ((pep,) for pep in peptides))
+            conn.executemany("INSERT OR REPLACE INTO peptides VALUES (?, ?)", ((pep, now) for pep in peptides))
+            conn.executemany("INSERT OR REPLACE INTO proteins VALUES (?, ?, ?, ?, ?)", proteins)
+            conn.executemany("INSERT OR REPLACE INTO sequences VALUES (?, ?)", sequences)
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def claim(self, peptides: List[str], owner: str) -> List[str]:
+        """Claims peptides to be queried by one worker. Peptides claimed by another worker are left to it, unless
+        its claim is older than claim_timeout.
+
+        Parameters
+        ----------
+        peptides: List[str]
+            Peptides missing from the cache.
+        owner: str
+            Unique id of the claiming worker, to release its claims.
+
+        Returns
+        -------
+        claimed: List[str]
+            Unique peptides this worker has to query, in the order of the peptide list.
+        """
+        now = time.time()
+        unique = list(dict.fromkeys(peptides))
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM claims WHERE claimed < ?", (now - self.claim_timeout,))
+            conn.executemany("INSERT OR IGNORE INTO claims VALUES (?, ?, ?)", ((pep, owner, now) for pep in unique))
+            owned = {row[0] for row in conn.execute("SELECT peptide FROM claims WHERE owner = ?", (owner,))}
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        claimed = [pep for pep in unique if pep in owned]
+        profiler.count('protein_cache_claimed', len(claimed))
+        return claimed
+
+    def release(self, owner: str):
+        """Releases the claims of a worker after its query results were stored, or after it failed."""
+        conn = self.connect()
+        try:
+            conn.execute("DELETE FROM claims WHERE owner = ?", (owner,))
+        finally:
+            conn.close()
+
+    def wait(self, peptides: List[str], poll: float = 0.2) -> Tuple[pd.DataFrame, List[str]]:
+        """Waits until the peptides claimed by other workers are released, at most claim_timeout seconds, and
+        looks them up.
+
+        Returns
+        -------
+        cached_df, missing:
+            See lookup, peptides are missing if the worker that claimed them failed.
+        """
+        unique = set(peptides)
+        deadline = time.time() + self.claim_timeout
+        while time.time() < deadline:
+            conn = self.connect()
+            try:
+                pending = [row[0] for row in conn.execute("SELECT peptide FROM claims") if row[0] in unique]
+            finally:
+                conn.close()
+            if not pending:
+                break
+            time.sleep(poll)
+        return self.lookup(peptides)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Removes expired peptides and the oldest peptides above the size limit inside the open transaction."""
+        if self.ttl is None and self.max_peptides is None:
+            return
+        if self.ttl is not None:
+            conn.execute("DELETE FROM peptides WHERE updated < ?", (time.time() - self.ttl,))
+        if self.max_peptides is not None:
+            conn.execute("DELETE FROM peptides WHERE peptide IN (SELECT peptide FROM peptides "
+                         "ORDER BY updated DESC LIMIT -1 OFFSET ?)", (self.max_peptides,))
+        conn.execute("DELETE FROM proteins WHERE peptide NOT IN (SELECT peptide FROM peptides)")
+        conn.execute("DELETE FROM sequences WHERE accession NOT IN (SELECT accession FROM proteins)")
+
+    def evict(self):
+        """Applies the TTL and size limits to the cache."""
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._evict(conn)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def clear(self):
+        """Removes all cached peptides and proteins."""
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for table in ("peptides", "proteins", "sequences", "claims"):
+                conn.execute(f"DELETE FROM {table}")
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def import_csv(self, csv_path: str):
+        """Imports the append-only protein_data.csv written by previous versions of the package."""
+        try:
+            df = pd.read_csv(csv_path)
+        except pd.errors.EmptyDataError:
+            return
+        if not set(PROTEIN_COLUMNS).issubset(df.columns):
+            logger.warning(f"Could not import {csv_path}, unexpected columns")
+            return
+        df = df.drop_duplicates(subset=["Peptide", "Protein_Accession", "Peptide Position"])
+        self.upsert(df, list(df["Peptide"]))
+        logger.info(f"Imported {len(df)} cached proteins from {csv_path}")
@@ -1,14 +1,13 @@
-import os
-import sys
-
+import uuid
 import logging
-import requests
+from typing import Optional
 
-import json
 import pandas as pd
-from collections import defaultdict
 
-from ms_package.startup import DATA_DIR
+from ms_package.protein_cache import ProteinCache, PROTEIN_COLUMNS
+from ms_package.fasta_index import get_index
+from ms_package.proteins_api import ProteinsAPIClient, PROTEINS_API_URL
+from ms_package.profiling import profiled
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -17,11 +16,25 @@ logger.setLevel(logging.DEBUG)
 class ProteinSearch:
     """This class uses The Proteins API from EBI to map the given list of peptides."""
 
-    def __init__(self, peptide_list: list):
+    def __init__(self, peptide_list: list, api_url: str = PROTEINS_API_URL, max_workers: int = 4,
+                 cache: Optional[ProteinCache] = None, fasta_path: Optional[str] = None):
+        """
+        parameters:
+            peptide_list = list of peptide sequences to map
+            api_url = proteomics endpoint of The Proteins API, can point to a local mock server
+            max_workers = maximum number of concurrent API requests
+            cache = local store of previous API queries, the default cache in DATA_DIR is used if None
+            fasta_path = local FASTA file (e.g. a UniProt proteome) to map the peptides offline instead of
+                calling The Proteins API
+        """
         self.peptide_list = peptide_list
+        self.api_url = api_url
+        self.max_workers = max_workers
+        self.cache = cache
+        self.fasta_path = fasta_path
 
         self.sel_peptides = []
-        self.protein_response = ""
+        self.protein_records = {column: [] for column in PROTEIN_COLUMNS}
         self.ans_df = None
 
     def filter_peptides(self) -> list:
@@ -71,114 +84,133 @@ class ProteinSearch:
                 api_query += "%2C" + pep
         return api_query
 
+    @profiled()
     def proteins_api(self):
         """Make API query for 15 peptides at a time.
         The Proteins API is used, which searches in the databases: MaxQB, PeptideAtlas, EPD and  ProteomicsDB.
-        The response in json format is saved.
+        The chunks are queried concurrently over pooled connections and each json response is parsed once,
+        in the order of the chunks, as soon as it arrives.
         """
 
         logger.info("Calling The Proteins API...  "
                     "to match peptides in databases: MaxQB, PeptideAtlas, EPD and  ProteomicsDB")
 
-        for pep_lil in self.sel_peptides:
-            api_query = self.get_api_query(pep_lil)
-            requestURL = f"https://www.ebi.ac.uk/proteins/api/proteomics?offset=0&size=100&peptide={api_query}"
-            r = requests.get(requestURL, headers={"Accept": "application/json"})
+        client = ProteinsAPIClient(url=self.api_url, max_workers=self.max_workers)
+        try:
+            responses = client.iter_fetch([self.get_api_query(pep_lil) for pep_lil in self.sel_peptides])
+            for pep_lil, r in zip(self.sel_peptides, responses):
+                self.add_response(r.json(), pep_lil)
+        finally:
+            client.close()
 
-            if not r.ok:
-                r.raise_for_status()
-                logger.error("API request not successful, Protein list not received")
-                sys.exit()
+        logger.info("Peptide mapping to Proteins completed successfully")
 
-            self.protein_response += r.text
+    def add_response(self, entries: list, list_peps: list):
+        """Appends the protein identification values of one parsed API response to the columnar records.
+        Every feature of an entry matching one of the queried peptides gets its own row.
 
-        logger.info("Peptide mapping to Proteins completed successfully")
+        Parameters
+        ----------
+        entries: list
+            Parsed json response of The Proteins API.
+        list_peps: list
+            Peptides of the query.
+        """
+        queried = set(list_peps)
+        records = self.protein_records
+        for entry in entries:
+            for feature in entry.get("features", []):
+                if feature.get("peptide") not in queried:
+                    continue
+                source = [data["source"]["name"] for data in feature.get("evidences", [])]
+
+                records["Peptide"].append(feature["peptide"])
+                records["Protein_Accession"].append(entry["accession"])
+                records["Taxonomy_ID"].append(entry["taxid"])
+                records["Data Source"].append(",".join(source))
+                records["Peptide Position"].append(f"{feature['begin']} to {feature['end']}")
+                records["Sequence"].append(entry["sequence"])
 
     def parse_content(self) -> pd.DataFrame:
-        """Function to parse the API request into dataframe
+        """Function to turn the parsed API responses into dataframe
         Returns:
         ----------
         dataframe :
             Dataframe of protein identification values.
         """
+        return pd.DataFrame(self.protein_records, columns=PROTEIN_COLUMNS)
 
-        ans_dict = defaultdict(lambda: defaultdict(str))
-        for l in range(len(json.loads(self.protein_response))):
-            ind = json.loads(self.protein_response)[l]
-
-            ans_dict[l + 1]["Peptide"] = ind["features"][0]["peptide"]
-            ans_dict[l + 1]["Protein_Accession"] = ind["accession"]
-            ans_dict[l + 1]["Taxonomy_ID"] = ind["taxid"]
-
-            source = []
-            for data in ind['features'][0]["evidences"]:
-                source.append(data["source"]["name"])
-
-            ans_dict[l + 1]["Data Source"] = ",".join(source)
-            ans_dict[l + 1]["Peptide Position"] = f"{ind['features'][0]['begin']} to {ind['features'][0]['end']}"
-
-            ans_dict[l + 1]["Sequence"] = ind["sequence"]
-
-        return pd.DataFrame.from_dict(ans_dict, orient="index")
+    def query(self, peptides: list) -> pd.DataFrame:
+        """Queries The Proteins API for the given peptides only.
+        Returns
+        ----------
+        dataframe :
+            Dataframe of protein identification values of the peptides.
+        """
+        self.sel_peptides = []
+        self.protein_records = {column: [] for column in PROTEIN_COLUMNS}
+        self.divide_into_chunks(peptides)
+        self.proteins_api()
+        return self.parse_content()
 
-    @staticmethod
-    def file_handle():
-        """Creates a directory and files to keep a track of peptide query submitted
+    def file_handle(self) -> ProteinCache:
+        """Creates the directory and the cache database to keep a track of peptide queries submitted
         to the API.
-        """
-        pro_dir = os.path.join(DATA_DIR, "proteins")
-        os.makedirs(pro_dir, exist_ok=True)
 
-        pep_list_dir = os.path.join(pro_dir, "protein_data.csv")
-        try:
-            open(pep_list_dir, "x")
-        except FileExistsError:
-            pass
+        Returns
+        -------
+        cache : ProteinCache
+            Local store of previous API queries.
+        """
+        if self.cache is None:
+            self.cache = ProteinCache()
+        return self.cache
 
     def get_proteins(self):
         """ Wrapper function to call relevant methods.
         Only calls API if the data was not available from previous API queries.
+        If a local FASTA file was given, the peptides are mapped offline instead.
         """
-        self.file_handle()
         filtered = self.filter_peptides()
+        if self.fasta_path is not None:
+            self.ans_df = get_index(self.fasta_path).map_peptides(filtered)
+            return
 
-        pep_list_dir = os.path.join(DATA_DIR, "proteins", "protein_data.csv")
+        cache = self.file_handle()
 
-        try:
-            df = pd.read_csv(pep_list_dir)
-        except pd.errors.EmptyDataError:
-            df = None
-
-        if df is not None:
-            exists_df = df[df['Peptide'].isin(filtered)]
-            already_exists_peptide = list(exists_df["Peptide"])
-            to_be_queried = [x for x in filtered if x not in already_exists_peptide]
-        else:
-            to_be_queried = filtered
-            exists_df = None
+        exists_df, to_be_queried = cache.lookup(filtered)
+        frames = [exists_df]
 
         if to_be_queried:
-            self.divide_into_chunks(to_be_queried)
-            self.proteins_api()
-            response_df = self.parse_content()
-        else:
-            response_df = None
-
-        # half exists, half API
-        if response_df is not None and exists_df is not None:
-            self.ans_df = pd.concat([exists_df, response_df],  axis=0, ignore_index=True)
-            response_df.to_csv(pep_list_dir, mode="a", header=False, index=False)
-
-        # full API
-        elif response_df is not None and exists_df is None:
-            self.ans_df = response_df
+            # peptides missed by concurrent searches are queried by the search claiming them first, the others
+            # wait for its result
+            owner = uuid.uuid4().hex
+            claimed = cache.claim(to_be_queried, owner)
             try:
-                self.ans_df.to_csv(pep_list_dir, mode="a", index=False)
-            except KeyError:
-                self.ans_df.to_csv(pep_list_dir, mode="a", header=False, index=False)
-
-        # full exists
-        elif response_df is None and exists_df is not None:
-            self.ans_df = exists_df
+                if claimed:
+                    response_df = self.query(claimed)
+                    cache.upsert(response_df, claimed)
+                    frames.append(response_df)
+            finally:
+                cache.release(owner)
+
+            claimed = set(claimed)
+            waiting = [pep for pep in to_be_queried if pep not in claimed]
+            if waiting:
+                waited_df, failed = cache.wait(waiting)
+                frames.append(waited_df)
+                if failed:  # the other search did not store its result
+                    response_df = self.query(failed)
+                    cache.upsert(response_df, failed)
+                    frames.append(response_df)
+
+        frames = [df for df in frames if df is not None and not df.empty]
+        if frames:
+            ans_df = pd.concat(frames, axis=0, ignore_index=True)
+            # keep the order of the submitted peptides
+            order = {pep: i for i, pep in enumerate(dict.fromkeys(filtered))}
+            self.ans_df = ans_df.sort_values("Peptide", key=lambda col: col.map(order), kind="stable",
+                                             ignore_index=True)
         else:
+            self.ans_df = pd.DataFrame(columns=PROTEIN_COLUMNS)
             logger.error("No response received")
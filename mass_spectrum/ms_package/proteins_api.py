@@ -0,0 +1,166 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Iterator, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ms_package.profiling import profiler
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# The endpoint can be pointed at a local mock server for tests and air-gapped runs
+PROTEINS_API_URL = os.environ.get("PLAB2_PROTEINS_API_URL", "https://www.ebi.ac.uk/proteins/api/proteomics")
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting the number of requests per second."""
+
+    def __init__(self, rate: float, capacity: Optional[int] = None):
+        """
+        parameters:
+            rate = number of tokens added per second
+            capacity = maximum number of tokens that can be saved up for bursts, defaults to rate
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and takes it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ProteinsAPIClient:
+    """Queries The Proteins API concurrently over a pool of keep-alive connections."""
+
+    def __init__(self, url: str = PROTEINS_API_URL, max_workers: int = 4, rate: float = 10.0, retries: int = 5,
+                 backoff_factor: float = 0.5, timeout: float = 30.0):
+        """
+        parameters:
+            url = proteomics endpoint of The Proteins API
+            max_workers = maximum number of requests in flight at the same time
+            rate = maximum number of requests per second
+            retries = number of retries on 429 and 5xx responses or connection errors
+            backoff_factor = base of the exponential backoff between retries in seconds
+            timeout = timeout of a single request in seconds
+        """
+        self.url = url
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate)
+
+        self.session = requests.Session()
+        self.session.headers.update({"Accept": "application/json"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def backoff(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """Returns the time to wait before the next attempt, honouring a Retry-After header if present."""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is not None and retry_after.isdigit():
+                return float(retry_after)
+        return self.backoff_factor * (2 ** attempt)
+
+    def fetch(self, api_query: str) -> requests.Response:
+        """Makes a single API query, retrying with exponential backoff on rate limiting and server errors.
+
+        Parameters
+        ----------
+        api_query: str
+            Peptides in The Proteins API query format.
+
+        Returns
+        -------
+        response: requests.Response
+            Successful response of the API.
+
+        Raises
+        -------
+        requests.HTTPError: if the request did not succeed after all retries
+        """
+        request_url = f"{self.url}?offset=0&size=100&peptide={api_query}"
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                r = self.session.get(request_url, timeout=self.timeout)
+                profiler.count('api_requests')
+            except requests.ConnectionError:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"Connection to The Proteins API failed, retrying (attempt {attempt + 1})")
+                time.sleep(self.backoff(attempt))
+                continue
+            if r.status_code not in RETRY_STATUS_CODES or attempt == self.retries:
+                break
+            logger.warning(f"The Proteins API returned {r.status_code}, retrying (attempt {attempt + 1})")
+            time.sleep(self.backoff(attempt, r))
+
+        if not r.ok:
+            logger.error("API request not successful, Protein list not received")
+            r.raise_for_status()
+        return r
+
+    def fetch_all(self, api_queries: List[str]) -> List[requests.Response]:
+        """Makes all API queries concurrently.
+
+        Parameters
+        ----------
+        api_queries: List[str]
+            Peptide chunks in The Proteins API query format.
+
+        Returns
+        -------
+        responses: List[requests.Response]
+            Responses in the same order as the queries.
+        """
+        return list(self.iter_fetch(api_queries))
+
+    def iter_fetch(self, api_queries: List[str]) -> Iterator[requests.Response]:
+        """Makes the API queries concurrently and yields the responses in the order of the queries as soon as
+        they are available. At most twice as many requests as workers are kept in flight, so finished responses
+        do not pile up in memory.
+
+        Parameters
+        ----------
+        api_queries: List[str]
+            Peptide chunks in The Proteins API query format.
+
+        Yields
+        -------
+        response: requests.Response
+            Successful response of the API.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            for api_query in api_queries:
+                if len(pending) >= 2 * self.max_workers:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(self.fetch, api_query))
+            while pending:
+                yield pending.popleft().result()
+
+    def close(self):
+        """Closes the pooled connections."""
+        self.session.close()
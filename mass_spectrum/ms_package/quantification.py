@@ -0,0 +1,245 @@
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ms_package.library import read_spectra
+from ms_package.peptide_masses import mz_values, peptide_masses
+from ms_package.compressed import strip_compression
+from ms_package.profiling import profiled, profiler
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+PROTON = 1.007276
+ISOTOPE_SPACING = 1.0033548
+TOLERANCE = 10.0  # ppm
+RT_WINDOW = 30.0  # seconds around the expected retention time the XIC is integrated over
+ISOTOPES = 3  # isotope peaks summed in the XIC
+IDENTIFICATION_COLUMNS = ['run', 'peptide', 'charge', 'm/z', 'rt']
+INFO_COLUMNS = ['peptide', 'charge', 'm/z', 'rt', 'identifications']
+
+
+def run_name(path: str) -> str:
+    """Name of a run in the intensity matrix, the file name without (compression) extension."""
+    return os.path.splitext(os.path.basename(strip_compression(path)))[0]
+
+
+def identifications_from_search(peptide_df: pd.DataFrame, run: str, max_charge: int = 6) -> pd.DataFrame:
+    """Converts the peptide hits of PeptideSearch.peptide_wrapper into identifications of a run.
+
+    The charge is the one whose theoretical m/z is closest to the measured precursor m/z.
+    """
+    charges = np.arange(1, max_charge + 1)
+    mz = mz_values(peptide_masses(peptide_df['Peptide hit sequence']), charges)
+    best = np.argmin(np.abs(mz - peptide_df['Peptide ID m/z'].to_numpy(dtype=np.float64)[:, None]), axis=1)
+    return pd.DataFrame({'run': run, 'peptide': peptide_df['Peptide hit sequence'].to_numpy(),
+                         'charge': charges[best], 'm/z': mz[np.arange(len(best)), best],
+                         'rt': peptide_df['Peptide ID rt'].to_numpy()}, columns=IDENTIFICATION_COLUMNS)
+
+
+def isotonic(y: np.ndarray, weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """Non-decreasing least squares fit of y (isotonic regression), by pooling adjacent violators."""
+    weights = np.ones(len(y)) if weights is None else np.asarray(weights, dtype=np.float64)
+    values, block_weights, sizes = list(), list(), list()
+    for value, weight in zip(np.asarray(y, dtype=np.float64), weights):
+        values.append(value)
+        block_weights.append(weight)
+        sizes.append(1)
+        while len(values) > 1 and values[-2] > values[-1]:
+            weight = block_weights[-2] + block_weights[-1]
+            value = (values[-2] * block_weights[-2] + values[-1] * block_weights[-1]) / weight
+            size = sizes[-2] + sizes[-1]
+            del values[-1], block_weights[-1], sizes[-1]
+            values[-1], block_weights[-1], sizes[-1] = value, weight, size
+    return np.repeat(values, sizes)
+
+
+def fit_alignment(rt: np.ndarray, reference_rt: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Monotone mapping of the retention times of a run onto the reference run, from the retention times of
+    peptides identified in both.
+
+    Returns
+    -------
+    knots: Tuple[np.ndarray, np.ndarray]
+        retention times of the run and the reference they map to, both non-decreasing, see align
+    """
+    if len(rt) == 0:
+        return np.zeros(1), np.zeros(1)  # no shared identifications, the identity
+    x, inverse = np.unique(rt, return_inverse=True)
+    counts = np.bincount(inverse)
+    y = np.bincount(inverse, weights=reference_rt) / counts
+    return x, isotonic(y, counts)
+
+
+def align(rt: np.ndarray, knots: Tuple[np.ndarray, np.ndarray], inverse: bool = False) -> np.ndarray:
+    """Maps retention times of a run onto the reference (or back with inverse), shifting them by the offset of
+    the nearest end outside of the knots."""
+    x, y = (knots[1], knots[0]) if inverse else knots
+    rt = np.asarray(rt, dtype=np.float64)
+    aligned = np.interp(rt, x, y)
+    aligned = np.where(rt < x[0], rt + (y[0] - x[0]), aligned)
+    return np.where(rt > x[-1], rt + (y[-1] - x[-1]), aligned)
+
+
+@profiled()
+def extract_areas(path: str, mz: np.ndarray, rt: np.ndarray, charge: np.ndarray, tolerance: float = TOLERANCE,
+                  rt_window: float = RT_WINDOW, isotopes: int = ISOTOPES) -> np.ndarray:
+    """Integrates the extracted ion chromatograms of targets in the MS1 spectra of a run.
+
+    The targets are sorted by retention time, so the targets whose window contains a spectrum are a contiguous
+    slice, and their isotope peaks are looked up in the spectrum with one binary search.
+
+    Parameters
+    ----------
+    path: str
+        mzML file of the run
+    mz, rt, charge: np.ndarray
+        monoisotopic m/z, expected retention time in seconds and charge of every target
+    tolerance: float
+        m/z tolerance in ppm
+    rt_window: float
+        the XIC is integrated from rt - rt_window to rt + rt_window
+    isotopes: int
+        number of isotope peaks summed
+
+    Returns
+    -------
+    areas: np.ndarray
+        area of every target, intensity times seconds
+    """
+    spectra = read_spectra(path, ms_level=1)
+    scan_order = np.argsort(spectra['rt'], kind='stable')
+    scan_rt = spectra['rt'][scan_order]
+    # each scan stands for the time until the next one, the last one for as long as the one before
+    duration = np.diff(scan_rt)
+    duration = np.r_[duration, duration[-1:] if len(duration) else np.ones(len(scan_rt))]
+    order = np.argsort(rt, kind='stable')
+    mz, rt, charge = mz[order], rt[order], charge[order]
+    centres = mz[:, None] + np.arange(isotopes)[None, :] * ISOTOPE_SPACING / charge[:, None]
+    widths = centres * tolerance * 1e-6
+    first = np.searchsorted(rt, scan_rt - rt_window, side='left')
+    last = np.searchsorted(rt, scan_rt + rt_window, side='right')
+    offsets = spectra['offsets']
+    areas = np.zeros(len(mz))
+    for position, scan in enumerate(scan_order):
+        lo, hi = first[position], last[position]
+        if lo == hi:
+            continue
+        peak_mz = spectra['mz'][offsets[scan]:offsets[scan + 1]]
+        peak_intensity = spectra['intensity'][offsets[scan]:offsets[scan + 1]]
+        if np.any(np.diff(peak_mz) < 0):
+            peak_order = np.argsort(peak_mz)
+            peak_mz, peak_intensity = peak_mz[peak_order], peak_intensity[peak_order]
+        cumulative = np.r_[0.0, np.cumsum(peak_intensity)]
+        left = np.searchsorted(peak_mz, centres[lo:hi] - widths[lo:hi], side='left')
+        right = np.searchsorted(peak_mz, centres[lo:hi] + widths[lo:hi], side='right')
+        areas[lo:hi] += (cumulative[right] - cumulative[left]).sum(axis=1) * duration[position]
+    profiler.count('quantification.scans', len(scan_order))
+    result = np.empty(len(areas))
+    result[order] = areas
+    return result
+
+
+def extract_run(job: Tuple[str, np.ndarray, np.ndarray, np.ndarray, Dict]) -> np.ndarray:
+    """XIC extraction of one run in a worker process, see extract_areas."""
+    path, mz, rt, charge, options = job
+    return extract_areas(path, mz, rt, charge, **options)
+
+
+def quantify(paths: Sequence[str], identifications: pd.DataFrame, workers: Optional[int] = None,
+             tolerance: float = TOLERANCE, rt_window: float = RT_WINDOW, isotopes: int = ISOTOPES,
+             names: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """Label-free quantification of identified peptides across runs.
+
+    The retention times of every run are aligned onto the run with the most identifications by a monotone fit on
+    the peptides identified in both. A peptide is quantified in every run: at its own retention time where it
+    was identified, otherwise at its median aligned retention time mapped back into the run (match between
+    runs). The runs are read and integrated in parallel processes.
+
+    Parameters
+    ----------
+    paths: Sequence[str]
+        mzML files of the runs
+    identifications: pd.DataFrame
+        columns run (see names), peptide, charge, m/z (monoisotopic, theoretical) and rt in seconds, e.g. from
+        identifications_from_search
+    workers: int
+        number of processes, the number of CPUs if None
+    tolerance, rt_window, isotopes:
+        see extract_areas
+    names: Sequence[str]
+        unique name of every run, the file names without (compression) extension if None, see run_name
+
+    Returns
+    -------
+    matrix: pd.DataFrame
+        one row per peptide and charge with its m/z, median aligned retention time, number of runs it was
+        identified in and one float32 column of XIC areas per run (0 where no signal was found)
+
+    Raises
+    ------
+    ValueError: if the runs do not have unique names, or identifications belong to none of the runs
+    """
+    names = [run_name(path) for path in paths] if names is None else list(names)
+    if len(names) != len(paths):
+        raise ValueError(f'{len(names)} names given for {len(paths)} runs')
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f'Runs with the same name: {", ".join(duplicates)}, pass unique names')
+    unknown = set(identifications['run']) - set(names)
+    if unknown:
+        raise ValueError(f'Identifications of unknown runs: {", ".join(sorted(unknown))}')
+    ids = identifications.groupby(['run', 'peptide', 'charge'], as_index=False).agg({'m/z': 'first', 'rt': 'median'})
+    reference = ids['run'].value_counts().reindex(names).fillna(0).idxmax()
+    reference_rt = ids[ids['run'] == reference].set_index(['peptide', 'charge'])['rt']
+
+    alignments = dict()
+    aligned = list()
+    for name in names:
+        run_ids = ids[ids['run'] == name]
+        shared = run_ids.join(reference_rt.rename('reference_rt'), on=['peptide', 'charge'], how='inner')
+        alignments[name] = fit_alignment(shared['rt'].to_numpy(), shared['reference_rt'].to_numpy())
+        aligned.append(run_ids.assign(aligned_rt=align(run_ids['rt'].to_numpy(), alignments[name])))
+        logger.info(f'Aligned {name} onto {reference} with {len(shared)} shared identifications')
+    aligned = pd.concat(aligned, ignore_index=True)
+    peptides = aligned.groupby(['peptide', 'charge'], as_index=False).agg(
+        **{'m/z': ('m/z', 'first'), 'rt': ('aligned_rt', 'median'), 'identifications': ('run', 'nunique')})
+
+    jobs = list()
+    for name, path in zip(names, paths):
+        own = ids[ids['run'] == name].set_index(['peptide', 'charge'])['rt']
+        own = own.reindex(pd.MultiIndex.from_frame(peptides[['peptide', 'charge']])).to_numpy()
+        expected = np.where(np.isnan(own), align(peptides['rt'].to_numpy(), alignments[name], inverse=True), own)
+        jobs.append((path, peptides['m/z'].to_numpy(dtype=np.float64), expected,
+                     peptides['charge'].to_numpy(dtype=np.float64),
+                     {'tolerance': tolerance, 'rt_window': rt_window, 'isotopes': isotopes}))
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    if workers == 1:
+        areas = [extract_run(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            areas = list(executor.map(extract_run, jobs))
+
+    matrix = peptides.astype({'charge': np.int8, 'rt': np.float32, 'identifications': np.int16})
+    for name, run_areas in zip(names, areas):
+        matrix[name] = run_areas.astype(np.float32)
+    logger.info(f'Quantified {len(matrix)} peptides in {len(names)} runs')
+    return matrix
+
+
+def save_matrix(path: str, matrix: pd.DataFrame):
+    """Saves an intensity matrix as compressed .npz with one array per column."""
+    np.savez_compressed(path, columns=np.array(matrix.columns, dtype=str),
+                        **{f'column_{i}': matrix[column].to_numpy() if pd.api.types.is_numeric_dtype(matrix[column])
+                           else matrix[column].to_numpy(dtype=str) for i, column in enumerate(matrix.columns)})
+
+
+def load_matrix(path: str) -> pd.DataFrame:
+    """Loads an intensity matrix saved by save_matrix."""
+    with np.load(path) as data:
+        columns = list(data['columns'])
+        return pd.DataFrame({column: data[f'column_{i}'] for i, column in enumerate(columns)}, columns=columns)
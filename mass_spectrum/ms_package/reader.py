@@ -1,17 +1,29 @@
+import os
 import xml.dom.minidom
 from xml.dom import minidom as md
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import base64
 import zlib
 import struct
 import logging
+import numpy as np
 import pandas as pd
 import argparse
 
+from ms_package.profiling import profiled, profiler
+from ms_package.compressed import open_input, strip_compression
+
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+SUMMARY_PARAMS = ('base peak m/z', 'base peak intensity', 'total ion current', 'lowest observed m/z',
+                  'highest observed m/z')
+SUMMARY_ATTRIBUTES = ('basePeakMz', 'basePeakIntensity', 'totIonCurrent', 'lowMz', 'highMz')  # mzXML
+VALUE_DTYPES = {'base_peak_m/z': np.float64, 'base_peak_intensity': np.float32, 'total_ion_current': np.float32,
+                'lowest_observed_m/z': np.float64, 'highest_observed_m/z': np.float64}
+VALUE_COLUMNS = ['spectra_id'] + list(VALUE_DTYPES)
+
 
 class Reader:
     """Parses the input mzml/mzXml file and extracts spectrum values."""
@@ -21,27 +33,32 @@ class Reader:
         self.compression = None  # contains compression dict for each spectrum
         self.binary_values = None  # contains binary values (m/z and intensity arrays) for each spectrum id
         self.spectrum_data = None  # decoded intensity and m/z array values
-        self.values = None  # base peak m/z, base peak intensity, lowest and highest observed m/z and total ion current
+        self.values = None  # table of base peak m/z, base peak intensity, lowest and highest observed m/z and TIC
+        self.scan_times = None  # retention time of each spectrum in seconds
+        self.precursors = None  # ms level, precursor m/z and charge of each spectrum
 
     def check_extension(self) -> bool:
-        """Checks if the extension of the parsed file is either .mzML or .mzXML.
+        """Checks if the extension of the parsed file is either .mzML or .mzXML, optionally followed by .gz, .bgz
+        or .zst for compressed files.
 
         Returns
         -------
         bool: True if extension is allowed
 
         """
-        if self.path.endswith('.mzML'):
+        path = strip_compression(self.path)
+        if path.endswith('.mzML'):
             self.format = 'mzml'
             return True
-        elif self.path.endswith('.mzXML'):
+        elif path.endswith('.mzXML'):
             self.format = 'mzxml'
             return True
         else:
             return False
 
+    @profiled()
     def parse_file(self) -> xml.dom.minidom.Document:
-        """Parses the input file and creates minidom object.
+        """Parses the input file and creates minidom object. Compressed files are decompressed while parsing.
 
         Returns
         -------
@@ -53,7 +70,9 @@ class Reader:
         ValueError: if the input file has non-allowed extension
         """
         if self.check_extension():
-            parsed_file = md.parse(self.path)
+            with open_input(self.path) as f:
+                parsed_file = md.parse(f)
+            profiler.count('bytes_read', os.path.getsize(self.path))
             logger.info(f'Successfully parsed file: {self.path}')
             return parsed_file
         else:
@@ -107,6 +126,7 @@ class Reader:
                 spectrum_dict[ids] = spectrum
         return spectrum_dict
 
+    @profiled()
     def get_compression(self, spectrum_dict: Dict[int, xml.dom.minidom.Element]):
         """Gathers information about the encoding of the binary arrays in the parsed input file.
 
@@ -133,6 +153,9 @@ class Reader:
             compression_dict[key] = data
         compression_list = list()
         for key in compression_dict:
+            if 'm/z array' not in compression_dict[key]:  # empty spectra written without binary data arrays
+                compression_list.append([[], []])
+                continue
             mz = compression_dict[key].index('m/z array')
             intensity = compression_dict[key].index('intensity array')
             length = len(compression_dict[key])
@@ -144,10 +167,8 @@ class Reader:
                 mz_comp = compression_dict[key][int(length/2):]
             compression_list.append([mz_comp, int_comp])
         dict_final = dict()
-        for key in compression_dict:
+        for key, (value_mz, value_int) in zip(compression_dict, compression_list):
             dict_final[key] = {'mz': dict(), 'intensity': dict()}
-            value_mz = compression_list[key][0]
-            value_int = compression_list[key][1]
             for val in value_mz:
                 if 'float' in val or 'bit' in val:
                     dict_final[key]['mz']['data_type'] = val
@@ -161,6 +182,7 @@ class Reader:
         self.compression = dict_final
         return
 
+    @profiled()
     def get_binary_spectrum_values(self, spectrum_dict: Dict[int, xml.dom.minidom.Element]):
         """Extracts binary data arrays for each spectrum.
 
@@ -187,12 +209,14 @@ class Reader:
         self.binary_values = vals
         return
 
+    @profiled()
     def decode_decompress(self):
         """Takes the raw spectrum values and creates a dictionary of decoded and uncompressed m/z and intensity values."""
         if self.format == 'mzxml':
             logger.warning('Decoding binary arrays is only available for .mzML files.')
             raise argparse.ArgumentTypeError('Decoding binary arrays is only available for .mzML files.')
         spectrum_data = dict()
+        bytes_decoded = 0
         for key in self.binary_values:
             encoded_mz_data, encoded_int_data = self.binary_values[key]['mz'], self.binary_values[key]['intensity']
             if encoded_mz_data is not None or encoded_int_data is not None:
@@ -219,15 +243,36 @@ class Reader:
                     int_data = struct.unpack('<%sd' % (len(decompressed_int_data) // 8),
                                              decompressed_int_data)
                 spectrum_data[key] = {'mz': mz_data, 'intensity': int_data}
+                bytes_decoded += len(decompressed_mz_data) + len(decompressed_int_data)
             else:
                 spectrum_data[key] = {'mz': None, 'intensity': None}
         self.spectrum_data = spectrum_data
+        profiler.count('bytes_decoded', bytes_decoded)
         return
 
-    def get_values(self, spectrum_dict: Dict[int, xml.dom.minidom.Element]) -> Dict[int, Dict]:
-        """Creates dictionary with spectrum ids and base peak m/z, base peak intensity, total ion current,
+    @staticmethod
+    def get_summary_params(spectrum: xml.dom.minidom.Element) -> List[float]:
+        """Reads the summary values of an mzML spectrum from its userParams, or its cvParams as written by
+        pyopenms, by name, and from the first five userParams if they are named differently."""
+        user_params = spectrum.getElementsByTagName('userParam')
+        found = {param.getAttribute('name'): param.getAttribute('value') for param in user_params
+                 if param.getAttribute('name') in SUMMARY_PARAMS}
+        if len(found) < len(SUMMARY_PARAMS):
+            for param in spectrum.getElementsByTagName('cvParam'):
+                if param.getAttribute('name') in SUMMARY_PARAMS:
+                    found.setdefault(param.getAttribute('name'), param.getAttribute('value'))
+        if not found and len(user_params) >= len(SUMMARY_PARAMS):
+            return [float(param.getAttribute('value')) for param in user_params[:len(SUMMARY_PARAMS)]]
+        return [float(found.get(name) or 'nan') for name in SUMMARY_PARAMS]
+
+    @profiled()
+    def get_values(self, spectrum_dict: Dict[int, xml.dom.minidom.Element]) -> pd.DataFrame:
+        """Creates a table with spectrum ids and base peak m/z, base peak intensity, total ion current,
         lowest and highest observed m/z.
 
+        The values are read into one preallocated array with a column per value, which the table is built around
+        without copying.
+
         Parameters
         ----------
         spectrum_dict: Dict[int, xml.dom.minidom.Element]
@@ -235,43 +280,123 @@ class Reader:
 
         Returns
         -------
-        value_dict: Dict[int, Dict]
-            dictionary containing spectrum ids and the spectrum values
+        df_values: pd.DataFrame
+            spectrum ids (int32) and spectrum values rounded to 2 decimals, indexed by the spectrum keys; the
+            values of empty spectra are NaN
         """
-        value_dict = dict()
+        count = len(spectrum_dict)
+        raw = np.full((count, len(SUMMARY_PARAMS)), np.nan, order='F')  # contiguous columns
         if self.format == 'mzml':
-            for index, key in enumerate(spectrum_dict):
-                if spectrum_dict[key].getAttribute('defaultArrayLength') != '0':
-                    vals = spectrum_dict[key].getElementsByTagName('userParam')
-                    bpmz = vals[0].getAttribute('value')
-                    bpi = vals[1].getAttribute('value')
-                    tic = vals[2].getAttribute('value')
-                    lomz = vals[3].getAttribute('value')
-                    homz = vals[4].getAttribute('value')
-                    value_dict[key] = {'spectra_id': int(index), 'base_peak_m/z': round(float(bpmz), 2),
-                                       'base_peak_intensity': round(float(bpi), 2),
-                                       'total_ion_current': round(float(tic), 2),
-                                       'lowest_observed_m/z': round(float(lomz), 2),
-                                       'highest_observed_m/z': round(float(homz), 2)}
-                else:
-                    value_dict[key] = {'base_peak_m/z': None, 'base_peak_intensity': None, 'total_ion_current': None,
-                                       'lowest_observed_m/z': None, 'highest_observed_m/z': None}
+            for index, spectrum in enumerate(spectrum_dict.values()):
+                if spectrum.getAttribute('defaultArrayLength') != '0':
+                    raw[index] = self.get_summary_params(spectrum)
         elif self.format == 'mzxml':
-            for index, key in enumerate(spectrum_dict):
-                if spectrum_dict[key].getAttribute('peaksCount') >= '0':
-                    bpmz = spectrum_dict[key].getAttribute('basePeakMz')
-                    bpi = spectrum_dict[key].getAttribute('basePeakIntensity')
-                    tic = spectrum_dict[key].getAttribute('totIonCurrent')
-                    lomz = spectrum_dict[key].getAttribute('lowMz')
-                    homz = spectrum_dict[key].getAttribute('highMz')
-                    value_dict[key] = {'spectra_id': int(index), 'base_peak_m/z': round(float(bpmz), 2),
-                                       'base_peak_intensity': round(float(bpi), 2),
-                                       'total_ion_current': round(float(tic), 2),
-                                       'lowest_observed_m/z': round(float(lomz), 2),
-                                       'highest_observed_m/z': round(float(homz), 2)}
-        self.values = value_dict
+            for index, spectrum in enumerate(spectrum_dict.values()):
+                if spectrum.getAttribute('peaksCount') != '0':
+                    raw[index] = [float(spectrum.getAttribute(name) or 'nan') for name in SUMMARY_ATTRIBUTES]
+        np.round(raw, 2, out=raw)
+        columns = {'spectra_id': np.arange(count, dtype=np.int32)}
+        for position, (column, dtype) in enumerate(VALUE_DTYPES.items()):
+            columns[column] = raw[:, position].astype(dtype, copy=False)
+        df_values = pd.DataFrame(columns, index=np.fromiter(spectrum_dict.keys(), dtype=np.int64, count=count),
+                                 columns=VALUE_COLUMNS, copy=False)
+        self.values = df_values
+        profiler.count('spectra', count)
         logger.info('Successfully gathered spectrum values.')
-        return value_dict
+        return df_values
+
+    def get_scan_times(self, spectrum_dict: Dict[int, xml.dom.minidom.Element]) -> Dict[int, float]:
+        """Creates dictionary with spectrum ids and the retention time (scan start time) in seconds.
+
+        Parameters
+        ----------
+        spectrum_dict: Dict[int, xml.dom.minidom.Element]
+            dictionary with spectrum ids as key and xml.dom.minidom.Element as values
+
+        Returns
+        -------
+        scan_times: Dict[int, float]
+            dictionary containing spectrum ids and retention times, None if a spectrum has no retention time
+        """
+        scan_times = dict()
+        for key in spectrum_dict:
+            rt = None
+            if self.format == 'mzml':
+                for param in spectrum_dict[key].getElementsByTagName('cvParam'):
+                    if param.getAttribute('name') == 'scan start time':
+                        rt = float(param.getAttribute('value'))
+                        if param.getAttribute('unitName') == 'minute':
+                            rt *= 60
+                        break
+            elif self.format == 'mzxml':
+                value = spectrum_dict[key].getAttribute('retentionTime')  # xs:duration, e.g. PT1.23S
+                if value.startswith('PT') and value.endswith('S'):
+                    rt = float(value[2:-1])
+            scan_times[key] = rt
+        return scan_times
+
+    def get_precursors(self, spectrum_dict: Dict[int, xml.dom.minidom.Element]) -> Dict[int, Dict]:
+        """Creates dictionary with spectrum ids and the ms level, precursor m/z and precursor charge.
+
+        Parameters
+        ----------
+        spectrum_dict: Dict[int, xml.dom.minidom.Element]
+            dictionary with spectrum ids as key and xml.dom.minidom.Element as values
+
+        Returns
+        -------
+        precursors: Dict[int, Dict]
+            dictionary containing spectrum ids and 'ms_level', 'precursor_mz' and 'charge', the precursor values
+            are None for MS1 spectra and the charge is None if it is not annotated
+        """
+        precursors = dict()
+        for key in spectrum_dict:
+            spectrum = spectrum_dict[key]
+            info = {'ms_level': None, 'precursor_mz': None, 'charge': None}
+            if self.format == 'mzml':
+                for param in spectrum.getElementsByTagName('cvParam'):
+                    name = param.getAttribute('name')
+                    if name == 'ms level':
+                        info['ms_level'] = int(param.getAttribute('value'))
+                    elif name == 'selected ion m/z' and info['precursor_mz'] is None:
+                        info['precursor_mz'] = float(param.getAttribute('value'))
+                    elif name == 'charge state' and info['charge'] is None:
+                        info['charge'] = int(param.getAttribute('value'))
+            elif self.format == 'mzxml':
+                if spectrum.getAttribute('msLevel'):
+                    info['ms_level'] = int(spectrum.getAttribute('msLevel'))
+                for precursor in spectrum.getElementsByTagName('precursorMz')[:1]:
+                    info['precursor_mz'] = float(precursor.firstChild.nodeValue)
+                    if precursor.getAttribute('precursorCharge'):
+                        info['charge'] = int(precursor.getAttribute('precursorCharge'))
+            precursors[key] = info
+        return precursors
+
+    def get_spectrum_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Concatenates the decoded m/z and intensity values of all spectra into flat numpy arrays.
+
+        Returns
+        -------
+        keys: np.ndarray
+            spectrum ids
+        mz: np.ndarray
+            m/z values of all spectra
+        intensity: np.ndarray
+            intensity values of all spectra
+        offsets: np.ndarray
+            the values of the i-th spectrum are mz[offsets[i]:offsets[i + 1]]
+        """
+        keys = np.fromiter(self.spectrum_data.keys(), dtype=np.int64, count=len(self.spectrum_data))
+        lengths = [len(value['mz']) if value['mz'] is not None else 0 for value in self.spectrum_data.values()]
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        mz = np.empty(offsets[-1], dtype=np.float64)
+        intensity = np.empty(offsets[-1], dtype=np.float64)
+        for i, value in enumerate(self.spectrum_data.values()):
+            if value['mz'] is not None:
+                mz[offsets[i]:offsets[i + 1]] = value['mz']
+                intensity[offsets[i]:offsets[i + 1]] = value['intensity']
+        return keys, mz, intensity, offsets
 
     def analyse_spectrum(self) -> pd.DataFrame:
         """Wrapper function for the parsing of an mzML file and the extraction of the m/z and intensity values.
@@ -288,11 +413,7 @@ class Reader:
             self.get_compression(spectrum_dictionary)
             self.get_binary_spectrum_values(spectrum_dictionary)
             self.decode_decompress()
-        values_spectrum = self.get_values(spectrum_dictionary)
-        df_values = pd.DataFrame.from_dict(values_spectrum, orient='index', columns=['spectra_id',
-                                                                                     'base_peak_m/z',
-                                                                                     'base_peak_intensity',
-                                                                                     'total_ion_current',
-                                                                                     'lowest_observed_m/z',
-                                                                                     'highest_observed_m/z'])
+        df_values = self.get_values(spectrum_dictionary)
+        self.scan_times = self.get_scan_times(spectrum_dictionary)
+        self.precursors = self.get_precursors(spectrum_dictionary)
         return df_values
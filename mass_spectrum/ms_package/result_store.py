@@ -0,0 +1,125 @@
+import os
+import uuid
+import fcntl
+import shutil
+import hashlib
+import logging
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Iterator, Optional, Tuple
+
+from ms_package.startup import DATA_DIR
+from ms_package.profiling import profiler
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+STORE_DIR = DATA_DIR.joinpath('results')
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_signature(path: str) -> Tuple[str, int, int]:
+    """Identifies the version of a file by its path, size and modification time."""
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+@lru_cache(maxsize=256)
+def _content_digest(signature: Tuple[str, int, int]) -> str:
+    sha = hashlib.sha256()
+    with open(signature[0], 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 hash of the content of a file, so copies of a file at other paths or uploaded by other users have
+    the same digest. Hashed once per process for every version of the file."""
+    return _content_digest(file_signature(str(path)))
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Holds an exclusive lock on a lock file, blocking until other processes release it. The lock is released by
+    the operating system if the process holding it dies."""
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class ResultStore:
+    """Directory of results keyed by a hash of their inputs, shared by all users and processes.
+
+    A result is computed into a temporary directory and renamed to its key when it is complete, so readers never
+    see a partly written result. The computation of a key holds an exclusive file lock, so processes asking for
+    the same result wait for the first one instead of computing it again. The lock is released by the operating
+    system if the computing process dies.
+    """
+
+    def __init__(self, root: str = STORE_DIR):
+        """
+        parameters:
+            root = directory containing one directory per result
+        """
+        self.root = str(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Hashes the inputs of a result, e.g. a stage name, file digests and settings."""
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        """Directory of the result with the given key."""
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the directory of a complete result, or None if it was not computed yet."""
+        path = self.path(key)
+        return path if os.path.isdir(path) else None
+
+    def lock(self, key: str):
+        """Holds an exclusive lock on a key, blocking until other processes release it, see file_lock."""
+        os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+        return file_lock(self.path(key) + '.lock')
+
+    def compute(self, key: str, fill: Callable[[str], None]) -> str:
+        """Returns the directory of a result, computing it only if no process did before.
+
+        Parameters
+        ----------
+        key: str
+            hash of the inputs of the result, see key
+        fill: Callable[[str], None]
+            writes the files of the result into the given directory
+
+        Returns
+        -------
+        path: str
+            directory of the complete result
+        """
+        path = self.get(key)
+        if path is not None:
+            profiler.count('result_store.hits')
+            return path
+        with self.lock(key):
+            path = self.get(key)
+            if path is not None:  # computed by another process while waiting for the lock
+                profiler.count('result_store.hits')
+                return path
+            path = self.path(key)
+            tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            os.makedirs(tmp_path)
+            try:
+                fill(tmp_path)
+                os.replace(tmp_path, path)
+            except BaseException:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
+        profiler.count('result_store.misses')
+        logger.info(f'Stored result {key}')
+        return path
@@ -11,11 +11,14 @@ PROJECT_DIR = home_dir.joinpath(".plab2_group3_project")
 LOG_DIR = PROJECT_DIR.joinpath("logs")
 DATA_DIR = PROJECT_DIR.joinpath("data")
 
-os.makedirs(LOG_DIR, exist_ok=True)
-os.makedirs(DATA_DIR, exist_ok=True)
-
-
 # Logging Configuration
 LOG_FILE_PATH = os.path.join(LOG_DIR, "group3's_log.log")
-logging.basicConfig(filename=LOG_FILE_PATH, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
+
+def init():
+    """Creates the project directories and configures logging to the log file.
+    Called explicitly by the entry points instead of on import, so importing the package has no side effects.
+    """
+    os.makedirs(LOG_DIR, exist_ok=True)
+    os.makedirs(DATA_DIR, exist_ok=True)
+    logging.basicConfig(filename=LOG_FILE_PATH, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
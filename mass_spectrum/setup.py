@@ -16,6 +16,8 @@ requirements = ["pyopenms",
 
 test_requirements = ['pytest>=3', ]
 
+extras_requirements = {'zstd': ['zstandard']}
+
 setup(
     author="Group03",
     author_email='rohitha0112@gmail.com',
@@ -37,6 +39,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="MIT license",
     include_package_data=True,
     keywords='ms_package',
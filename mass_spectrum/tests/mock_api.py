@@ -0,0 +1,58 @@
+"""Local mock of The Proteins API proteomics endpoint."""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+def make_entry(peptide: str) -> dict:
+    """Creates a fake protein entry for a peptide in The Proteins API format."""
+    return {"accession": f"P{abs(hash(peptide)) % 100000:05d}",
+            "taxid": 9913,
+            "sequence": f"MK{peptide}R",
+            "features": [{"peptide": peptide, "begin": "3", "end": str(2 + len(peptide)),
+                          "evidences": [{"source": {"name": "PeptideAtlas"}}]}]}
+
+
+class MockProteinsAPI:
+    """Serves fake protein entries for every queried peptide. The first `failures` requests are answered
+    with `failure_status` to test the retry logic."""
+
+    def __init__(self, failures: int = 0, failure_status: int = 429):
+        self.failures = failures
+        self.failure_status = failure_status
+        self.requests = list()
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                mock.requests.append(query)
+                if mock.failures > 0:
+                    mock.failures -= 1
+                    self.send_response(mock.failure_status)
+                    self.send_header("Retry-After", "0")
+                    self.end_headers()
+                    return
+                peptides = query["peptide"][0].split(",")
+                body = json.dumps([make_entry(pep) for pep in peptides]).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/proteomics"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
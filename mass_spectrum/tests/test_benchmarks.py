@@ -0,0 +1,76 @@
+"""Benchmark package tests."""
+
+import json
+
+import numpy as np
+import pytest
+
+from ms_package.reader import Reader
+from ms_package.benchmarks.synthetic import fragment_mz, generate_spectra, peptide_mass, write_run
+from ms_package.benchmarks.suite import compare_reports, run_suite, save_report
+
+
+class TestSynthetic:
+    """A test class which checks that the synthetic runs are deterministic and readable."""
+
+    @pytest.mark.parametrize('precision', [32, 64])
+    @pytest.mark.parametrize('compression', [True, False])
+    def test_mzml_round_trip(self, tmp_path, precision, compression):
+        """Tests that the Reader decodes the arrays and summary values written by the generator."""
+        run_path, _, peptides = write_run(str(tmp_path), 10, 'mzml', peaks=20, precision=precision,
+                                          compression=compression)
+        reader = Reader(run_path)
+        values = reader.analyse_spectrum()
+        spectra = list(generate_spectra(10, peaks=20, peptides=peptides))
+        assert len(values) == 10
+        dtype = np.float32 if precision == 32 else np.float64
+        np.testing.assert_array_equal(reader.spectrum_data[3]['mz'], spectra[3]['mz'].astype(dtype))
+        assert values.loc[3, 'highest_observed_m/z'] == round(float(spectra[3]['mz'].astype(dtype)[-1]), 2)
+        assert reader.scan_times[3] == 1.5
+
+    def test_mzxml(self, tmp_path):
+        """Tests that mzXML runs are readable and the same seed gives the same file."""
+        first = write_run(str(tmp_path / 'a'), 10, 'mzxml', peaks=20, indexed=False)[0]
+        second = write_run(str(tmp_path / 'b'), 10, 'mzxml', peaks=20, indexed=False)[0]
+        with open(first, 'rb') as f1, open(second, 'rb') as f2:
+            assert f1.read() == f2.read()
+        values = Reader(first).analyse_spectrum()
+        assert len(values) == 10
+
+    def test_indexed_mzml(self, tmp_path):
+        """Tests that the offset index of indexed mzML runs is accepted by pyopenms."""
+        from pyopenms import OnDiscMSExperiment
+
+        run_path = write_run(str(tmp_path), 10, 'mzml', peaks=20)[0]
+        experiment = OnDiscMSExperiment()
+        assert experiment.openFile(run_path)
+        assert experiment.getNrSpectra() == 10
+        assert experiment.getSpectrum(1).getPrecursors()[0].getCharge() == 2
+
+    def test_fragments(self):
+        """Tests the precursor and fragment masses of a peptide."""
+        assert peptide_mass('PEPTIDE') == pytest.approx(799.35997, abs=1e-4)
+        assert fragment_mz('PEPTIDE')[0] == pytest.approx(98.06004, abs=1e-4)  # b1
+        assert len(fragment_mz('PEPTIDE')) == 12
+
+
+class TestSuite:
+    """A test class which checks running, saving and comparing benchmarks."""
+
+    def test_run_and_compare(self, tmp_path):
+        """Tests a small benchmark run and the comparison of two reports."""
+        report = run_suite(scales=[20], benchmarks=['parse', 'summary', 'proteins'], peaks=10,
+                           data_dir=str(tmp_path), echo=lambda line: None)
+        assert {(r['benchmark'], r['format']) for r in report['results']} == {
+            ('parse', 'mzml'), ('summary', 'mzml'), ('proteins', 'mzml'), ('parse', 'mzxml'), ('summary', 'mzxml')}
+        assert all(r['seconds'] > 0 and r['peak_rss_mb'] > 0 for r in report['results'])
+
+        path = save_report(report, str(tmp_path / 'report.json'))
+        with open(path) as f:
+            saved = json.load(f)
+        slower = json.loads(json.dumps(saved))
+        for result in slower['results']:
+            result['seconds'] *= 2
+        rows = compare_reports(saved, slower)
+        assert len(rows) == 5
+        assert all(row['ratio'] == pytest.approx(2) for row in rows)
@@ -0,0 +1,49 @@
+"""CLI module tests."""
+
+import os
+import sys
+import time
+import subprocess
+
+from click.testing import CliRunner
+
+from ms_package.cli import main
+
+# Cold start budget of `ms_package --help` in seconds, can be raised on slow machines
+STARTUP_BUDGET = float(os.environ.get('MS_PACKAGE_STARTUP_BUDGET', 1.0))
+HEAVY_MODULES = ['pyopenms', 'pandas', 'numpy', 'requests']
+
+
+def run_python(code: str, home: str) -> subprocess.CompletedProcess:
+    """Runs code in a fresh interpreter with a separate home directory."""
+    env = dict(os.environ, HOME=str(home))
+    return subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+
+
+class TestCli:
+    """A test class which checks the startup behaviour of the CLI."""
+
+    def test_import_is_lazy(self, tmp_path):
+        """Tests that importing the CLI neither loads the heavy dependencies nor creates directories."""
+        result = run_python('import sys, ms_package.cli; '
+                            f'print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))', tmp_path)
+        assert result.stdout.strip() == ''
+        assert not os.path.exists(tmp_path / '.plab2_group3_project')
+
+    def test_help_cold_start(self, tmp_path):
+        """Benchmarks the cold start of `ms_package --help` against the startup budget."""
+        timings = list()
+        for _ in range(3):
+            start = time.perf_counter()
+            run_python('import sys; sys.argv = ["ms_package", "--help"]\n'
+                       'from ms_package.cli import main\n'
+                       'try:\n    main()\nexcept SystemExit:\n    pass', tmp_path)
+            timings.append(time.perf_counter() - start)
+        assert min(timings) < STARTUP_BUDGET
+
+    def test_commands_listed(self):
+        """Tests that all commands are available without importing them."""
+        result = CliRunner().invoke(main, ['--help'])
+        assert result.exit_code == 0
+        for command in ['get-spectrum-values', 'peptide-info', 'protein-info', 'run-pipeline', 'library']:
+            assert command in result.output
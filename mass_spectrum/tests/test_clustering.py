@@ -0,0 +1,55 @@
+"""Spectrum clustering tests."""
+
+import numpy as np
+import pytest
+from pyopenms import MSExperiment, MzMLFile
+
+from ms_package.clustering import cluster_file, connected_components, similar_pairs
+from ms_package.benchmarks.synthetic import generate_spectra, write_run
+
+
+@pytest.fixture
+def run(tmp_path):
+    """Synthetic run re-fragmenting the peptides of two proteins, with the peptide of every MS2 spectrum."""
+    path, _, peptides = write_run(str(tmp_path), 400, 'mzml', peaks=50, proteins=2, seed=3)
+    labels = {spectrum['index']: spectrum['precursor']['peptide']
+              for spectrum in generate_spectra(400, peaks=50, peptides=peptides, seed=3) if spectrum['precursor']}
+    return path, labels
+
+
+class TestClustering:
+    """A test class which checks clustering MS2 spectra into consensus spectra."""
+
+    def test_connected_components(self):
+        """Tests labelling the components of a graph, including chains and isolated nodes."""
+        labels = connected_components(7, np.array([5, 1, 3, 0]), np.array([6, 2, 4, 3]))
+        assert list(labels) == [0, 1, 1, 0, 0, 2, 2]
+        assert list(connected_components(3, np.zeros(0, dtype=int), np.zeros(0, dtype=int))) == [0, 1, 2]
+
+    def test_similar_pairs(self):
+        """Tests that only spectra within the precursor and retention time tolerance are paired."""
+        vectors = {'precursor_mz': np.array([500.0, 500.001, 500.002, 600.0]),
+                   'rt': np.array([10.0, 15.0, 100.0, 10.0]), 'charge': np.array([2, 2, 2, 2]),
+                   'indptr': np.array([0, 1, 2, 3, 4]),
+                   'indices': np.array([300, 300, 300, 300]), 'data': np.ones(4, dtype=np.float32)}
+        first, second, similarity = similar_pairs(vectors, tolerance=10, rt_tolerance=30)
+        assert list(zip(first, second)) == [(0, 1)]
+        assert np.allclose(similarity, 1.0)
+
+    def test_cluster_file(self, run, tmp_path):
+        """Tests that clusters contain one peptide and the consensus spectra can be loaded for the search."""
+        path, labels = run
+        output = str(tmp_path.joinpath('consensus.mzML'))
+        assignments = cluster_file(path, output)
+        assert len(assignments) == 200
+        assignments['peptide'] = assignments['spectrum'].map(labels)
+        assert (assignments.groupby('cluster')['peptide'].nunique() == 1).all()
+        clusters = assignments['cluster'].nunique()
+        assert clusters < 150
+        experiment = MSExperiment()
+        MzMLFile().load(output, experiment)
+        assert experiment.getNrSpectra() == clusters
+        largest = assignments['cluster_size'].idxmax()
+        spectrum = experiment.getSpectrum(int(assignments.loc[largest, 'cluster']))
+        assert spectrum.getMSLevel() == 2 and spectrum.getPrecursors()[0].getCharge() == 2
+        assert spectrum.size() >= 10
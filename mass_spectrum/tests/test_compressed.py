@@ -0,0 +1,71 @@
+"""Compressed input tests."""
+
+import gzip
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ms_package.reader import Reader
+from ms_package.compressed import IndexedMzML, open_seekable, write_bgzf, write_zstd_seekable
+from ms_package.benchmarks.synthetic import write_run
+
+
+@pytest.fixture
+def run_path(tmp_path):
+    """Indexed synthetic mzML run of about 200 kB."""
+    return write_run(str(tmp_path), 30, 'mzml', peaks=50)[0]
+
+
+def compress(run_path, kind):
+    """Writes a compressed copy of the run."""
+    if kind == 'gzip':
+        with open(run_path, 'rb') as src, gzip.open(run_path + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        return run_path + '.gz'
+    if kind == 'bgzf':
+        write_bgzf(run_path, run_path + '.bgz')
+        return run_path + '.bgz'
+    pytest.importorskip('zstandard')
+    write_zstd_seekable(run_path, run_path + '.zst', frame_size=4096)
+    return run_path + '.zst'
+
+
+class TestCompressed:
+    """A test class which checks reading gzip and zstd compressed mzML files."""
+
+    @pytest.mark.parametrize('kind', ['gzip', 'bgzf', 'zstd'])
+    def test_reader(self, run_path, kind):
+        """Tests that the Reader gives the same values for compressed and uncompressed files."""
+        path = compress(run_path, kind)
+        reader = Reader(path)
+        assert reader.check_extension() and reader.format == 'mzml'
+        pd.testing.assert_frame_equal(reader.analyse_spectrum(), Reader(run_path).analyse_spectrum())
+
+    @pytest.mark.parametrize('kind', ['bgzf', 'zstd'])
+    def test_random_access(self, run_path, kind):
+        """Tests reading single spectra through the offset index of seekable compressed files."""
+        path = compress(run_path, kind)
+        with open(run_path, 'rb') as f:
+            content = f.read()
+        data = open_seekable(path)
+        assert data.size == len(content)
+        assert data.read_at(100_000, 70_000) == content[100_000:170_000]
+
+        indexed = IndexedMzML(path)
+        assert len(indexed) == 30 and indexed.ids[7] == 'scan=8'
+        reader = Reader(path)
+        reader.check_extension()
+        spectrum_dict = indexed.get_spectrum_dict([7, 21])
+        reader.get_compression(spectrum_dict)
+        reader.get_binary_spectrum_values(spectrum_dict)
+        reader.decode_decompress()
+        full = Reader(run_path)
+        full.analyse_spectrum()
+        np.testing.assert_array_equal(reader.spectrum_data[21]['mz'], full.spectrum_data[21]['mz'])
+
+    def test_plain_gzip_not_seekable(self, run_path):
+        """Tests that plain gzip files are rejected for random access."""
+        with pytest.raises(ValueError):
+            IndexedMzML(compress(run_path, 'gzip'))
@@ -0,0 +1,62 @@
+"""Daemon module tests."""
+
+import threading
+
+import pandas as pd
+import pytest
+
+from ms_package import daemon
+from .constants import TEST_FASTA_FILE
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    """Runs a daemon on a temporary socket for the duration of a test."""
+    path = str(tmp_path / 'test.sock')
+    server = daemon.Daemon(path)
+    thread = threading.Thread(target=server.serve, kwargs={'preload': False}, daemon=True)
+    thread.start()
+    yield path
+    daemon.call('shutdown', socket_path=path)
+    thread.join(timeout=5)
+
+
+class TestDaemon:
+    """A test class which checks forwarding commands to the daemon and the in-process fallback."""
+
+    def test_forwarded_command(self, socket_path):
+        """Tests that a forwarded command returns the same table as running it in process."""
+        peptides = ['DLGEEHFK', 'LVTDLTK']
+        remote = daemon.call('protein_info', socket_path=socket_path, peptides=peptides,
+                             database=str(TEST_FASTA_FILE))
+        local = daemon.protein_info(peptides, database=str(TEST_FASTA_FILE))
+        assert isinstance(remote, pd.DataFrame)
+        pd.testing.assert_frame_equal(remote.fillna(-1), local.fillna(-1), check_dtype=False)
+
+    def test_ping_and_errors(self, socket_path):
+        """Tests the status command and that failing commands raise a DaemonError."""
+        info = daemon.call('ping', socket_path=socket_path)
+        assert info['pid'] > 0
+        with pytest.raises(daemon.DaemonError):
+            daemon.call('spectrum_values', socket_path=socket_path, path='/does/not/exist.mzML')
+
+    def test_fallback(self, tmp_path):
+        """Tests that commands run in process if no daemon is running."""
+        with pytest.raises(daemon.DaemonUnavailable):
+            daemon.call('ping', socket_path=str(tmp_path / 'missing.sock'))
+        result = daemon.run('protein_info', socket_path=str(tmp_path / 'missing.sock'), peptides=['DLGEEHFK'],
+                            database=str(TEST_FASTA_FILE))
+        assert list(result['Peptide']) == ['DLGEEHFK']
+
+    def test_result_cache(self, tmp_path):
+        """Tests that results are cached until the input file changes."""
+        cache = daemon.ResultCache(size=2)
+        path = tmp_path / 'input.txt'
+        path.write_text('a')
+        calls = list()
+        for _ in range(3):
+            cache.get(('test', daemon.file_signature(str(path))), lambda: calls.append(1))
+        assert len(calls) == 1
+        path.write_text('changed')
+        cache.get(('test', daemon.file_signature(str(path))), lambda: calls.append(1))
+        assert len(calls) == 2
@@ -0,0 +1,86 @@
+"""Multi-database digest tests."""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ms_package.databases import Digest, digest_protein, merge_hits, read_fasta
+from ms_package.peptide_prediction import PeptideSearch
+
+PROTEOME = '>sp|P1|ONE\nMAAAAAAAKGGGGGGGRXXXXK\n>sp|P2|TWO\nLLLLLLLKGGGGGGGR\n'
+CONTAMINANTS = '>sp|P3|THREE\nGGGGGGGRCCCCCCCK\n>sp|P2|TWO\nLLLLLLLKGGGGGGGR\n'
+
+
+@pytest.fixture
+def databases(tmp_path):
+    paths = list()
+    for name, content in (('proteome.fasta', PROTEOME), ('contaminants.fasta', CONTAMINANTS)):
+        path = tmp_path / name
+        path.write_text(content)
+        paths.append(str(path))
+    return paths
+
+
+def write_shards(job):
+    databases, shard_dir = job
+    return Digest(databases).write_shards(shard_dir, shard_peptides=2)
+
+
+class TestDatabases:
+    """A test class which checks digesting, deduplicating and sharding several FASTA files."""
+
+    def test_digest_protein(self):
+        """Tests tryptic cleavage, which is blocked before proline, with one missed cleavage."""
+        assert digest_protein('MKAAAAAAAKPLLLLLLLRGGGGGGGGK') == [
+            'MKAAAAAAAKPLLLLLLLR', 'AAAAAAAKPLLLLLLLR', 'AAAAAAAKPLLLLLLLRGGGGGGGGK', 'GGGGGGGGK']
+        assert digest_protein('SAMPLEK' * 3, missed_cleavages=0, max_length=7) == ['SAMPLEK'] * 3
+
+    def test_digest(self, databases):
+        """Tests that shared peptides are kept once with all their proteins, each listed once, sorted by mass."""
+        digest = Digest(databases)
+        assert len(digest.accessions) == 4
+        assert len(set(digest.peptides)) == len(digest) == 7
+        assert np.all(np.diff(digest.masses) >= 0)
+        # peptides with unknown residues are left out
+        assert not any('X' in peptide for peptide in digest.peptides)
+        assert digest.proteins(['GGGGGGGR', 'C(Carbamidomethyl)CCCCCCK', 'LLLLLLLK', 'PEPTIDE']) == [
+            ['P1', 'P2', 'P3'], ['P3'], ['P2'], []]
+
+    def test_write_shards(self, databases, tmp_path):
+        """Tests that the shards hold every peptide once, in order of mass."""
+        digest = Digest(databases)
+        paths = digest.write_shards(str(tmp_path / 'shards'), shard_peptides=3)
+        assert len(paths) == 3
+        peptides = [sequence for path in paths for _, sequence in read_fasta(path)]
+        assert peptides == list(digest.peptides)
+        assert digest.write_shards(str(tmp_path / 'shards'), shard_peptides=3) == paths
+
+    def test_concurrent_write_shards(self, databases, tmp_path):
+        """Tests that processes writing the same shards at the same time all get the complete shards."""
+        shard_dir = str(tmp_path / 'shards')
+        with ProcessPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(write_shards, [(databases, shard_dir)] * 8))
+        assert all(paths == results[0] for paths in results)
+        peptides = [sequence for path in results[0] for _, sequence in read_fasta(path)]
+        assert peptides == list(Digest(databases).peptides)
+        assert sorted(os.listdir(shard_dir)) == ['.lock'] + [os.path.basename(path) for path in results[0]]
+
+    def test_merge_hits(self):
+        """Tests that the best scoring hit of every spectrum over the shards is kept."""
+        columns = ['Peptide ID m/z', 'Peptide ID rt', 'Peptide hit sequence', 'Peptide hit score', 'spectrum',
+                   'sequences']
+        first = pd.DataFrame([(400.0, 10.0, 'AAAK', 0.2, 'scan=1', ['AAAK']),
+                              (500.0, 20.0, 'CCCK', 0.5, 'scan=2', ['CCCK'])], columns=columns)
+        second = pd.DataFrame([(400.0, 10.0, 'GGGK', 0.4, 'scan=1', ['GGGK'])], columns=columns)
+        merged = merge_hits([first, second])
+        assert merged['Peptide hit sequence'].tolist() == ['GGGK', 'CCCK']
+        assert len(merge_hits([])) == 0
+
+    def test_peptide_search_paths(self, databases):
+        """Tests that a single FASTA file in a list is searched as before and several only as a digest."""
+        assert PeptideSearch(databases[:1], 'run.mzML').fasta_path == databases[0]
+        with pytest.raises(ValueError):
+            PeptideSearch(databases, 'run.mzML').peptide_search()
@@ -0,0 +1,59 @@
+"""Isotope envelope deconvolution tests."""
+
+import numpy as np
+import pytest
+
+from ms_package.deconvolution import ISOTOPE_SPACING, PROTON, averagine, deconvolve, deconvolve_file, find_masses
+from ms_package.benchmarks.synthetic import peptide_features, peptide_mass, write_run
+
+
+def envelope(mass, charge, scale, isotopes=5):
+    """m/z and intensities of the first isotope peaks of an averagine peptide."""
+    return ((mass + charge * PROTON + np.arange(isotopes) * ISOTOPE_SPACING) / charge,
+            scale * averagine(np.array([mass]), isotopes)[0])
+
+
+class TestDeconvolution:
+    """A test class which checks finding isotope envelopes, their charge and neutral mass."""
+
+    def test_averagine(self):
+        """Tests that the isotope distribution shifts to heavier isotopes with the mass."""
+        pattern = averagine(np.array([500.0, 5000.0]), 6)
+        assert np.argmax(pattern[0]) == 0
+        assert np.argmax(pattern[1]) >= 2
+
+    def test_deconvolve(self):
+        """Tests that overlapping envelopes of different charges are separated from noise peaks."""
+        rng = np.random.default_rng(0)
+        peaks = [envelope(1500.0, 2, 1e5), envelope(1502.5, 3, 5e4), envelope(900.0, 1, 2e4),
+                 (rng.uniform(300, 1500, 30), rng.uniform(10, 100, 30))]
+        mz = np.concatenate([peak[0] for peak in peaks])
+        intensity = np.concatenate([peak[1] for peak in peaks])
+        order = np.argsort(mz)
+        # the same peaks in two spectra, and an empty spectrum between them
+        offsets = np.array([0, len(mz), len(mz), 2 * len(mz)])
+        envelopes = deconvolve(np.tile(mz[order], 2), np.tile(intensity[order], 2), offsets)
+        found = sorted(zip(envelopes['spectrum'], np.round(envelopes['neutral_mass'], 3), envelopes['charge']))
+        assert found == [(0, 900.0, 1), (0, 1500.0, 2), (0, 1502.5, 3), (2, 900.0, 1), (2, 1500.0, 2),
+                         (2, 1502.5, 3)]
+        assert np.all(envelopes['isotopes'] == 5)
+        assert np.all(envelopes['score'] > 0.99)
+
+    def test_empty(self):
+        """Tests spectra without peaks."""
+        envelopes = deconvolve(np.zeros(0), np.zeros(0), np.array([0, 0]))
+        assert len(envelopes['neutral_mass']) == 0
+
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_deconvolve_file(self, tmp_path, workers):
+        """Tests that the peptides eluting in a synthetic run are found with their charge."""
+        path, _, peptides = write_run(str(tmp_path), 400, 'mzml', peaks=50, proteins=2, seed=1, isotopes=5)
+        masses = deconvolve_file(path, workers=workers)
+        assert np.all(np.diff(masses['neutral_mass']) >= 0)
+        assert masses['charge'].dtype == np.int8
+        elution, _, charge, _, _ = peptide_features(peptides, 200.0, 5)
+        for peptide, peptide_charge, apex in zip(peptides, charge, elution):
+            found = find_masses(masses, peptide_mass(peptide))
+            assert len(found) > 0
+            assert (found['charge'] == peptide_charge).all()
+            assert abs(found.loc[found['intensity'].idxmax(), 'rt'] - apex) < 5
@@ -0,0 +1,33 @@
+""" Downsample module tests. """
+
+import numpy as np
+
+from ms_package.downsample import minmax_downsample
+
+
+class TestDownsample:
+    """Unit tests for the min/max downsampling of plot traces"""
+
+    def test_keeps_extremes(self):
+        """Checks that the trace is reduced to at most two points per pixel and keeps every peak apex"""
+        x = np.linspace(100, 2000, 1_000_000)
+        y = np.abs(np.sin(x)) * 10
+        y[123456] = 1000
+        y[654321] = -5
+        dx, dy = minmax_downsample(x, y, width=500)
+        assert len(dx) <= 1000
+        assert np.all(np.diff(dx) > 0)
+        assert dy.max() == 1000
+        assert dy.min() == -5
+        assert x[123456] in dx
+
+    def test_zoom(self):
+        """Checks that only the visible range is returned and small traces are not reduced"""
+        x = np.arange(1000, dtype=float)
+        y = np.arange(1000, dtype=float)
+        dx, dy = minmax_downsample(x, y, width=100, x_min=10, x_max=20)
+        assert list(dx) == list(range(10, 21))
+        dx, dy = minmax_downsample(x, y, width=100, x_min=0, x_max=999)
+        assert len(dx) == 200
+        assert dx[0] == 0 and dx[-1] == 999
+        assert len(minmax_downsample(np.array([]), np.array([]), 10)[0]) == 0
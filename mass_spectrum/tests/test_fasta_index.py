@@ -0,0 +1,48 @@
+""" Offline FASTA index module tests. """
+
+from ms_package.fasta_index import ProteomeIndex, read_fasta, parse_header
+from ms_package.protein_cache import PROTEIN_COLUMNS
+from ms_package.protein_prediction import ProteinSearch
+from .constants import TEST_FASTA_FILE
+
+
+class TestProteomeIndex:
+    """Unit tests for the offline peptide to protein mapping"""
+
+    def test_read_fasta(self):
+        """Checks the FASTA reader and header parsing"""
+        entries = read_fasta(str(TEST_FASTA_FILE))
+        assert len(entries) == 1
+        assert entries[0][1].startswith("MKWVTFISLLLLFSSAYSRGVFRRDTHKSEIAHRFKDLGEEHFK")
+        assert parse_header(entries[0][0]) == ("P02769", None)
+        assert parse_header("tr|A0A140T897|A0A140T897_BOVIN Serum albumin OS=Bos taurus OX=9913") == \
+            ("A0A140T897", 9913)
+
+    def test_map_peptides(self):
+        """Checks that peptides are mapped with the columns and positions of the API results"""
+        index = ProteomeIndex(str(TEST_FASTA_FILE))
+        df = index.map_peptides(["DLGEEHFK", "LVTDLTK", "MKWV", "NOTINBSAK", "DLGEEHFK"])
+        assert list(df.columns) == PROTEIN_COLUMNS
+        assert list(df["Peptide"]) == ["DLGEEHFK", "LVTDLTK", "MKWV"]
+        assert df["Protein_Accession"].unique() == ["P02769"]
+        assert df["Peptide Position"].iloc[0] == "37 to 44"
+        assert df["Peptide Position"].iloc[2] == "1 to 4"
+        assert df["Data Source"].iloc[0] == "BSA.fasta"
+
+    def test_protein_boundaries(self, tmp_path):
+        """Checks that every occurrence is found and that matches never span two proteins"""
+        fasta = tmp_path / "test.fasta"
+        fasta.write_text(">sp|P1|A_HUMAN OX=9606\nPEPTIDEKPEPTIDEK\nAAAC\n>sp|P2|B_HUMAN OX=9606\nDEFGPEPTIDEK\n")
+        index = ProteomeIndex(str(fasta), k=4)
+        df = index.map_peptides(["PEPTIDEK", "AACDEF", "AAC", "K"])
+        assert list(df["Peptide Position"][df["Peptide"] == "PEPTIDEK"]) == ["1 to 8", "9 to 16", "5 to 12"]
+        assert "AACDEF" not in set(df["Peptide"])
+        assert list(df["Protein_Accession"][df["Peptide"] == "AAC"]) == ["P1"]
+        assert len(df[df["Peptide"] == "K"]) == 3
+        assert df["Taxonomy_ID"].iloc[0] == 9606
+
+    def test_protein_search_offline(self):
+        """Checks that ProteinSearch maps peptides offline when a FASTA file is given"""
+        pro = ProteinSearch(peptide_list=["DLGEEHFK", "LC(Carbamidomethyl)VLHEK"], fasta_path=str(TEST_FASTA_FILE))
+        pro.get_proteins()
+        assert list(pro.ans_df["Peptide"]) == ["DLGEEHFK"]
@@ -0,0 +1,68 @@
+"""Follow module tests."""
+
+import gzip
+import argparse
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ms_package.follow import SpectrumFollower
+from ms_package.reader import Reader
+from ms_package.benchmarks.synthetic import write_run
+
+
+class TestFollow:
+    """A test class which checks reading an mzML file while it is being written."""
+
+    def test_growing_file(self, tmp_path):
+        """Tests that spectra are read once they are completely written and match reading the whole file."""
+        run_path = write_run(str(tmp_path / 'runs'), 12, 'mzml', peaks=10)[0]
+        with open(run_path, 'rb') as f:
+            content = f.read()
+        full = Reader(run_path)
+        expected = full.analyse_spectrum()
+
+        growing = str(tmp_path / 'growing.mzML')
+        checkpoint = str(tmp_path / 'checkpoint.json')
+        # the first cut ends in the middle of the sixth spectrum
+        cut = content.index(b'<spectrum index="5"') + 100
+        with open(growing, 'wb') as f:
+            f.write(content[:cut])
+        follower = SpectrumFollower(growing, checkpoint_path=checkpoint)
+        first, first_arrays = follower.poll()
+        assert list(first.index) == [0, 1, 2, 3, 4]
+        assert not follower.finished
+        assert follower.poll()[0].empty
+
+        with open(growing, 'ab') as f:
+            f.write(content[cut:])
+        second, second_arrays = follower.poll()
+        assert list(second.index) == list(range(5, 12))
+        assert follower.finished
+
+        values = pd.concat([first, second])
+        pd.testing.assert_frame_equal(values[expected.columns], expected)
+        assert values.loc[7, 'scan_time'] == full.get_scan_times(
+            full.get_spectrum_dict(full.get_spectrum_list(full.parse_file())))[7]
+        np.testing.assert_array_equal(second_arrays[7]['mz'], full.spectrum_data[7]['mz'])
+
+        resumed = SpectrumFollower(growing, checkpoint_path=checkpoint)
+        assert resumed.count == 12 and resumed.poll()[0].empty
+
+    def test_follow(self, tmp_path):
+        """Tests that follow stops at the end of the run."""
+        run_path = write_run(str(tmp_path), 4, 'mzml', peaks=10)[0]
+        polls = list(SpectrumFollower(run_path, decode=False).follow(interval=0))
+        assert len(polls) == 1 and len(polls[0][0]) == 4 and polls[0][1] == {}
+
+    def test_compressed_file(self, tmp_path):
+        """Tests that compressed files are refused instead of being followed forever."""
+        run_path = write_run(str(tmp_path / 'runs'), 2, 'mzml', peaks=10)[0]
+        with open(run_path, 'rb') as f:
+            content = f.read()
+        for name in ('run.mzML.gz', 'run.mzML'):
+            with gzip.open(str(tmp_path / name), 'wb') as f:
+                f.write(content)
+            with pytest.raises(argparse.ArgumentTypeError):
+                SpectrumFollower(str(tmp_path / name))
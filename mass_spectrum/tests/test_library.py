@@ -0,0 +1,79 @@
+"""Spectral library tests."""
+
+import numpy as np
+import pytest
+
+from ms_package.reader import Reader
+from ms_package.library import SpectralLibrary, bin_spectra, run_vectors, search_file
+from ms_package.benchmarks.synthetic import generate_spectra, write_mzml, write_run
+
+
+def labels(count, peptides, seed):
+    """Peptide of every MS2 spectrum of a synthetic run."""
+    return {spectrum['index']: spectrum['precursor']['peptide']
+            for spectrum in generate_spectra(count, peaks=50, peptides=peptides, seed=seed) if spectrum['precursor']}
+
+
+@pytest.fixture
+def runs(tmp_path):
+    """Library run and query run of the same synthetic proteome, with the peptides of their MS2 spectra."""
+    library_path, _, peptides = write_run(str(tmp_path), 200, 'mzml', peaks=50, proteins=5, seed=1)
+    query_path = str(tmp_path.joinpath('query.mzML'))
+    write_mzml(query_path, 200, peaks=50, peptides=peptides, seed=2)
+    return library_path, labels(200, peptides, 1), query_path, labels(200, peptides, 2)
+
+
+class TestLibrary:
+    """A test class which checks building and searching spectral libraries."""
+
+    def test_bin_spectra(self):
+        """Tests that peaks in the same bin are summed and the vectors are normalised."""
+        mz = np.array([150.1, 150.3, 400.0, 50.0, 300.0, 500.0, 700.0, 800.0])
+        intensity = np.array([4.0, 5.0, 16.0, 1.0, 1.0, 4.0, 9.0, 16.0])
+        indptr, indices, data = bin_spectra(mz, intensity, np.array([0, 3, 4, 8]), bin_width=1.0, bin_offset=0.0,
+                                            max_peaks=3)
+        assert list(indptr) == [0, 2, 2, 5]
+        assert list(indices) == [150, 400, 500, 700, 800]  # the least intense peak of the last spectrum is dropped
+        assert np.allclose(data[:2], np.array([2 + np.sqrt(5), 4]) / np.sqrt((2 + np.sqrt(5)) ** 2 + 16))
+        assert np.allclose(data[2:], np.array([2, 3, 4]) / np.sqrt(29))
+
+    def test_get_precursors(self, runs):
+        """Tests that the ms level, precursor m/z and charge are extracted."""
+        reader = Reader(runs[0])
+        reader.analyse_spectrum()
+        assert reader.precursors[0] == {'ms_level': 1, 'precursor_mz': None, 'charge': None}
+        assert reader.precursors[1]['ms_level'] == 2 and reader.precursors[1]['charge'] == 2
+        assert reader.precursors[1]['precursor_mz'] > 0
+
+    @pytest.mark.parametrize('approximate', [False, True])
+    def test_search(self, runs, tmp_path, approximate):
+        """Tests that query spectra are matched to library spectra of the same peptide."""
+        library_path, library_labels, query_path, query_labels = runs
+        library = SpectralLibrary.from_file(library_path, peptides=library_labels)
+        assert len(library) == 100
+        assert np.all(np.diff(library.precursor_mz) >= 0)
+        library.save(str(tmp_path.joinpath('library')))
+        matches = search_file(str(tmp_path.joinpath('library')), query_path, approximate=approximate)
+        assert len(matches) > 50
+        assert (matches['peptide'] == matches['query'].map(query_labels)).mean() > 0.95
+        assert matches['score'].between(0, 1 + 1e-6).all()
+
+    def test_self_search(self, runs):
+        """Tests that every spectrum is its own best match and the matches are ranked by score."""
+        vectors = run_vectors(runs[0])
+        library = SpectralLibrary.build(vectors)
+        matches = library.search(vectors, tolerance=10, unit='ppm', top=3)
+        best = matches[matches['rank'] == 1]
+        assert len(best) == 100
+        assert np.allclose(best['score'], 1.0, atol=1e-5)
+        assert (matches.groupby('query')['score'].apply(lambda s: s.is_monotonic_decreasing)).all()
+
+    def test_load(self, runs, tmp_path):
+        """Tests that a saved library is memory mapped and gives the same matches, also searched in two processes."""
+        library = SpectralLibrary.from_file(runs[0], peptides=runs[1])
+        library.save(str(tmp_path.joinpath('library')))
+        loaded = SpectralLibrary.load(str(tmp_path.joinpath('library')))
+        assert isinstance(loaded.data, np.memmap)
+        queries = run_vectors(runs[2])
+        assert library.search(queries).equals(loaded.search(queries))
+        assert search_file(str(tmp_path.joinpath('library')), runs[2], workers=2).equals(loaded.search(queries))
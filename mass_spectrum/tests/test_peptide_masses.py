@@ -0,0 +1,53 @@
+"""Batch peptide mass calculator tests."""
+
+import numpy as np
+import pandas as pd
+
+from ms_package.peptide_masses import encode, modification_sites, mz_values, peptide_masses, residue_table, \
+    variable_masses
+from ms_package.quantification import identifications_from_search
+
+
+class TestPeptideMasses:
+    """A test class which checks the vectorised masses and m/z of peptide lists."""
+
+    def test_encode(self):
+        """Tests that modifications written into sequences are removed from the residues and summed."""
+        codes, offsets, deltas = encode(['PEPM(Oxidation)K', 'ak', '', '.(Acetyl)PEPM[+15.995]K'])
+        assert codes.tobytes() == b'PEPMKAKPEPMK'
+        assert list(offsets) == [0, 5, 7, 7, 12]
+        assert np.allclose(deltas, [15.994915, 0.0, 0.0, 42.010565 + 15.995])
+
+    def test_peptide_masses(self):
+        """Tests monoisotopic and average masses against known values, and NaN for unknown residues."""
+        masses = peptide_masses(['PEPTIDE', 'ACDEFGHIKLMNPQRSTVWY', 'PEPM(Oxidation)K', 'PEPXIDE', 'PEPM(Foo)K'])
+        assert np.allclose(masses[:3], [799.359965, 2394.124900, 616.289049], atol=1e-5)
+        assert np.isnan(masses[3:]).all()
+        assert np.allclose(peptide_masses(['PEPTIDE'], average=True), 799.8328, atol=1e-3)
+        assert np.allclose(peptide_masses(['CAK'], fixed_modifications={'C': 57.021464}),
+                           peptide_masses(['C(Carbamidomethyl)AK']))
+        assert residue_table() is residue_table()
+
+    def test_mz_values(self):
+        """Tests the m/z of several charges."""
+        mz = mz_values(peptide_masses(['PEPTIDE']), (1, 2))
+        assert mz.shape == (1, 2)
+        assert np.allclose(mz, [800.367241, 400.687259], atol=1e-5)
+
+    def test_variable_masses(self):
+        """Tests that only combinations with enough modifiable residues are kept."""
+        codes, offsets, _ = encode(['PEPMK', 'MSTM', 'A'])
+        assert modification_sites(codes, offsets, ['M', 'sty']).tolist() == [[1, 0], [2, 2], [0, 0]]
+        forms = variable_masses(['PEPMK', 'MSTM', 'A'], {'M': 15.994915, 'STY': 79.966331}, max_modifications=2)
+        assert np.bincount(forms['peptide']).tolist() == [2, 6, 1]
+        assert forms['modifications'][forms['peptide'] == 0].tolist() == [[0, 0], [1, 0]]
+        unmodified = peptide_masses(['PEPMK', 'MSTM', 'A'])[forms['peptide']]
+        assert np.allclose(forms['mass'] - unmodified, forms['modifications'] @ [15.994915, 79.966331])
+
+    def test_identifications_from_search(self):
+        """Tests that the charge of a peptide hit is taken from its precursor m/z."""
+        hits = pd.DataFrame({'Peptide ID m/z': [400.69, 800.37], 'Peptide ID rt': [10.0, 20.0],
+                             'Peptide hit sequence': ['PEPTIDE', 'PEPTIDE']})
+        identifications = identifications_from_search(hits, 'run')
+        assert identifications['charge'].tolist() == [2, 1]
+        assert np.allclose(identifications['m/z'], [400.687259, 800.367241], atol=1e-5)
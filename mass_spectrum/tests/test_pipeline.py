@@ -0,0 +1,126 @@
+"""Pipeline module tests."""
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ms_package.pipeline import Checkpoints, Stage, clear_work_dir, run_stages, shard_spectra, work_dir_for
+
+
+def square(x):
+    time.sleep(0.05)
+    return x * x
+
+
+def slow_increment(x):
+    time.sleep(0.05)
+    return x + 1
+
+
+def fail_on_three(x):
+    if x == 9:
+        raise ValueError('bad item')
+    return x
+
+
+class TestPipeline:
+    """A test class which checks the streaming stage graph and the mzML sharding."""
+
+    def test_order_and_overlap(self):
+        """Tests that results come in source order and that the stages run concurrently."""
+        stages = [Stage('square', square, workers=2, processes=True), Stage('increment', slow_increment)]
+        results = list(run_stages(range(10), stages, queue_size=2))
+        assert results == [(i, i * i + 1) for i in range(10)]
+
+        # the last item of the first stage waits for the second stage to start on the first item, which would
+        # never happen if the stages ran one after the other
+        started = threading.Event()
+        overlapped = list()
+
+        def first(x):
+            if x == 9:
+                overlapped.append(started.wait(timeout=10))
+            return x
+
+        def second(x):
+            started.set()
+            return x
+
+        assert [i for i, _ in run_stages(range(10), [Stage('first', first, workers=2), Stage('second', second)],
+                                         queue_size=2)] == list(range(10))
+        assert overlapped == [True]
+
+    def test_resume(self, tmp_path):
+        """Tests that checkpointed items are not computed again."""
+        calls = list()
+
+        def record(x):
+            calls.append(x)
+            return x * 10
+
+        checkpoints = Checkpoints(tmp_path)
+        assert list(run_stages(range(3), [Stage('record', record)], checkpoints)) == [(0, 0), (1, 10), (2, 20)]
+        assert list(run_stages(range(4), [Stage('record', record)], checkpoints)) == [(0, 0), (1, 10), (2, 20),
+                                                                                      (3, 30)]
+        assert calls == [0, 1, 2, 3]
+
+    def test_concurrent_checkpoints(self, tmp_path):
+        """Tests that runs saving the same checkpoint at the same time leave one complete checkpoint."""
+        checkpoints = Checkpoints(tmp_path)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda i: checkpoints.save('search', 0, list(range(100000))), range(8)))
+        assert checkpoints.load('search', 0) == list(range(100000))
+        assert os.listdir(tmp_path) == ['search-00000.pkl']
+
+    def test_errors(self):
+        """Tests that an exception in a stage stops the pipeline and is raised to the caller."""
+        with pytest.raises(ValueError):
+            list(run_stages(range(100), [Stage('square', lambda x: x * x), Stage('fail', fail_on_three)]))
+
+    def test_work_dir(self, tmp_path):
+        """Tests that a given work directory is namespaced by the inputs and that clearing it only removes the
+        files of the pipeline."""
+        fasta_path, mzml_path = tmp_path / 'proteins.fasta', tmp_path / 'run.mzML'
+        fasta_path.write_text('>P1\nPEPTIDEK\n')
+        mzml_path.write_text('spectra')
+        work_dir = work_dir_for(str(fasta_path), str(mzml_path), None, 500, root=str(tmp_path / 'results'))
+        assert os.path.dirname(work_dir) == str(tmp_path / 'results')
+        assert work_dir != work_dir_for(str(fasta_path), str(mzml_path), None, 500, cluster=True,
+                                        root=str(tmp_path / 'results'))
+
+        os.makedirs(os.path.join(work_dir, 'notes'))
+        for name in ('shard-00000.mzML', 'search-00000.pkl', 'proteins-00000.pkl', 'consensus.mzML',
+                     'report.csv'):
+            open(os.path.join(work_dir, name), 'w').close()
+        clear_work_dir(work_dir, [Stage('search', square), Stage('proteins', square)])
+        assert sorted(os.listdir(work_dir)) == ['notes', 'report.csv']
+
+    def test_shard_spectra(self, tmp_path):
+        """Tests splitting an mzML file into shards."""
+        from pyopenms import MSExperiment, MSSpectrum, MzMLFile
+
+        experiment = MSExperiment()
+        for i in range(7):
+            spectrum = MSSpectrum()
+            spectrum.setRT(float(i))
+            spectrum.set_peaks(([100.0 + i, 200.0], [1.0, 2.0]))
+            experiment.addSpectrum(spectrum)
+        mzml_path = str(tmp_path / 'test.mzML')
+        MzMLFile().store(mzml_path, experiment)
+
+        # runs of the same inputs share the shard directory
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            runs = list(executor.map(lambda _: list(shard_spectra(mzml_path, str(tmp_path / 'shards'), shard_size=3)),
+                                     range(4)))
+        shards = runs[0]
+        assert all(run == shards for run in runs)
+        assert sorted(os.listdir(tmp_path / 'shards')) == [os.path.basename(path) for path in shards]
+        assert [os.path.basename(path) for path in shards] == ['shard-00000.mzML', 'shard-00001.mzML',
+                                                               'shard-00002.mzML']
+        last = MSExperiment()
+        MzMLFile().load(shards[-1], last)
+        assert last.getNrSpectra() == 1
+        assert last.getSpectrum(0).getRT() == 6.0
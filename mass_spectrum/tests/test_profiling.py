@@ -0,0 +1,68 @@
+"""Profiling module tests."""
+
+import json
+
+import pytest
+
+from ms_package.profiling import Profiler, profiled, profiler
+from ms_package.reader import Reader
+from ms_package.benchmarks.synthetic import write_run
+
+
+@pytest.fixture
+def enabled():
+    """Profiles the duration of a test."""
+    profiler.enable()
+    yield profiler
+    profiler.disable()
+
+
+@profiled()
+def work(n):
+    profiler.count('items', n)
+    return n
+
+
+class TestProfiling:
+    """A test class which checks the stage timings, counters and trace export."""
+
+    def test_disabled(self):
+        """Tests that nothing is recorded while the profiler is disabled."""
+        local = Profiler()
+        with local.stage('stage'):
+            local.count('items', 3)
+        assert local.events == [] and not local.counters
+        assert work(2) == 2
+
+    def test_stages_and_counters(self, enabled):
+        """Tests the per-stage breakdown of profiled functions."""
+        work(2)
+        work(3)
+        summary = enabled.summary()
+        assert summary['stages']['work']['calls'] == 2
+        assert summary['counters'] == {'items': 5}
+        assert summary['peak_rss_mb'] > 0
+        assert 'work' in enabled.format_summary()
+
+    def test_reader(self, enabled, tmp_path):
+        """Tests the instrumentation of the Reader on a synthetic run."""
+        run_path = write_run(str(tmp_path), 20, 'mzml', peaks=10, compression=False)[0]
+        Reader(run_path).analyse_spectrum()
+        summary = enabled.summary()
+        assert list(summary['stages']) == ['Reader.parse_file', 'Reader.get_compression',
+                                           'Reader.get_binary_spectrum_values', 'Reader.decode_decompress',
+                                           'Reader.get_values']
+        assert summary['counters']['spectra'] == 20
+        assert summary['counters']['bytes_decoded'] == 20 * 10 * 8 * 2
+        assert summary['spectra_per_second'] > 0
+
+    def test_chrome_trace(self, enabled, tmp_path):
+        """Tests the Chrome trace export."""
+        work(1)
+        path = str(tmp_path / 'trace.json')
+        enabled.save(path)
+        with open(path) as f:
+            trace = json.load(f)
+        events = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+        assert events[0]['name'] == 'work' and events[0]['dur'] >= 0
+        assert trace['otherData']['summary']['counters'] == {'items': 1}
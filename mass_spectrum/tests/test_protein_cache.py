@@ -0,0 +1,100 @@
+""" Protein cache module tests. """
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from ms_package.protein_cache import ProteinCache, PROTEIN_COLUMNS
+from ms_package.protein_prediction import ProteinSearch
+from .mock_api import MockProteinsAPI
+
+
+def make_protein_df(peptides):
+    """Creates protein identification values in the format of ProteinSearch.parse_content."""
+    return pd.DataFrame([[pep, f"P{i:05d}", 9913, "PeptideAtlas", "3 to 10", f"MK{pep}R"]
+                         for i, pep in enumerate(peptides)], columns=PROTEIN_COLUMNS)
+
+
+class TestProteinCache:
+    """Unit tests for ProteinCache class"""
+
+    def test_lookup_upsert(self, tmp_path):
+        """Checks that stored peptides are found, missing peptides are reported and re-inserts do not duplicate."""
+        cache = ProteinCache(path=tmp_path / "cache.sqlite")
+        cache.upsert(make_protein_df(["DLGEEHFK", "AEFVEVTK"]), ["DLGEEHFK", "AEFVEVTK", "NOHITK"])
+        cache.upsert(make_protein_df(["DLGEEHFK"]), ["DLGEEHFK"])
+
+        cached_df, missing = cache.lookup(["YLYEIAR", "AEFVEVTK", "DLGEEHFK", "NOHITK", "DLGEEHFK"])
+        assert missing == ["YLYEIAR"]
+        assert list(cached_df.columns) == PROTEIN_COLUMNS
+        assert list(cached_df["Peptide"]) == ["AEFVEVTK", "DLGEEHFK"]
+        assert cached_df["Sequence"].iloc[1] == "MKDLGEEHFKR"
+
+    def test_eviction(self, tmp_path):
+        """Checks the TTL and size based eviction."""
+        cache = ProteinCache(path=tmp_path / "cache.sqlite", max_peptides=2)
+        for pep in ["AAAK", "CCCK", "DDDK"]:
+            cache.upsert(make_protein_df([pep]), [pep])
+            time.sleep(0.01)
+        assert cache.lookup(["AAAK", "CCCK", "DDDK"])[1] == ["AAAK"]
+
+        cache = ProteinCache(path=tmp_path / "cache.sqlite", ttl=0)
+        assert cache.lookup(["CCCK", "DDDK"])[1] == ["CCCK", "DDDK"]
+
+    def test_concurrent_writes(self, tmp_path):
+        """Checks that several workers can write to the same cache."""
+        path = tmp_path / "cache.sqlite"
+        peptides = [f"PEPTIDE{i}K" for i in range(40)]
+
+        def write(pep):
+            ProteinCache(path=path).upsert(make_protein_df([pep]), [pep])
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(write, peptides))
+        cached_df, missing = ProteinCache(path=path).lookup(peptides)
+        assert missing == []
+        assert len(cached_df) == 40
+
+    def test_get_proteins_uses_cache(self, tmp_path):
+        """Checks that ProteinSearch only queries peptides missing from the cache."""
+        cache = ProteinCache(path=tmp_path / "cache.sqlite")
+        with MockProteinsAPI() as mock:
+            pro = ProteinSearch(peptide_list=["DLGEEHFK"], api_url=mock.url, cache=cache)
+            pro.get_proteins()
+            pro = ProteinSearch(peptide_list=["AEFVEVTK", "DLGEEHFK"], api_url=mock.url, cache=cache)
+            pro.get_proteins()
+        assert len(mock.requests) == 2
+        assert mock.requests[1]["peptide"] == ["AEFVEVTK"]
+        assert list(pro.ans_df["Peptide"]) == ["AEFVEVTK", "DLGEEHFK"]
+
+    def test_claims(self, tmp_path):
+        """Checks that peptides claimed by one worker are left to it until released or expired."""
+        cache = ProteinCache(path=tmp_path / "cache.sqlite")
+        assert cache.claim(["AAAK", "CCCK", "AAAK"], "first") == ["AAAK", "CCCK"]
+        assert cache.claim(["CCCK", "DDDK"], "second") == ["DDDK"]
+        cache.upsert(make_protein_df(["CCCK"]), ["AAAK", "CCCK"])
+        cache.release("first")
+        cached_df, missing = cache.wait(["AAAK", "CCCK"])
+        assert missing == [] and list(cached_df["Peptide"]) == ["CCCK"]
+
+        cache = ProteinCache(path=tmp_path / "cache.sqlite", claim_timeout=0)
+        assert cache.claim(["DDDK"], "third") == ["DDDK"]
+
+    def test_concurrent_get_proteins(self, tmp_path):
+        """Checks that concurrent searches of the same peptides query every peptide only once."""
+        path = tmp_path / "cache.sqlite"
+        peptides = [f"PEPTIDE{i}K" for i in range(30)]
+
+        def search(shift):
+            pro = ProteinSearch(peptide_list=peptides[shift:] + peptides[:shift], api_url=mock.url,
+                                cache=ProteinCache(path=path))
+            pro.get_proteins()
+            return pro.ans_df
+
+        with MockProteinsAPI() as mock:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(search, [0, 10, 20, 5]))
+        queried = [pep for request in mock.requests for pep in request["peptide"][0].split(",")]
+        assert sorted(queried) == sorted(peptides)
+        assert all(sorted(df["Peptide"]) == sorted(peptides) for df in results)
@@ -1,13 +1,13 @@
 """ Protein Prediction module tests. """
 
 import os
-import json
 
 import pandas as pd
 import pytest
 
 from ms_package.startup import DATA_DIR
 from ms_package.protein_prediction import ProteinSearch
+from ms_package.protein_cache import ProteinCache
 from ms_package.peptide_prediction import PeptideSearch
 from .constants import TEST_FASTA_FILE, TEST_MZML_FILE
 
@@ -52,10 +52,11 @@ class TestProteinSearch:
         assert query == ans
 
     def test_file_handle(self):
-        """Checks if a data file is created"""
+        """Checks if a cache database is created"""
         pro = ProteinSearch(peptide_list=peptide_list)
-        pro.file_handle()
-        assert os.path.exists(os.path.join(DATA_DIR, "proteins", "protein_data.csv")) is True
+        cache = pro.file_handle()
+        assert isinstance(cache, ProteinCache)
+        assert os.path.exists(os.path.join(DATA_DIR, "proteins", "protein_data.sqlite")) is True
 
     def test_proteins_api(self):
         """ Checks the response of The Proteins API
@@ -65,15 +66,13 @@ class TestProteinSearch:
         assert pro.sel_peptides == [["DLGEEHFK"]]
 
         pro.proteins_api()
-        pro_response = pro.protein_response
-        assert isinstance(pro_response, str)
+        records = pro.protein_records
+        assert isinstance(records, dict)
+        first = records["Peptide"].index("DLGEEHFK")
 
-        pro_response_json = json.loads(pro_response)[0]
-
-        assert pro_response_json["features"][0]["peptide"] == "DLGEEHFK"
-        assert pro_response_json["accession"] == "A0A140T897"
-        assert pro_response_json["taxid"] == 9913
-        assert f"{pro_response_json['features'][0]['begin']}-{pro_response_json['features'][0]['end']}" == "37-44"
+        assert records["Protein_Accession"][first] == "A0A140T897"
+        assert records["Taxonomy_ID"][first] == 9913
+        assert records["Peptide Position"][first] == "37 to 44"
 
     def test_get_proteins(self):
         """Check the wrapper function
@@ -85,7 +84,7 @@ class TestProteinSearch:
         assert pro.ans_df["Peptide"].unique() == ["DLGEEHFK"]
 
         # test full API condition
-        os.remove(os.path.join(DATA_DIR, "proteins", "protein_data.csv"))  # delete cache database
+        ProteinCache().clear()  # delete cache database
         pro = ProteinSearch(peptide_list=["DLGEEHFK"])
         pro.get_proteins()
         assert isinstance(pro.ans_df, pd.DataFrame)
@@ -0,0 +1,76 @@
+""" Proteins API client tests. """
+
+import time
+
+import pytest
+import requests
+
+from ms_package.proteins_api import ProteinsAPIClient, TokenBucket
+from ms_package.protein_prediction import ProteinSearch
+from .mock_api import MockProteinsAPI
+
+
+class TestProteinsAPIClient:
+    """Unit tests for the ProteinsAPIClient and TokenBucket classes against a local mock server."""
+
+    def test_fetch_all_keeps_order(self):
+        """Checks that concurrent responses are returned in the order of the queries."""
+        queries = [f"PEPTIDE{i}K%2CPEPTIDE{i}R" for i in range(20)]
+        with MockProteinsAPI() as mock:
+            client = ProteinsAPIClient(url=mock.url, max_workers=8, rate=1000)
+            responses = client.fetch_all(queries)
+            client.close()
+        assert len(responses) == 20
+        for i, r in enumerate(responses):
+            assert [entry["features"][0]["peptide"] for entry in r.json()] == [f"PEPTIDE{i}K", f"PEPTIDE{i}R"]
+
+    def test_fetch_retries(self):
+        """Checks that rate limiting and server errors are retried."""
+        with MockProteinsAPI(failures=2, failure_status=429) as mock:
+            client = ProteinsAPIClient(url=mock.url, rate=1000, backoff_factor=0)
+            r = client.fetch("DLGEEHFK")
+        assert r.json()[0]["features"][0]["peptide"] == "DLGEEHFK"
+        assert len(mock.requests) == 3
+
+        with MockProteinsAPI(failures=5, failure_status=503) as mock:
+            client = ProteinsAPIClient(url=mock.url, rate=1000, retries=2, backoff_factor=0)
+            with pytest.raises(requests.HTTPError):
+                client.fetch("DLGEEHFK")
+        assert len(mock.requests) == 3
+
+    def test_multiple_chunks(self):
+        """Checks that responses of several chunks are parsed into one table with a row per matching feature."""
+        peptides = [f"PEPTIDE{i}K" for i in range(40)]
+        with MockProteinsAPI() as mock:
+            pro = ProteinSearch(peptide_list=peptides, api_url=mock.url)
+            pro.divide_into_chunks(peptides)
+            pro.proteins_api()
+        df = pro.parse_content()
+        assert len(mock.requests) == 3
+        assert list(df["Peptide"]) == peptides
+        assert df["Peptide Position"].iloc[0] == "3 to 11"
+
+        pro = ProteinSearch(peptide_list=["AAAK"])
+        entry = {"accession": "P1", "taxid": 9606, "sequence": "MAAAKCCCKR",
+                 "features": [{"peptide": "AAAK", "begin": "2", "end": "5",
+                               "evidences": [{"source": {"name": "MaxQB"}}, {"source": {"name": "EPD"}}]},
+                              {"peptide": "CCCK", "begin": "6", "end": "9", "evidences": []}]}
+        pro.add_response([entry], ["AAAK", "CCCK"])
+        assert pro.protein_records["Peptide"] == ["AAAK", "CCCK"]
+        assert pro.protein_records["Data Source"] == ["MaxQB,EPD", ""]
+
+    def test_token_bucket(self):
+        """Checks that the token bucket limits the request rate after the initial burst."""
+        bucket = TokenBucket(rate=50, capacity=1)
+        start = time.monotonic()
+        for _ in range(11):
+            bucket.acquire()
+        assert time.monotonic() - start >= 0.18
+
+    def test_protein_search_api_url(self):
+        """Checks that ProteinSearch queries the configured endpoint."""
+        with MockProteinsAPI() as mock:
+            pro = ProteinSearch(peptide_list=["DLGEEHFK"], api_url=mock.url)
+            pro.divide_into_chunks(["DLGEEHFK"])
+            pro.proteins_api()
+        assert pro.protein_records["Peptide"] == ["DLGEEHFK"]
@@ -0,0 +1,81 @@
+"""Multi-run label-free quantification tests."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ms_package.quantification import PROTON, align, fit_alignment, isotonic, load_matrix, quantify, run_name, \
+    save_matrix
+from ms_package.benchmarks.synthetic import peptide_features, peptide_mass, write_mzml, write_run
+
+RUNS = [(1.0, 0.0), (1.1, 5.0), (0.95, 10.0)]  # retention time scale and offset of every run
+
+
+class TestQuantification:
+    """A test class which checks retention time alignment and XIC quantification across runs."""
+
+    def test_isotonic(self):
+        """Tests that violators are pooled to their weighted mean."""
+        assert np.allclose(isotonic(np.array([1.0, 3.0, 2.0, 4.0])), [1.0, 2.5, 2.5, 4.0])
+        assert np.allclose(isotonic(np.array([3.0, 1.0]), np.array([1.0, 3.0])), [1.5, 1.5])
+        assert np.allclose(isotonic(np.arange(5.0)), np.arange(5.0))
+
+    def test_align(self):
+        """Tests that a shifted and stretched run is mapped onto the reference and back, shifted by the offset
+        of the nearest end outside of the shared identifications."""
+        reference = np.linspace(10, 100, 20)
+        rt = reference * 1.1 + 5
+        knots = fit_alignment(rt, reference)
+        assert np.allclose(align(rt, knots), reference)
+        assert np.allclose(align(np.array([50.0, 0.0, 500.0]), knots, inverse=True), [60.0, 6.0, 515.0])
+        identity = fit_alignment(np.zeros(0), np.zeros(0))
+        assert np.allclose(align(np.array([1.0, 2.0]), identity), [1.0, 2.0])
+
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_quantify(self, tmp_path, workers):
+        """Tests that peptides of equal abundance in shifted runs get equal areas, also where they were only
+        identified in other runs, and that the matrix survives a save and load."""
+        _, _, peptides = write_run(str(tmp_path), 10, proteins=2, seed=1)
+        elution, _, charge, _, _ = peptide_features(peptides, 400.0, 3)
+        # peptides eluting well inside every run, each identified in all but one of them
+        inside = np.flatnonzero((elution > 60) & (elution < 300))
+        paths, rows = list(), list()
+        for number, (scale, offset) in enumerate(RUNS):
+            path = str(tmp_path / f'run{number}.mzML')
+            write_mzml(path, 800, peaks=20, peptides=peptides, seed=number, isotopes=3, rt_scale=scale,
+                       rt_offset=offset)
+            paths.append(path)
+            for i in inside[inside % len(RUNS) != number]:
+                mz = (peptide_mass(peptides[i]) + charge[i] * PROTON) / charge[i]
+                rows.append((run_name(path), peptides[i], charge[i], mz, elution[i] * scale + offset))
+        matrix = quantify(paths, pd.DataFrame(rows, columns=['run', 'peptide', 'charge', 'm/z', 'rt']),
+                          workers=workers)
+        assert len(matrix) == len(inside)
+        assert (matrix['identifications'] == len(RUNS) - 1).all()
+        areas = matrix[[run_name(path) for path in paths]].to_numpy()
+        assert areas.dtype == np.float32
+        assert np.all(areas > 0)
+        assert np.median(areas.std(axis=1) / areas.mean(axis=1)) < 0.05
+
+        save_matrix(str(tmp_path / 'matrix.npz'), matrix)
+        loaded = load_matrix(str(tmp_path / 'matrix.npz'))
+        assert list(loaded.columns) == list(matrix.columns)
+        assert np.array_equal(loaded[matrix.columns[-1]], matrix[matrix.columns[-1]])
+        assert list(loaded['peptide']) == list(matrix['peptide'])
+
+    def test_unknown_run(self, tmp_path):
+        """Tests that identifications of runs that are not quantified are refused."""
+        identifications = pd.DataFrame([('other', 'PEPTIDE', 2, 400.0, 10.0)],
+                                       columns=['run', 'peptide', 'charge', 'm/z', 'rt'])
+        with pytest.raises(ValueError):
+            quantify([str(tmp_path / 'run.mzML')], identifications)
+
+    def test_duplicate_run_names(self, tmp_path):
+        """Tests that runs with the same file name are refused unless they are given unique names."""
+        identifications = pd.DataFrame([('first', 'PEPTIDE', 2, 400.0, 10.0)],
+                                       columns=['run', 'peptide', 'charge', 'm/z', 'rt'])
+        paths = [str(tmp_path / 'a' / 'run.mzML'), str(tmp_path / 'b' / 'run.mzML.gz')]
+        with pytest.raises(ValueError, match='same name'):
+            quantify(paths, identifications)
+        with pytest.raises(ValueError):
+            quantify(paths, identifications, names=['first'])
@@ -1,6 +1,7 @@
 """Reader module tests."""
 
 import pytest
+import numpy as np
 import pandas as pd
 from ms_package.reader import Reader
 import xml.dom.minidom
@@ -106,21 +107,67 @@ class TestReader:
         list1 = test1.get_spectrum_list(file1)
         dict1 = test1.get_spectrum_dict(list1)
         values1 = test1.get_values(dict1)
-        assert isinstance(values1, dict)
-        assert len(values1[0]) == 6
+        assert isinstance(values1, pd.DataFrame)
         keys = ['spectra_id', 'base_peak_m/z', 'base_peak_intensity', 'total_ion_current', 'lowest_observed_m/z',
                 'highest_observed_m/z']
-        assert keys == list(values1[0].keys())
+        assert keys == list(values1.columns)
+        assert values1['spectra_id'].dtype == np.int32
+        assert values1['base_peak_intensity'].dtype == np.float32
         id0 = {'spectra_id': 0,
                'base_peak_m/z': 391.28,
                'base_peak_intensity': 928844.25,
                'total_ion_current': 6937649.0,
                'lowest_observed_m/z': 300.0,
                'highest_observed_m/z': 2008.46}
-        assert values1[0] == id0
-        assert test1.values == values1
+        assert values1.loc[0].to_dict() == pytest.approx(id0)
+        assert test1.values is values1
+
+    def test_get_values_empty_and_cv_params(self, tmp_path):
+        """Tests that empty spectra keep their spectrum id with missing values, and that the values are read from
+        the cvParams of files written by pyopenms."""
+        from pyopenms import MSExperiment, MSSpectrum, MzMLFile
+
+        experiment = MSExperiment()
+        for peaks in ([100.0, 200.5], [], [300.0]):
+            spectrum = MSSpectrum()
+            spectrum.set_peaks((np.array(peaks), np.ones(len(peaks))))
+            if peaks:
+                for name, value in (('base peak m/z', peaks[0]), ('base peak intensity', 1.0),
+                                    ('total ion current', float(len(peaks))), ('lowest observed m/z', peaks[0]),
+                                    ('highest observed m/z', peaks[-1])):
+                    spectrum.setMetaValue(name, value)
+            experiment.addSpectrum(spectrum)
+        path = str(tmp_path / 'written.mzML')
+        MzMLFile().store(path, experiment)
+        values = Reader(path).analyse_spectrum()
+        assert values['spectra_id'].tolist() == [0, 1, 2]
+        assert values['highest_observed_m/z'].tolist()[::2] == [200.5, 300.0]
+        assert values.loc[1, 'base_peak_m/z':].isna().all()
+        assert values['total_ion_current'].tolist()[::2] == [2.0, 1.0]
 
     def test_analyse_spectrum(self):
         """Tests whether the wrapper method analyse_spectrum returns a pandas dataframe."""
         result1 = test1.analyse_spectrum()
         assert isinstance(result1, pd.DataFrame)
+
+    def test_get_scan_times(self):
+        """Tests whether the retention times are extracted in seconds for mzML and mzXML files."""
+        file1 = test1.parse_file()
+        dict1 = test1.get_spectrum_dict(test1.get_spectrum_list(file1))
+        times1 = test1.get_scan_times(dict1)
+        assert len(times1) == 1684
+        assert all(isinstance(rt, float) for rt in times1.values())
+        file2 = test2.parse_file()
+        dict2 = test2.get_spectrum_dict(test2.get_spectrum_list(file2))
+        times2 = test2.get_scan_times(dict2)
+        assert len(times2) == 7161
+        assert list(times2.values()) == sorted(times2.values())
+
+    def test_get_spectrum_arrays(self):
+        """Tests whether the decoded spectra are concatenated into flat arrays with correct offsets."""
+        test1.analyse_spectrum()
+        keys, mz, intensity, offsets = test1.get_spectrum_arrays()
+        assert len(keys) == 1684
+        assert len(offsets) == 1685
+        assert len(mz) == len(intensity) == offsets[-1]
+        assert list(mz[offsets[0]:offsets[1]]) == list(test1.spectrum_data[0]['mz'])
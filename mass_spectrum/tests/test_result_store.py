@@ -0,0 +1,58 @@
+"""Shared result store tests."""
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ms_package.result_store import ResultStore, file_digest
+
+
+class TestResultStore:
+    """A test class which checks that results are computed once and written atomically."""
+
+    def test_file_digest(self, tmp_path):
+        """Tests that copies of a file at other paths have the same digest and changed files a new one."""
+        first, second = tmp_path / 'first.mzML', tmp_path / 'second.mzML'
+        first.write_text('spectra')
+        second.write_text('spectra')
+        assert file_digest(str(first)) == file_digest(str(second))
+        second.write_text('other spectra')
+        assert file_digest(str(first)) != file_digest(str(second))
+
+    def test_compute_once(self, tmp_path):
+        """Tests that concurrent requests of the same result wait for the first computation."""
+        store = ResultStore(tmp_path / 'store')
+        key = store.key('spectrum values', 'abc')
+        calls = list()
+        lock = threading.Lock()
+
+        def fill(path):
+            with lock:
+                calls.append(path)
+            time.sleep(0.1)
+            with open(os.path.join(path, 'values.txt'), 'w') as f:
+                f.write('values')
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            paths = list(executor.map(lambda _: store.compute(key, fill), range(4)))
+        assert len(calls) == 1
+        assert len(set(paths)) == 1 and paths[0] == store.get(key)
+        assert open(os.path.join(paths[0], 'values.txt')).read() == 'values'
+        assert store.key('spectrum values', 'abc') != store.key('spectrum values', 'abd')
+
+    def test_failed_compute(self, tmp_path):
+        """Tests that a failed computation leaves no partial result behind."""
+        store = ResultStore(tmp_path / 'store')
+        key = store.key('peptide search')
+
+        def fill(path):
+            open(os.path.join(path, 'hits.pkl'), 'w').close()
+            raise RuntimeError('search failed')
+
+        with pytest.raises(RuntimeError):
+            store.compute(key, fill)
+        assert store.get(key) is None
+        assert [name for name in os.listdir(os.path.dirname(store.path(key))) if name.endswith('.tmp')] == []